@@ -0,0 +1,125 @@
+# api/analytics.py
+"""
+Sales analytics read from the daily rollup tables (DailyVariantSales,
+DailyCustomerSales) instead of Invoice and InvoiceItem, so a report costs the
+same however many invoices there are. The rollups are kept current by the
+invoice write paths (see the models); rebuild_rollups() recomputes them.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncMonth
+from rest_framework.exceptions import ValidationError
+
+from .exports import parse_date_range
+from .models import DailyCustomerSales, DailyVariantSales, Invoice, InvoiceItem, Product
+
+BATCH_SIZE = 1000
+
+PERIODS = ('day', 'month')
+MAX_LIMIT = 100
+
+
+def sales_invoices():
+    """Invoices that count as sales (see Invoice.counts_as_sale)."""
+    return Invoice.objects.filter(type='invoice').exclude(status__in=Invoice.NON_SALE_STATUSES)
+
+
+def in_range(rows, start, end):
+    if start:
+        rows = rows.filter(date__gte=start)
+    if end:
+        rows = rows.filter(date__lte=end)
+    return rows
+
+
+def rebuild_rollups(start=None, end=None):
+    """
+    Recompute both rollups for invoice dates in [start, end] (all dates by default).
+    Returns the number of (variant, customer) rollup rows in the range.
+    """
+    invoices = in_range(sales_invoices(), start, end)
+    with transaction.atomic():
+        in_range(DailyVariantSales.objects.all(), start, end).delete()
+        in_range(DailyCustomerSales.objects.all(), start, end).delete()
+        variants = InvoiceItem.objects.filter(invoice__in=invoices).values(
+            'product_id', 'variant_id', day=F('invoice__date'),
+        ).annotate(sold=Sum('quantity'), amount=Sum('total_price')).order_by()
+        DailyVariantSales.objects.bulk_create((
+            DailyVariantSales(
+                date=row['day'], product_id=row['product_id'], product_variant_id=row['variant_id'],
+                units=row['sold'], revenue=row['amount'],
+            )
+            for row in variants.iterator()
+        ), batch_size=BATCH_SIZE)
+        customers = invoices.values('date', 'customer_id').annotate(
+            count=Count('pk'), subtotal_sum=Sum('subtotal'), tax_sum=Sum('tax'), total_sum=Sum('total'),
+        ).order_by()
+        DailyCustomerSales.objects.bulk_create((
+            DailyCustomerSales(
+                date=row['date'], customer_id=row['customer_id'], invoice_count=row['count'],
+                subtotal=row['subtotal_sum'], tax=row['tax_sum'], revenue=row['total_sum'],
+            )
+            for row in customers.iterator()
+        ), batch_size=BATCH_SIZE)
+    return (
+        in_range(DailyVariantSales.objects.all(), start, end).count(),
+        in_range(DailyCustomerSales.objects.all(), start, end).count(),
+    )
+
+
+def report_range(params):
+    """The ?start=/&end= of a report as dates, raising ValidationError on bad input."""
+    try:
+        return parse_date_range(params.get('start'), params.get('end'))
+    except ValueError as e:
+        raise ValidationError({'date': str(e)})
+
+
+def report_limit(params, default=10):
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def sales_by_period(params):
+    """Invoices, subtotal, tax and revenue per day or per month (?period=)."""
+    period = params.get('period', 'day')
+    if period not in PERIODS:
+        raise ValidationError({'period': f"Must be one of: {list(PERIODS)}"})
+    rows = in_range(DailyCustomerSales.objects.all(), *report_range(params))
+    if period == 'month':
+        rows = rows.annotate(period=TruncMonth('date'))
+    else:
+        rows = rows.annotate(period=F('date'))
+    return list(rows.values('period').annotate(
+        invoices=Sum('invoice_count'), subtotal=Sum('subtotal'), tax=Sum('tax'), revenue=Sum('revenue'),
+    ).order_by('period'))
+
+
+def top_products(params):
+    """
+    Best sellers by revenue, per product or per variant (?by=variant). Sales of deleted products stay in
+    the rollups and are listed with product_name None.
+    """
+    by = params.get('by', 'product')
+    if by not in ('product', 'variant'):
+        raise ValidationError({'by': "Must be 'product' or 'variant'."})
+    fields = ['product_id']
+    if by == 'variant':
+        fields += ['product_variant_id', 'product_variant__size', 'product_variant__color']
+    # A subquery rather than product__name: the non-null product FK would be an inner join.
+    product_name = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('name')[:1])
+    rows = in_range(DailyVariantSales.objects.all(), *report_range(params))
+    return list(rows.values(*fields, product_name=product_name).annotate(
+        units=Sum('units'), revenue=Sum('revenue'),
+    ).order_by('-revenue', 'product_id')[:report_limit(params)])
+
+
+def top_customers(params):
+    """Customers by revenue."""
+    rows = in_range(DailyCustomerSales.objects.filter(customer__isnull=False), *report_range(params))
+    return list(rows.values('customer_id', 'customer__first_name', 'customer__last_name').annotate(
+        invoices=Sum('invoice_count'), tax=Sum('tax'), revenue=Sum('revenue'),
+    ).order_by('-revenue', 'customer_id')[:report_limit(params)])
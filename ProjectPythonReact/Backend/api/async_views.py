@@ -0,0 +1,130 @@
+# api/async_views.py
+"""
+Async versions of read-heavy endpoints, for ASGI deployments (iicm/asgi.py).
+
+The views in api/views.py hold a worker thread for the whole request. These
+GET-only counterparts await the ORM, so one slow aggregate does not hold up
+other requests, and they send the same responses as their sync versions.
+
+Django's async ORM runs the queries of one request one after another on that
+request's sync thread. gather() runs independent sub-queries concurrently
+instead, each on its own worker thread and database connection.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import conditional_get
+from .middleware import request_query_timer
+from .models import Product, Shelf, StockOccupancy, Warehouse
+from .serializers import ProductSerializer, ShelfSerializer, WarehouseSerializer, requested_expansions
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def async_api_view(view):
+    """Async counterpart of @api_view(['GET']) with @permission_classes([IsAuthenticated])."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return render({'detail': f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+        authenticators = [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        request = Request(request, authenticators=authenticators)
+        try:
+            # Token validation and the user lookup use the sync ORM.
+            authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        except APIException as e:
+            authenticated, detail = False, e.detail
+        else:
+            detail = 'Authentication credentials were not provided.'
+        if not authenticated:
+            response = render({'detail': detail}, status.HTTP_401_UNAUTHORIZED)
+            if authenticators:
+                response['WWW-Authenticate'] = authenticators[0].authenticate_header(request)
+            return response
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def on_own_connection(query):
+    def run():
+        timer = request_query_timer.get()
+        try:
+            if timer is None:
+                return query()
+            with connection.execute_wrapper(timer):
+                return query()
+        finally:
+            # Worker threads are reused: their connections follow CONN_MAX_AGE like a request's.
+            close_old_connections()
+    return run
+
+
+async def gather(*queries):
+    """Run the sync callables `queries` concurrently, each on its own thread and connection; returns their results in order."""
+    return await asyncio.gather(*(sync_to_async(on_own_connection(query), thread_sensitive=False)() for query in queries))
+
+
+def shelf_counts(warehouses):
+    return dict(warehouses.values_list('warehouse').annotate(count=Count('pk')).order_by())
+
+
+def occupancy_totals(warehouses):
+    return dict(warehouses.values_list('warehouse').annotate(total=Sum('quantity')).order_by())
+
+
+# Warehouses: rows, shelf counts and stock totals are three concurrent queries
+@async_api_view
+async def warehouse_list(request):
+    warehouses, shelves, totals = await gather(
+        lambda: list(Warehouse.objects.all()),
+        lambda: shelf_counts(Shelf.objects.all()),
+        lambda: occupancy_totals(StockOccupancy.objects.all()),
+    )
+    for warehouse in warehouses:
+        warehouse.shelf_total = shelves.get(warehouse.pk, 0)
+        warehouse.occupancy_total = totals.get(warehouse.pk)
+    return render(WarehouseSerializer(warehouses, many=True).data)
+
+@async_api_view
+async def warehouse_detail(request, pk):
+    try:
+        warehouse, shelves, totals = await gather(
+            lambda: Warehouse.objects.get(pk=pk),
+            lambda: shelf_counts(Shelf.objects.filter(warehouse_id=pk)),
+            lambda: occupancy_totals(StockOccupancy.objects.filter(warehouse_id=pk)),
+        )
+    except Warehouse.DoesNotExist:
+        return render({'detail': 'Warehouse not found'}, status.HTTP_404_NOT_FOUND)
+    warehouse.shelf_total = shelves.get(warehouse.pk, 0)
+    warehouse.occupancy_total = totals.get(warehouse.pk)
+    return render(WarehouseSerializer(warehouse).data)
+
+@async_api_view
+async def shelf_list(request):
+    shelves = [shelf async for shelf in ShelfSerializer.setup_eager_loading(Shelf.objects.all())]
+    return render(ShelfSerializer(shelves, many=True).data)
+
+# Products
+@async_api_view
+@conditional_get('products')
+async def product_detail(request, pk):
+    products = ProductSerializer.setup_eager_loading(Product.objects.all(), requested_expansions(request))
+    try:
+        product = await products.aget(pk=pk)
+    except Product.DoesNotExist:
+        return render({'detail': 'Product not found'}, status.HTTP_404_NOT_FOUND)
+    # Fields outside the requested expansions may still load lazily, which needs the sync ORM.
+    data = await sync_to_async(lambda: ProductSerializer(product, context={'request': request}).data)()
+    return render(data)
@@ -0,0 +1,158 @@
+# api/cache.py
+"""
+Response cache and conditional GET for the API views.
+
+Cached GET responses are stored in the `api` cache (see CACHES in settings):
+local memory by default, which evicts least-recently-used entries past
+MAX_ENTRIES and expires them after TIMEOUT seconds.
+
+Every namespace ('products', 'categories', ...) has a version number that is
+part of the cache key. The versions are rows of the response_cache_version
+table (api.models.ResponseCacheVersion), so every worker process and
+management command sees the same ones. A change moves the namespace to a new
+version in the writer's transaction, so the new version becomes visible with
+the data it describes, on commit. Entries of older versions are never read
+again and age out of the cache.
+
+On SQLite, triggers created by migration 0015 bump the versions on every
+insert, update and delete of the tables a namespace reads, including bulk
+writes, queryset updates and raw SQL. Other databases rely on the model
+signals (api/signals.py) and the bulk write paths that bypass signals calling
+invalidate().
+
+The version is at least the time of the namespace's last change in
+microseconds, so it also serves as the ETag and Last-Modified of the views
+that read from it (conditional_get), and unchanged resources are answered with
+304 after a single query, before any serialization runs.
+"""
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.views.decorators.http import condition
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import REGISTRY
+
+CACHE_ALIAS = getattr(settings, 'API_RESPONSE_CACHE_ALIAS', 'api')
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def is_tracked():
+    """Whether database triggers keep the namespace versions (migration 0015)."""
+    return connection.vendor == 'sqlite'
+
+
+def get_versions(namespaces, request=None):
+    """
+    Current versions of `namespaces`, 0 for a namespace that never changed. With `request`, the versions
+    are read once per request, so the cache key and the validators of a response agree.
+    """
+    # api.models imports this module.
+    from .models import ResponseCacheVersion
+
+    loaded = getattr(request, '_response_cache_versions', None)
+    if loaded is None:
+        loaded = {}
+    missing = [namespace for namespace in namespaces if namespace not in loaded]
+    if missing:
+        versions = dict(ResponseCacheVersion.objects.filter(namespace__in=missing).values_list('namespace', 'version'))
+        loaded.update((namespace, versions.get(namespace, 0)) for namespace in missing)
+        if request is not None:
+            request._response_cache_versions = loaded
+    return [loaded[namespace] for namespace in namespaces]
+
+
+def get_version(namespace, request=None):
+    return get_versions([namespace], request)[0]
+
+
+def invalidate(*namespaces, force=False):
+    """
+    Drop the cached responses of `namespaces`: move each to a version above both its current one and
+    the current time. Inside a transaction the new versions are committed or rolled back with it.
+    With `force`, also where triggers keep the versions, for writes to tables they do not watch.
+    """
+    from .models import ResponseCacheVersion
+
+    namespaces = sorted(set(namespaces))
+    for namespace in namespaces:
+        REGISTRY.increment('api_response_cache_invalidations_total', namespace)
+    if is_tracked() and not force:
+        return  # the triggers have moved the versions with the change itself
+    now = time.time_ns() // 1000
+    updated = ResponseCacheVersion.objects.filter(namespace__in=namespaces).update(
+        version=Greatest(F('version') + 1, Value(now))
+    )
+    if updated < len(namespaces):
+        ResponseCacheVersion.objects.bulk_create(
+            [ResponseCacheVersion(namespace=namespace, version=now) for namespace in namespaces],
+            ignore_conflicts=True,
+        )
+
+
+def cached_get(namespace):
+    """Serve successful GET responses of a view from the response cache, keyed by full path and query string."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = f'api-response:{namespace}:{get_version(namespace, request)}:{request.get_full_path()}'
+            data = cache.get(key)
+            if data is not None:
+                REGISTRY.increment('api_response_cache_hits_total', namespace)
+                return Response(data, status=status.HTTP_200_OK)
+
+            response = view(request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, timeout=getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+                REGISTRY.increment('api_response_cache_misses_total', namespace)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_get(*namespaces):
+    """
+    Add ETag and Last-Modified to GET and HEAD responses of a view from the versions of `namespaces`,
+    and answer If-None-Match / If-Modified-Since with 304 Not Modified. Writes are passed through
+    untouched, so their preconditions are not checked against the read validators.
+    """
+    def etag(request, *args, **kwargs):
+        return '-'.join(str(version) for version in get_versions(namespaces, request))
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(max(get_versions(namespaces, request)) / 1e6, tz=timezone.utc)
+
+    def decorator(view):
+        conditional = condition(etag_func=etag, last_modified_func=last_modified)(view)
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                # condition() calls the validators on the event loop, where the ORM is not allowed.
+                await sync_to_async(get_versions)(namespaces, request)
+                return await conditional(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(request, *args, **kwargs)
+                return conditional(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,53 @@
+# api/db.py
+"""
+Write serialization on SQLite.
+
+The production database profile (iicm/settings.py) opens every atomic()
+block with BEGIN IMMEDIATE. The write lock is taken when the transaction
+starts, so concurrent writers queue for it, waiting up to the `timeout`
+option, instead of failing with "database is locked" when a transaction
+that has read tries to start writing.
+
+retry_when_locked() re-runs a whole write that still timed out, a bounded
+number of times with backoff.
+"""
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+from .metrics import REGISTRY
+
+LOCKED_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_locked_error(error):
+    return any(message in str(error) for message in LOCKED_ERRORS)
+
+
+def label(func):
+    owner = getattr(func, '__self__', None)
+    return f'{type(owner).__name__}.{func.__name__}' if owner is not None else func.__qualname__
+
+
+def retry_when_locked(func):
+    """
+    Call `func`, again when the database reports it is locked: up to DATABASE_WRITE_RETRIES more times,
+    DATABASE_WRITE_RETRY_BACKOFF seconds apart, doubling, with jitter. `func` must be safe to repeat: it
+    has to run its own transaction, so nothing is retried inside an outer atomic() block.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = getattr(settings, 'DATABASE_WRITE_RETRIES', 3)
+        backoff = getattr(settings, 'DATABASE_WRITE_RETRY_BACKOFF', 0.05)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == retries or not is_locked_error(e) or connection.in_atomic_block:
+                    raise
+                REGISTRY.increment('api_database_lock_retries_total', label(func))
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
@@ -0,0 +1,113 @@
+# api/exports.py
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import StockMovement, Invoice, Purchase
+
+# Rows fetched from the database per round trip while streaming.
+CHUNK_SIZE = 2000
+
+# dataset name -> (model, date field used by ?start=/&end=, [(column header, values_list lookup)])
+EXPORTS = {
+    'stock-movements': (StockMovement, 'movement_date', [
+        ('id', 'id'),
+        ('movement_date', 'movement_date'),
+        ('movement_type', 'movement_type'),
+        ('product_id', 'product_id'),
+        ('product_name', 'product__name'),
+        ('product_variant_id', 'product_variant_id'),
+        ('warehouse_name', 'warehouse__name'),
+        ('shelf_name', 'shelf__shelf_name'),
+        ('quantity', 'quantity'),
+        ('purchase_id', 'purchase_id'),
+        ('invoice_item_id', 'invoice_item_id'),
+    ]),
+    'invoices': (Invoice, 'date', [
+        ('id', 'id'),
+        ('date', 'date'),
+        ('due_date', 'due_date'),
+        ('type', 'type'),
+        ('status', 'status'),
+        ('customer_id', 'customer_id'),
+        ('customer_first_name', 'customer__first_name'),
+        ('customer_last_name', 'customer__last_name'),
+        ('payment_method', 'payment_method'),
+        ('subtotal', 'subtotal'),
+        ('tax', 'tax'),
+        ('shipping_cost', 'shipping_cost'),
+        ('total', 'total'),
+        ('total_in_riel', 'total_in_riel'),
+    ]),
+    'purchases': (Purchase, 'purchase_date', [
+        ('id', 'id'),
+        ('purchase_date', 'purchase_date'),
+        ('supplier_id', 'supplier_id'),
+        ('supplier_name', 'supplier__name'),
+        ('product_id', 'product_id'),
+        ('product_name', 'product__name'),
+        ('product_variant_id', 'product_variant_id'),
+        ('batch_number', 'batch_number'),
+        ('quantity', 'quantity'),
+        ('purchase_price', 'purchase_price'),
+        ('total', 'total'),
+    ]),
+}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_date_range(start, end):
+    """Parse ?start=/&end= (YYYY-MM-DD, both inclusive); raises ValueError on bad input."""
+    dates = []
+    for value in (start, end):
+        if not value:
+            dates.append(None)
+            continue
+        parsed = parse_date(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date: {value}. Use YYYY-MM-DD.")
+        dates.append(parsed)
+    return dates
+
+
+def export_queryset(dataset, start=None, end=None):
+    model, date_field, columns = EXPORTS[dataset]
+    queryset = model.objects.order_by('pk')
+    is_datetime = model._meta.get_field(date_field).get_internal_type() == 'DateTimeField'
+    # Compare datetimes against day boundaries rather than using __date, so the index can be used.
+    if start:
+        bound = timezone.make_aware(datetime.combine(start, time.min)) if is_datetime else start
+        queryset = queryset.filter(**{f'{date_field}__gte': bound})
+    if end:
+        if is_datetime:
+            queryset = queryset.filter(**{f'{date_field}__lt': timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))})
+        else:
+            queryset = queryset.filter(**{f'{date_field}__lte': end})
+    return queryset.values_list(*[lookup for _, lookup in columns])
+
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+    def write(self, value):
+        return value
+
+
+def stream_rows(dataset, output, start=None, end=None):
+    """Yield the export as CSV or NDJSON lines, reading the rows in chunks from a server-side iterator."""
+    headers = [header for header, _ in EXPORTS[dataset][2]]
+    rows = export_queryset(dataset, start, end).iterator(chunk_size=CHUNK_SIZE)
+    if output == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(headers, row)), default=str) + '\n'
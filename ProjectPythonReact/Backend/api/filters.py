@@ -0,0 +1,72 @@
+# api/filters.py
+from django.db.models import Value
+from django.db.models.functions import Concat, Trim
+from rest_framework.exceptions import ValidationError
+
+from .exports import parse_date_range
+from .models import Invoice
+
+# ?ordering= values accepted by invoice listings; the pk breaks ties in the same direction.
+INVOICE_ORDERINGS = ('date', 'due_date', 'total', 'status', 'id')
+
+# Columns of the flat ?view=summary invoice rows.
+INVOICE_SUMMARY_FIELDS = ('id', 'date', 'due_date', 'type', 'status', 'payment_method', 'total', 'customer_id', 'customer_name')
+
+
+def filter_invoices(queryset, params):
+    """
+    Apply ?status=, ?type=, ?payment_method= (comma-separated), ?customer= and
+    ?start=/&end= (invoice date, YYYY-MM-DD, inclusive). Raises ValidationError on bad values.
+    """
+    choices = {
+        'status': Invoice.STATUS_CHOICES,
+        'type': Invoice.INVOICE_TYPES,
+        'payment_method': Invoice.PAYMENT_METHODS,
+    }
+    for name, allowed in choices.items():
+        values = [value for value in params.get(name, '').split(',') if value]
+        if not values:
+            continue
+        allowed = [choice[0] for choice in allowed]
+        invalid = [value for value in values if value not in allowed]
+        if invalid:
+            raise ValidationError({name: f"Invalid value(s) {invalid}. Must be one of: {allowed}"})
+        queryset = queryset.filter(**{f'{name}__in': values})
+
+    customer = params.get('customer')
+    if customer:
+        if not customer.isdigit():
+            raise ValidationError({'customer': 'Must be a customer id.'})
+        queryset = queryset.filter(customer_id=int(customer))
+
+    try:
+        start, end = parse_date_range(params.get('start'), params.get('end'))
+    except ValueError as e:
+        raise ValidationError({'date': str(e)})
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def invoice_ordering(params):
+    """Keyset ordering for ?ordering=<field> or ?ordering=-<field>; newest first by default."""
+    value = params.get('ordering')
+    if not value:
+        return ('-date', '-pk')
+    descending = value.startswith('-')
+    field = value.lstrip('-')
+    if field not in INVOICE_ORDERINGS:
+        raise ValidationError({'ordering': f"Must be one of: {list(INVOICE_ORDERINGS)}, optionally prefixed with '-'"})
+    prefix = '-' if descending else ''
+    if field == 'id':
+        return (f'{prefix}pk',)
+    return (f'{prefix}{field}', f'{prefix}pk')
+
+
+def invoice_summaries(queryset):
+    """Flat invoice rows with the customer name joined in, as one values() query."""
+    return queryset.annotate(
+        customer_name=Trim(Concat('customer__first_name', Value(' '), 'customer__last_name')),
+    ).values(*INVOICE_SUMMARY_FIELDS)
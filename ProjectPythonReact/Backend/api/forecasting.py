@@ -0,0 +1,153 @@
+# api/forecasting.py
+"""
+Batch demand forecasting.
+
+The daily unit sales of every variant are read from the DailyVariantSales
+rollup (the per-day sums of InvoiceItem over the invoices that count as
+sales) into a dense variant × day matrix, a block of variants at a time, and
+two models are fitted to all rows of a block at once in NumPy:
+
+- simple exponential smoothing, for each factor in ALPHAS: the recursion runs
+  over the days, each step vectorized across the variants;
+- weekly seasonal naive: tomorrow sells what the same weekday sold last week.
+
+Each variant keeps the model with the lowest in-sample one-step mean absolute
+error. Variants without sales in the history get no forecast.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import invalidate as invalidate_cached_responses
+from .db import retry_when_locked
+from .models import DailyVariantSales, DemandForecast, ProductVariant
+from .restock import fetch_columns
+
+ALPHAS = (0.1, 0.3, 0.5)
+SEASON_DAYS = 7
+HISTORY_DAYS = 3 * 365
+HORIZON_DAYS = 28
+BLOCK_SIZE = 5000
+MAX_LIMIT = 500
+
+
+def load_history(variant_ids, start, days):
+    """Units sold by the (sorted) `variant_ids` on each of the `days` days from `start`, as a (variants, days) array."""
+    history = np.zeros((len(variant_ids), days))
+    rows = DailyVariantSales.objects.filter(
+        product_variant_id__gte=int(variant_ids[0]), product_variant_id__lte=int(variant_ids[-1]),
+        date__gte=start, date__lt=start + timedelta(days=days),
+    ).values_list('product_variant_id', 'date', 'units').order_by()
+    sql, params = rows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    if not rows:
+        return history
+    ids, dates, units = zip(*rows)
+    ids = np.array(ids, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(variant_ids, ids), len(variant_ids) - 1)
+    known = variant_ids[positions] == ids  # the range also holds ids deleted since variant_ids was read
+    # SQLite returns ISO date strings, other backends dates; NumPy parses both.
+    offsets = (np.array(dates, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+    # Accumulate: a variant has several rows a day when its sales were recorded under more than one product.
+    np.add.at(history, (positions[known], offsets[known]), np.array(units, dtype=np.float64)[known])
+    return history
+
+
+def fit(history, horizon):
+    """
+    Fit the models to every row of `history` (variants, days).
+    Returns the chosen model per row (an index into ALPHAS, or len(ALPHAS) for seasonal naive),
+    its in-sample MAE and the (variants, horizon) forecasts.
+    """
+    variants, days = history.shape
+    alphas = np.array(ALPHAS)[:, None]
+    by_day = np.ascontiguousarray(history.T)
+    level = np.tile(by_day[0], (len(ALPHAS), 1))
+    errors = np.zeros((len(ALPHAS), variants))
+    for sold in by_day[1:]:
+        error = sold - level
+        errors += np.abs(error)
+        level += alphas * error
+    maes = np.vstack([
+        errors / max(days - 1, 1),
+        np.abs(history[:, SEASON_DAYS:] - history[:, :-SEASON_DAYS]).mean(axis=1)
+        if days > SEASON_DAYS else np.full(variants, np.inf),
+    ])
+    best = maes.argmin(axis=0)
+    rows = np.arange(variants)
+
+    seasonal = best == len(ALPHAS)
+    forecasts = np.repeat(level[np.minimum(best, len(ALPHAS) - 1), rows][:, None], horizon, axis=1)
+    if seasonal.any():
+        last_season = days - SEASON_DAYS + np.arange(horizon) % SEASON_DAYS
+        forecasts[seasonal] = history[seasonal][:, last_season]
+    return best, maes[best, rows], forecasts
+
+
+def forecast_demand(history_days=HISTORY_DAYS, horizon_days=HORIZON_DAYS, today=None, block_size=BLOCK_SIZE):
+    """
+    Replace every DemandForecast with one fitted to the `history_days` before `today`. Returns the number stored.
+    The fit reads outside any transaction; only the replacement of the rows holds the write lock.
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=history_days)
+    variant_ids = fetch_columns(ProductVariant.objects.order_by('pk').values_list('pk'), 1)[:, 0]
+    forecasts = []
+    for offset in range(0, len(variant_ids), block_size):
+        block = variant_ids[offset:offset + block_size]
+        history = load_history(block, start, history_days)
+        sold = history.any(axis=1)
+        if not sold.any():
+            continue
+        block, history = block[sold], history[sold]
+        best, maes, daily = fit(history, horizon_days)
+        forecasts.extend(
+            DemandForecast(
+                product_variant_id=int(variant_id),
+                method='seasonal_naive' if choice == len(ALPHAS) else 'ses',
+                alpha=None if choice == len(ALPHAS) else ALPHAS[choice],
+                mae=round(float(mae), 4),
+                history_days=history_days,
+                horizon_days=horizon_days,
+                daily=values,
+                total=round(sum(values), 3),
+                generated_on=today,
+            )
+            for variant_id, choice, mae, values in zip(block, best.tolist(), maes, np.round(daily, 3).tolist())
+        )
+    return replace_forecasts(forecasts)
+
+
+@retry_when_locked
+def replace_forecasts(forecasts):
+    with transaction.atomic():
+        # Variants deleted while the forecasts were fitted have no row to point to anymore.
+        current = fetch_columns(ProductVariant.objects.order_by('pk').values_list('pk'), 1)[:, 0]
+        fitted = np.array([forecast.product_variant_id for forecast in forecasts], dtype=np.int64)
+        forecasts = [forecast for forecast, kept in zip(forecasts, np.isin(fitted, current)) if kept]
+        DemandForecast.objects.all().delete()
+        DemandForecast.objects.bulk_create(forecasts, batch_size=1000)
+        invalidate_cached_responses('forecasts')
+    return len(forecasts)
+
+
+def forecast_values(forecasts):
+    return forecasts.values(
+        'product_variant_id', 'product_variant__product_id', 'product_variant__product__name',
+        'product_variant__size', 'product_variant__color', 'product_variant__stock_quantity',
+        'method', 'alpha', 'mae', 'history_days', 'horizon_days', 'generated_on', 'total', 'daily',
+    )
+
+
+def top_forecasts(params):
+    """Variants with the highest forecast demand, ?limit= (default 100)."""
+    try:
+        limit = min(max(int(params.get('limit', 100)), 1), MAX_LIMIT)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    return list(forecast_values(DemandForecast.objects.order_by('-total', 'product_variant_id'))[:limit])
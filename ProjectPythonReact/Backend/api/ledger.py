@@ -0,0 +1,126 @@
+# api/ledger.py
+"""
+Checkpointed stock ledger.
+
+A variant's balance is the balance of its latest StockCheckpoint plus the signed
+sum of the StockMovement rows written after it, so a stock query only reads
+the movements since the last checkpoint instead of the whole history.
+Checkpoints are written by `manage.py checkpoint_stock`.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, Sum, When
+
+from .models import StockMovement, StockCheckpoint
+
+
+def signed_quantity_sum(prefix=''):
+    """SUM of movement quantities where IN adds to stock and OUT removes from it."""
+    return Sum(Case(
+        When(**{prefix + 'movement_type': 'IN'}, then=F(prefix + 'quantity')),
+        default=-F(prefix + 'quantity'),
+    ))
+
+
+SIGNED_QUANTITY = signed_quantity_sum()
+
+# Maximum number of variants resolved per movements query in variant_balances().
+BATCH_SIZE = 500
+
+
+def latest_checkpoint(variant_id, as_of=None):
+    checkpoints = StockCheckpoint.objects.filter(product_variant_id=variant_id)
+    if as_of is not None:
+        checkpoints = checkpoints.filter(as_of__lte=as_of)
+    return checkpoints.order_by('-position').first()
+
+
+def movement_total(movements, as_of=None):
+    if as_of is not None:
+        movements = movements.filter(movement_date__lte=as_of)
+    return movements.order_by().aggregate(total=SIGNED_QUANTITY)['total'] or 0
+
+
+def variant_balance(variant_id, as_of=None):
+    """Stock of one variant now, or at `as_of` when given."""
+    checkpoint = latest_checkpoint(variant_id, as_of)
+    movements = StockMovement.objects.filter(product_variant_id=variant_id)
+    if checkpoint is None:
+        return movement_total(movements, as_of)
+    return checkpoint.balance + movement_total(movements.filter(pk__gt=checkpoint.position), as_of)
+
+
+def variant_balances(variant_ids, as_of=None):
+    """Stock of many variants as {variant_id: balance}, in two queries per batch of variants."""
+    variant_ids = list(variant_ids)
+    balances = {variant_id: 0 for variant_id in variant_ids}
+    for start in range(0, len(variant_ids), BATCH_SIZE):
+        batch = variant_ids[start:start + BATCH_SIZE]
+        checkpoints = _latest_checkpoints(batch, as_of)
+
+        condition = Q()
+        for variant_id in batch:
+            checkpoint = checkpoints.get(variant_id)
+            if checkpoint is None:
+                condition |= Q(product_variant_id=variant_id)
+            else:
+                balances[variant_id] = checkpoint.balance
+                condition |= Q(product_variant_id=variant_id, pk__gt=checkpoint.position)
+
+        movements = StockMovement.objects.filter(condition)
+        if as_of is not None:
+            movements = movements.filter(movement_date__lte=as_of)
+        for row in movements.values('product_variant_id').annotate(total=SIGNED_QUANTITY).order_by():
+            balances[row['product_variant_id']] += row['total'] or 0
+    return balances
+
+
+def _latest_checkpoints(variant_ids, as_of=None):
+    newer = StockCheckpoint.objects.filter(product_variant_id=OuterRef('product_variant_id'))
+    if as_of is not None:
+        newer = newer.filter(as_of__lte=as_of)
+    latest = newer.order_by('-position').values('pk')[:1]
+    checkpoints = StockCheckpoint.objects.filter(product_variant_id__in=variant_ids, pk=Subquery(latest))
+    return {checkpoint.product_variant_id: checkpoint for checkpoint in checkpoints}
+
+
+def write_checkpoints(variant_ids=None, min_movements=1):
+    """
+    Write a new checkpoint for every variant with at least `min_movements` movements
+    since its latest checkpoint. Returns the number of checkpoints written.
+    """
+    if variant_ids is None:
+        variant_ids = StockMovement.objects.filter(product_variant__isnull=False).order_by().values_list(
+            'product_variant_id', flat=True
+        ).distinct()
+    variant_ids = list(variant_ids)
+
+    written = 0
+    for start in range(0, len(variant_ids), BATCH_SIZE):
+        batch = variant_ids[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            checkpoints = _latest_checkpoints(batch)
+            condition = Q()
+            for variant_id in batch:
+                checkpoint = checkpoints.get(variant_id)
+                if checkpoint is None:
+                    condition |= Q(product_variant_id=variant_id)
+                else:
+                    condition |= Q(product_variant_id=variant_id, pk__gt=checkpoint.position)
+
+            rows = StockMovement.objects.filter(condition).values('product_variant_id').annotate(
+                total=SIGNED_QUANTITY, position=Max('pk'), count=Count('pk'), as_of=Max('movement_date'),
+            ).order_by()
+            new_checkpoints = []
+            for row in rows:
+                if row['count'] < min_movements:
+                    continue
+                previous = checkpoints.get(row['product_variant_id'])
+                new_checkpoints.append(StockCheckpoint(
+                    product_variant_id=row['product_variant_id'],
+                    position=row['position'],
+                    as_of=row['as_of'],
+                    balance=(previous.balance if previous else 0) + (row['total'] or 0),
+                ))
+            StockCheckpoint.objects.bulk_create(new_checkpoints)
+            written += len(new_checkpoints)
+    return written
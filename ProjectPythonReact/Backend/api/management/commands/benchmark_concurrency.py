@@ -0,0 +1,149 @@
+# api/management/commands/benchmark_concurrency.py
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Product, Warehouse
+from .benchmark_endpoints import percentile
+
+# (sync view, async view, model whose first row is the <pk>)
+ENDPOINTS = [
+    ('warehouse_list_create', 'async_warehouse_list', None),
+    ('warehouse_detail', 'async_warehouse_detail', Warehouse),
+    ('shelf_list_create', 'async_shelf_list', None),
+    ('product_detail', 'async_product_detail', Product),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares concurrent-request throughput of the sync views under the WSGI handler (a pool of worker '
+        'threads, like gunicorn --threads) with their async versions under the ASGI handler (one event loop, '
+        'like uvicorn). Requests are sent in-process, without a network or server in between.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint and handler')
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent clients')
+        parser.add_argument('--threads', type=int, default=4, help='WSGI worker threads')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com'})
+        self.authorization = f'Bearer {AccessToken.for_user(user)}'
+        hosts = [host for host in settings.ALLOWED_HOSTS if not host.startswith(('.', '*'))]
+        self.host = hosts[0] if hosts else 'localhost'
+        wsgi, asgi = get_wsgi_application(), get_asgi_application()
+
+        results = {}
+        logging.disable(logging.WARNING)
+        try:
+            for sync_name, async_name, model in ENDPOINTS:
+                kwargs = {}
+                if model is not None:
+                    pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+                    if pk is None:
+                        results[async_name] = {'skipped': 'no data for the path parameters'}
+                        continue
+                    kwargs = {'pk': pk}
+                results[async_name] = {
+                    'wsgi': self.run_wsgi(wsgi, reverse(sync_name, kwargs=kwargs), options),
+                    'asgi': asyncio.run(self.run_asgi(asgi, reverse(async_name, kwargs=kwargs), options)),
+                }
+                results[async_name]['speedup'] = round(
+                    results[async_name]['asgi']['requests_per_second'] / results[async_name]['wsgi']['requests_per_second'], 2
+                )
+        finally:
+            logging.disable(logging.NOTSET)
+
+        report = {
+            'requests': options['requests'],
+            'clients': options['clients'],
+            'wsgi_threads': options['threads'],
+            'database': settings.DATABASES['default']['ENGINE'],
+            'endpoints': results,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(text + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote concurrency report for {len(results)} endpoints to {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+    def summary(self, timings, statuses, elapsed):
+        return {
+            'status': sorted(set(statuses)),
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+        }
+
+    # WSGI: the clients queue for a fixed number of worker threads
+    def wsgi_request(self, app, path, workers):
+        environ = {}
+        setup_testing_defaults(environ)
+        environ.update(PATH_INFO=path, HTTP_HOST=self.host, HTTP_AUTHORIZATION=self.authorization)
+        statuses = []
+        started = time.perf_counter()
+        with workers:
+            b''.join(app(environ, lambda status, headers, exc_info=None: statuses.append(int(status[:3]))))
+        return statuses[0], (time.perf_counter() - started) * 1000
+
+    def run_wsgi(self, app, path, options):
+        workers = threading.BoundedSemaphore(options['threads'])
+        self.wsgi_request(app, path, workers)  # warm up
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['clients']) as clients:
+            responses = list(clients.map(lambda _: self.wsgi_request(app, path, workers), range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        return self.summary([timing for _, timing in responses], [status for status, _ in responses], elapsed)
+
+    # ASGI: every client is a task on one event loop
+    async def asgi_request(self, app, path):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', self.host.encode()), (b'authorization', self.authorization.encode())],
+            'client': ('127.0.0.1', 0), 'server': (self.host, 80),
+        }
+        requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        messages = []
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await asyncio.Future()  # the client never disconnects; the handler cancels this wait
+
+        async def send(message):
+            messages.append(message)
+
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        return messages[0]['status'], (time.perf_counter() - started) * 1000
+
+    async def run_asgi(self, app, path, options):
+        await self.asgi_request(app, path)  # warm up
+        remaining = iter(range(options['requests']))
+        responses = []
+
+        async def client():
+            for _ in remaining:
+                responses.append(await self.asgi_request(app, path))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['clients'])))
+        elapsed = time.perf_counter() - started
+        return self.summary([timing for _, timing in responses], [status for status, _ in responses], elapsed)
@@ -0,0 +1,198 @@
+# api/management/commands/benchmark_endpoints.py
+import json
+import logging
+import math
+import platform
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import urls
+from api.metrics import QueryTimer
+from api.models import (
+    Supplier, Category, Product, ProductVariant, Warehouse, Shelf, Purchase, StockMovement, Customer,
+    DeliveryMethod, Invoice, InvoiceItem, DemandForecast,
+)
+
+# url name -> model whose first row is used for the <pk> of detail endpoints
+DETAIL_MODELS = {
+    'supplier_detail': Supplier,
+    'category_detail': Category,
+    'product_detail': Product,
+    'variant_detail': ProductVariant,
+    'shelf_detail': Shelf,
+    'warehouse_detail': Warehouse,
+    'purchase_detail': Purchase,
+    'stock_movement_detail': StockMovement,
+    'customer_detail': Customer,
+    'delivery_method_detail': DeliveryMethod,
+    'invoice_detail': Invoice,
+    'invoice_item_detail': InvoiceItem,
+    'async_warehouse_detail': Warehouse,
+    'async_product_detail': Product,
+}
+
+# url name -> path kwargs for endpoints that are not plain detail views
+PATH_KWARGS = {
+    'get_user': lambda user: {'user_id': user.pk},
+    'export_rows': lambda user: {'dataset': 'stock-movements'},
+    'invoice_margin_detail': lambda user: {'pk': Invoice.objects.order_by('pk').values_list('pk', flat=True).first()},
+    'variant_forecast': lambda user: {'pk': DemandForecast.objects.order_by('pk').values_list('pk', flat=True).first()},
+    'barcode_lookup': lambda user: {'barcode': Product.objects.order_by('pk').values_list('barcode', flat=True).first()},
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def allows_get(callback):
+    view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+    return view_class is None or hasattr(view_class, 'get')
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs every GET endpoint in api/urls.py in-process and writes p50/p95 latency, queries per request '
+        'and peak memory as JSON, for comparing runs (e.g. after generate_dataset).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only run these url names')
+        parser.add_argument('--host', help='Host header sent with the requests (default: first ALLOWED_HOSTS entry)')
+        parser.add_argument('--query', default='', help='Query string added to every request, e.g. "limit=100"')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--compare', help='Previous JSON report; prints the p50/p95 change per endpoint')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com'})
+        client = APIClient(HTTP_HOST=options['host'] or self.default_host())
+        client.force_authenticate(user)
+
+        results = {}
+        # The views log every request at INFO; keep that out of the timings.
+        logging.disable(logging.INFO)
+        try:
+            for pattern in urls.urlpatterns:
+                name = pattern.name
+                if not name or name in results or not allows_get(pattern.callback):
+                    continue
+                if options['endpoints'] and name not in options['endpoints']:
+                    continue
+                path = self.resolve_path(name, user)
+                if path is None:
+                    results[name] = {'skipped': 'no data for the path parameters'}
+                    continue
+                if options['query']:
+                    path = f"{path}?{options['query']}"
+                results[name] = self.measure(client, path, options['repeat'], options['warmup'])
+        finally:
+            logging.disable(logging.NOTSET)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'query': options['query'],
+            },
+            'rows': {
+                model.__name__: model.objects.count()
+                for model in (Product, ProductVariant, Purchase, StockMovement, Customer, Invoice, InvoiceItem)
+            },
+            'endpoints': results,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(text + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote benchmark report for {len(results)} endpoints to {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+        if options['compare']:
+            with open(options['compare']) as handle:
+                self.print_comparison(json.load(handle)['endpoints'], results)
+
+    def default_host(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if not host.startswith(('.', '*'))]
+        return hosts[0] if hosts else 'localhost'
+
+    def resolve_path(self, name, user):
+        if name in DETAIL_MODELS:
+            pk = DETAIL_MODELS[name].objects.order_by('pk').values_list('pk', flat=True).first()
+            return None if pk is None else reverse(name, kwargs={'pk': pk})
+        if name in PATH_KWARGS:
+            kwargs = PATH_KWARGS[name](user)
+            return None if None in kwargs.values() else reverse(name, kwargs=kwargs)
+        try:
+            return reverse(name)
+        except Exception:
+            return None
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        return response.status_code, size
+
+    def measure(self, client, path, repeat, warmup):
+        for _ in range(warmup):
+            self.request(client, path)
+
+        timings = []
+        queries = []
+        for _ in range(max(repeat, 1)):
+            timer = QueryTimer(time.perf_counter)
+            with connection.execute_wrapper(timer):
+                started = time.perf_counter()
+                status_code, size = self.request(client, path)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(timer.count)
+
+        # Memory is measured in a separate request: tracemalloc slows allocation down.
+        tracemalloc.start()
+        try:
+            self.request(client, path)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'path': path,
+            'status': status_code,
+            'response_bytes': size,
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries': max(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def print_comparison(self, baseline, results):
+        for name, current in results.items():
+            previous = baseline.get(name)
+            if not previous or 'p50_ms' not in previous or 'p50_ms' not in current:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'queries', 'peak_memory_kb'):
+                before, after = previous[key], current[key]
+                ratio = f"{after / before:.2f}x" if before else 'n/a'
+                changes.append(f"{key} {before} -> {after} ({ratio})")
+            self.stdout.write(f"{name}: " + ', '.join(changes), self.style.WARNING if current['p95_ms'] > previous['p95_ms'] * 1.2 else None)
@@ -0,0 +1,161 @@
+# api/management/commands/benchmark_write_contention.py
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from rest_framework.test import APIClient
+
+from api.metrics import REGISTRY
+from api.models import Customer, Product, ProductVariant
+from .benchmark_endpoints import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures invoices created per second by concurrent clients (POST /api/invoices/) for each SQLite '
+        'profile in settings.DATABASE_PROFILES, each on a fresh temporary database file next to the configured one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients, each on its own thread and connection')
+        parser.add_argument('--invoices', type=int, default=50, help='Invoices per client')
+        parser.add_argument('--items', type=int, default=3, help='Lines per invoice')
+        parser.add_argument('--readers', type=int, default=4, help='Clients listing invoices while the invoices are written')
+        parser.add_argument('--profile', action='append', dest='profiles', help='Only run these profiles')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'] or list(settings.DATABASE_PROFILES)
+        unknown = set(profiles) - set(settings.DATABASE_PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profiles: {sorted(unknown)}")
+
+        database = connections.settings['default']
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('The write-contention benchmark compares SQLite profiles')
+        original = dict(database)
+        results = {}
+        logging.disable(logging.ERROR)
+        try:
+            for profile in profiles:
+                # Next to the real database, so commits pay the same fsync cost.
+                with tempfile.TemporaryDirectory(dir=os.path.dirname(original['NAME'])) as directory:
+                    self.use_database(database, original, os.path.join(directory, 'benchmark.sqlite3'), profile)
+                    results[profile] = self.run(options)
+                    connection.close()
+        finally:
+            logging.disable(logging.NOTSET)
+            connection.close()
+            database.clear()
+            database.update(original)
+
+        report = {
+            'clients': options['clients'],
+            'invoices_per_client': options['invoices'],
+            'items_per_invoice': options['items'],
+            'readers': options['readers'],
+            'profiles': results,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(text + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote write-contention report to {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+    def use_database(self, database, original, name, profile):
+        """Point the default connection at `name` with `profile`; connections opened from now on use them."""
+        connection.close()
+        database.clear()
+        database.update(original)
+        database.update(CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False, OPTIONS={})
+        database.update(settings.DATABASE_PROFILES[profile])
+        database['NAME'] = name
+        call_command('migrate', verbosity=0, interactive=False)
+
+    def run(self, options):
+        customer = Customer.objects.create(first_name='Benchmark')
+        product = Product.objects.create(name='Benchmark')
+        variants = ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, size=str(size), stock_quantity=10 ** 9) for size in range(50)
+        ])
+        variant_ids = [variant.pk for variant in variants]
+        hosts = [host for host in settings.ALLOWED_HOSTS if not host.startswith(('.', '*'))]
+        host = hosts[0] if hosts else 'localhost'
+        retries_before = REGISTRY.counter('api_database_lock_retries_total', 'InvoiceSerializer.save')
+        timings, statuses, reads = [], [], []
+        lock = threading.Lock()
+        writing = threading.Event()
+
+        def client(seed):
+            rng = random.Random(seed)
+            api = APIClient(raise_request_exception=False, HTTP_HOST=host)
+            try:
+                for _ in range(options['invoices']):
+                    payload = {
+                        'customer_id': customer.pk,
+                        'date': date.today().isoformat(),
+                        'due_date': date.today().isoformat(),
+                        'status': 'PAID',
+                        'items': [
+                            {'product_id': product.pk, 'variant_id': variant_id, 'quantity': 1, 'unit_price': '5.00'}
+                            for variant_id in rng.sample(variant_ids, options['items'])
+                        ],
+                    }
+                    started = time.perf_counter()
+                    response = api.post('/api/invoices/', payload, format='json')
+                    with lock:
+                        timings.append((time.perf_counter() - started) * 1000)
+                        statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        def reader():
+            api = APIClient(raise_request_exception=False, HTTP_HOST=host)
+            try:
+                while writing.is_set():
+                    response = api.get('/api/invoices/', {'view': 'summary', 'ordering': '-date', 'limit': 50})
+                    with lock:
+                        reads.append(response.status_code)
+            finally:
+                connection.close()
+
+        writing.set()
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(options['clients'])]
+        started = time.perf_counter()
+        for thread in readers + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        created = statuses.count(201)
+        return {
+            'pragmas': {
+                pragma: connection.cursor().execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'mmap_size', 'cache_size')
+            },
+            'created': created,
+            'failed': len(statuses) - created,
+            'lock_retries': REGISTRY.counter('api_database_lock_retries_total', 'InvoiceSerializer.save') - retries_before,
+            'seconds': round(elapsed, 3),
+            'invoices_per_second': round(created / elapsed, 1),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'reads_per_second': round(reads.count(200) / elapsed, 1),
+            'failed_reads': len(reads) - reads.count(200),
+        }
@@ -0,0 +1,18 @@
+# api/management/commands/checkpoint_stock.py
+from django.core.management.base import BaseCommand
+from api.ledger import write_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Writes StockCheckpoint balances so stock queries only sum movements since the last checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-movements', type=int, default=100,
+            help='Only checkpoint variants with at least this many movements since their last checkpoint',
+        )
+        parser.add_argument('--variant', type=int, action='append', dest='variants', help='Limit to these variant ids')
+
+    def handle(self, *args, **options):
+        written = write_checkpoints(options['variants'], min_movements=options['min_movements'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} stock checkpoints"))
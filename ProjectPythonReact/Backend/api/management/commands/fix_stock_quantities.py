@@ -1,35 +1,104 @@
 # api/management/commands/fix_stock_quantities.py
-from django.core.management.base import BaseCommand
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Max, Min, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from api.cache import invalidate as invalidate_cached_responses
+from api.ledger import signed_quantity_sum
 from api.models import ProductVariant, StockMovement
-from django.db.models import Sum
+
 
 class Command(BaseCommand):
     help = 'Fixes stock quantities in ProductVariant based on StockMovement entries'
 
-    def handle(self, *args, **kwargs):
-        variants = ProductVariant.objects.all()
-        for variant in variants:
-            # Calculate stock from StockMovement
-            in_stock = StockMovement.objects.filter(
-                product_variant=variant,
-                movement_type='IN'
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-            out_stock = StockMovement.objects.filter(
-                product_variant=variant,
-                movement_type='OUT'
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-            correct_stock = in_stock - out_stock
-
-            if variant.stock_quantity != correct_stock:
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report the differences without writing them')
+        parser.add_argument(
+            '--since',
+            help='Only reconcile variants with movements on or after this date (YYYY-MM-DD or ISO datetime)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Variant ids per range and per bulk update')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.chunk_size = max(options['chunk_size'], 1)
+        self.since = self.parse_since(options['since'])
+
+        bounds = ProductVariant.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write(self.style.SUCCESS("No variants to reconcile"))
+            return
+        ranges = [
+            (start, min(start + self.chunk_size - 1, bounds['high']))
+            for start in range(bounds['low'], bounds['high'] + 1, self.chunk_size)
+        ]
+
+        started = time.monotonic()
+        results = [self.reconcile_range(*id_range) for id_range in ranges]
+        elapsed = time.monotonic() - started
+
+        scanned = sum(result[0] for result in results)
+        corrected = sum(result[1] for result in results)
+        if corrected and not self.dry_run:
+            invalidate_cached_responses('products')
+        rate = scanned / elapsed if elapsed > 0 else float(scanned)
+        verb = 'would be corrected' if self.dry_run else 'corrected'
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} variants, {corrected} {verb} in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        ))
+
+    def parse_since(self, value):
+        if not value:
+            return None
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f"Invalid --since value: {value}")
+            since = datetime.combine(day, datetime.min.time())
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def reconcile_range(self, low, high):
+        """Compare stored and computed stock for variants with ids in [low, high]; returns (scanned, corrected)."""
+        if self.dry_run:
+            return self.compare_range(low, high)
+        # Read and write in one transaction, so a movement recorded in between is not overwritten.
+        with transaction.atomic():
+            return self.compare_range(low, high)
+
+    def compare_range(self, low, high):
+        variants = ProductVariant.objects.filter(id__gte=low, id__lte=high)
+        if self.since is not None:
+            variants = variants.filter(id__in=StockMovement.objects.filter(
+                movement_date__gte=self.since
+            ).values('product_variant_id'))
+        scanned = variants.count()
+
+        # One LEFT JOIN + GROUP BY for the whole range.
+        wrong = list(variants.annotate(
+            correct_stock=Coalesce(signed_quantity_sum('stockmovement__'), 0)
+        ).filter(
+            Q(stock_quantity__isnull=True) | ~Q(stock_quantity=F('correct_stock'))
+        ).order_by().values_list('id', 'stock_quantity', 'correct_stock'))
+
+        if self.dry_run or self.verbosity > 1:
+            for variant_id, stored, correct in wrong:
                 self.stdout.write(self.style.WARNING(
-                    f"Variant {variant.id} stock_quantity={variant.stock_quantity}, should be {correct_stock}"
-                ))
-                variant.stock_quantity = correct_stock
-                variant.save()
-                self.stdout.write(self.style.SUCCESS(
-                    f"Updated variant {variant.id} stock_quantity to {correct_stock}"
+                    f"Variant {variant_id} stock_quantity={stored}, should be {correct}"
                 ))
-            else:
-                self.stdout.write(self.style.SUCCESS(
-                    f"Variant {variant.id} stock_quantity is correct: {correct_stock}"
-                ))
\ No newline at end of file
+        if wrong and not self.dry_run:
+            ProductVariant.objects.bulk_update(
+                [ProductVariant(id=variant_id, stock_quantity=correct) for variant_id, _, correct in wrong],
+                ['stock_quantity'],
+                batch_size=self.chunk_size,
+            )
+        return scanned, len(wrong)
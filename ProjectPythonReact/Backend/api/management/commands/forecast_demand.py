@@ -0,0 +1,24 @@
+# api/management/commands/forecast_demand.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.forecasting import HISTORY_DAYS, HORIZON_DAYS, forecast_demand
+
+
+class Command(BaseCommand):
+    help = 'Fits a demand forecast for every variant from its daily sales history and replaces the stored forecasts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history-days', type=int, default=HISTORY_DAYS, help=f'Days of sales history to fit (default {HISTORY_DAYS})')
+        parser.add_argument('--horizon-days', type=int, default=HORIZON_DAYS, help=f'Days to forecast (default {HORIZON_DAYS})')
+
+    def handle(self, *args, **options):
+        if options['history_days'] < 2 or options['horizon_days'] < 1:
+            raise CommandError('--history-days must be at least 2 and --horizon-days at least 1')
+        started = time.perf_counter()
+        stored = forecast_demand(options['history_days'], options['horizon_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Forecast {options['horizon_days']} days of demand for {stored} variants "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
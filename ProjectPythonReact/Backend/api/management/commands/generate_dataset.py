@@ -0,0 +1,299 @@
+# api/management/commands/generate_dataset.py
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.analytics import rebuild_rollups
+from api.cache import invalidate as invalidate_cached_responses
+from api.models import (
+    Supplier, Category, Product, ProductVariant, Warehouse, Shelf, Customer, DeliveryMethod,
+    Purchase, Invoice, InvoiceItem, StockMovement, StockOccupancy, VariantValuation, allocate_barcodes,
+)
+from api.serializers import InvoiceSerializer
+
+BATCH_SIZE = 1000
+
+BRANDS = ['Acme', 'Northwind', 'Contoso', 'Fabrikam', 'Globex', 'Initech', 'Umbrella', 'Tailspin']
+NOUNS = ['Shirt', 'Jeans', 'Jacket', 'Sneakers', 'Cap', 'Dress', 'Hoodie', 'Socks', 'Belt', 'Scarf']
+ADJECTIVES = ['Classic', 'Slim', 'Sport', 'Urban', 'Summer', 'Winter', 'Premium', 'Basic', 'Vintage']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+COLORS = ['Black', 'White', 'Red', 'Blue', 'Green', 'Grey', 'Navy', 'Beige']
+FIRST_NAMES = ['Sok', 'Dara', 'Vanna', 'Sophea', 'Rithy', 'Chenda', 'Bopha', 'Visal', 'Nary', 'Pisey']
+LAST_NAMES = ['Chan', 'Kim', 'Sok', 'Heng', 'Lim', 'Meas', 'Noun', 'Ouk', 'Prak', 'Seng']
+CITIES = ['Phnom Penh', 'Siem Reap', 'Battambang', 'Kampot', 'Sihanoukville']
+STATUSES = ['PAID'] * 6 + ['PENDING'] * 2 + ['DRAFT', 'CANCELLED']
+PAYMENT_METHODS = ['CASH', 'CASH', 'CREDIT', 'BANK_TRANSFER']
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a seeded synthetic dataset (suppliers, catalog, warehouses, purchases, customers, invoices) '
+        'with bulk inserts. Counts are multiplied by --scale; the same seed always produces the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplier applied to every count below')
+        parser.add_argument('--suppliers', type=int, default=50)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--variants-per-product', type=int, default=4)
+        parser.add_argument('--warehouses', type=int, default=5)
+        parser.add_argument('--shelves-per-warehouse', type=int, default=20)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--delivery-methods', type=int, default=5)
+        parser.add_argument('--purchases', type=int, default=20000)
+        parser.add_argument('--invoices', type=int, default=10000)
+        parser.add_argument('--max-items-per-invoice', type=int, default=5)
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Purchase, invoice and stock movement dates are spread over this many past days',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.tag = f"s{options['seed']}"
+        scale = options['scale']
+        count = lambda name: max(int(options[name] * scale), 1)
+
+        if Category.objects.filter(name__startswith=f"{self.tag}-").exists():
+            raise CommandError(f"A dataset with seed {options['seed']} already exists; use another --seed")
+
+        started = time.monotonic()
+        suppliers = self.create_suppliers(count('suppliers'))
+        categories = self.create_categories(count('categories'))
+        variants = self.create_catalog(count('products'), options['variants_per_product'], categories)
+        shelves = self.create_warehouses(count('warehouses'), options['shelves_per_warehouse'])
+        customers = self.create_customers(count('customers'))
+        delivery_methods = self.create_delivery_methods(count('delivery_methods'))
+
+        # Every variant is stored on one shelf; its IN and OUT movements happen there.
+        self.homes = {variant.id: self.rng.choice(shelves) for variant in variants}
+        self.stock = {variant.id: 0 for variant in variants}
+        # Purchased stock becomes sellable on the days after its purchase: (day, variant id, quantity).
+        self.arrivals = []
+        purchases = self.create_purchases(count('purchases'), options['days'], variants, suppliers)
+        invoices, items = self.create_invoices(
+            count('invoices'), options['max_items_per_invoice'], options['days'], variants, customers, delivery_methods,
+        )
+
+        # Everything above was bulk-inserted, which sends no model signals and skips Invoice.save.
+        today = timezone.localdate()
+        rebuild_rollups(today - timedelta(days=options['days']), today)
+        invalidate_cached_responses('categories', 'delivery_methods', 'suppliers', 'products', 'customers', 'invoices')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(suppliers)} suppliers, {len(categories)} categories, {len(variants)} variants, "
+            f"{len(shelves)} shelves, {len(customers)} customers, {purchases} purchases, "
+            f"{invoices} invoices with {items} items in {elapsed:.1f}s"
+        ))
+
+    def create_suppliers(self, count):
+        return Supplier.objects.bulk_create([
+            Supplier(
+                name=f"{self.rng.choice(BRANDS)} Supply {i + 1}",
+                contact_person=f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}",
+                phone=f"0{self.rng.randint(10000000, 99999999)}",
+                address=f"{self.rng.randint(1, 500)} Street {self.rng.randint(1, 400)}",
+                country=self.rng.choice(['KH', 'TH', 'VN', 'CN']),
+            )
+            for i in range(count)
+        ], batch_size=BATCH_SIZE)
+
+    def create_categories(self, count):
+        return Category.objects.bulk_create(
+            [Category(name=f"{self.tag}-{self.rng.choice(NOUNS)} {i + 1}") for i in range(count)],
+            batch_size=BATCH_SIZE,
+        )
+
+    def create_catalog(self, count, variants_per_product, categories):
+        variants = []
+        for start in range(0, count, BATCH_SIZE):
+            size = min(BATCH_SIZE, count - start)
+            with transaction.atomic():
+                barcodes = allocate_barcodes(size)
+                products = Product.objects.bulk_create([
+                    Product(
+                        name=f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {start + i + 1}",
+                        category=self.rng.choice(categories),
+                        brand=self.rng.choice(BRANDS),
+                        barcode=barcode,
+                    )
+                    for i, barcode in enumerate(barcodes)
+                ])
+                batch = []
+                for product in products:
+                    base = Decimal(self.rng.randint(200, 5000)) / 100
+                    for size_name in self.rng.sample(SIZES, min(variants_per_product, len(SIZES))):
+                        batch.append(ProductVariant(
+                            product=product,
+                            size=size_name,
+                            color=self.rng.choice(COLORS),
+                            stock_quantity=0,
+                            purchase_price=base,
+                            selling_price=(base * Decimal('1.6')).quantize(Decimal('0.01')),
+                        ))
+                variants.extend(ProductVariant.objects.bulk_create(batch, batch_size=BATCH_SIZE))
+        return variants
+
+    def create_warehouses(self, count, shelves_per_warehouse):
+        warehouses = Warehouse.objects.bulk_create([
+            Warehouse(name=f"Warehouse {i + 1}", location=self.rng.choice(CITIES), capacity=Decimal('100000'))
+            for i in range(count)
+        ])
+        return Shelf.objects.bulk_create([
+            Shelf(warehouse=warehouse, shelf_name=f"{chr(65 + j % 26)}{j + 1}", section=f"Aisle {j // 10 + 1}",
+                  capacity=Decimal('5000'))
+            for warehouse in warehouses for j in range(shelves_per_warehouse)
+        ], batch_size=BATCH_SIZE)
+
+    def create_customers(self, count):
+        return Customer.objects.bulk_create([
+            Customer(
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                email=f"customer{i + 1}@{self.tag}.example.com",
+                phone_number=f"0{self.rng.randint(10000000, 99999999)}",
+                city=self.rng.choice(CITIES),
+                country='KH',
+            )
+            for i in range(count)
+        ], batch_size=BATCH_SIZE)
+
+    def create_delivery_methods(self, count):
+        return DeliveryMethod.objects.bulk_create([
+            DeliveryMethod(delivery_name=f"Courier {i + 1}", car_number=f"2A-{self.rng.randint(1000, 9999)}",
+                           estimated_delivery_time=timedelta(days=self.rng.randint(1, 5)))
+            for i in range(count)
+        ])
+
+    def moment(self, day):
+        """A random time of `day` in the current time zone, not later than now."""
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        return min(start + timedelta(seconds=self.rng.randrange(24 * 60 * 60)), timezone.now())
+
+    def create_purchases(self, count, days, variants, suppliers):
+        # Over the --days days before today, in date order, so movement ids and FIFO layers follow the calendar.
+        today = timezone.localdate()
+        dates = sorted(self.moment(today - timedelta(days=self.rng.randint(1, max(days, 1)))) for _ in range(count))
+        for start in range(0, count, BATCH_SIZE):
+            purchases = []
+            for i in range(start, min(start + BATCH_SIZE, count)):
+                variant = self.rng.choice(variants)
+                quantity = self.rng.randint(5, 100)
+                purchases.append(Purchase(
+                    supplier=self.rng.choice(suppliers),
+                    product_id=variant.product_id,
+                    product_variant=variant,
+                    batch_number=f"B{i // 50 + 1:06d}",
+                    quantity=quantity,
+                    purchase_price=variant.purchase_price,
+                    total=quantity * variant.purchase_price,
+                ))
+                self.arrivals.append((timezone.localdate(dates[i]), variant.id, quantity))
+
+            with transaction.atomic():
+                Purchase.objects.bulk_create(purchases)
+                # bulk_create stamps auto_now_add fields with the current time.
+                for purchase, purchased_at in zip(purchases, dates[start:]):
+                    purchase.purchase_date = purchased_at
+                Purchase.objects.bulk_update(purchases, ['purchase_date'], batch_size=BATCH_SIZE)
+                movements = [
+                    self.movement(purchase.product_variant, 'IN', purchase.quantity, purchase=purchase,
+                                  cost=purchase.quantity * purchase.purchase_price)
+                    for purchase in purchases
+                ]
+                self.write_movements(movements, [purchase.purchase_date for purchase in purchases])
+        return count
+
+    def create_invoices(self, count, max_items, days, variants, customers, delivery_methods):
+        today = timezone.localdate()
+        # In date order, selling only what was purchased on earlier days.
+        dates = sorted(today - timedelta(days=self.rng.randint(0, days)) for _ in range(count))
+        arrived = 0
+        invoice_count = item_count = 0
+        for start in range(0, count, BATCH_SIZE):
+            invoices, invoice_items = [], []
+            for invoice_date in dates[start:start + BATCH_SIZE]:
+                while arrived < len(self.arrivals) and self.arrivals[arrived][0] < invoice_date:
+                    _, variant_id, quantity = self.arrivals[arrived]
+                    self.stock[variant_id] += quantity
+                    arrived += 1
+                invoice = Invoice(
+                    type='quotation' if self.rng.random() < 0.05 else 'invoice',
+                    status=self.rng.choice(STATUSES),
+                    date=invoice_date,
+                    due_date=invoice_date + timedelta(days=30),
+                    customer=self.rng.choice(customers),
+                    delivery_method=self.rng.choice(delivery_methods) if self.rng.random() < 0.3 else None,
+                    payment_method=self.rng.choice(PAYMENT_METHODS),
+                    shipping_cost=Decimal(self.rng.choice([0, 0, 150, 300])) / 100,
+                    overall_discount=Decimal(self.rng.choice([0, 0, 0, 5, 10])),
+                )
+                items = []
+                for variant in self.rng.sample(variants, min(self.rng.randint(1, max_items), len(variants))):
+                    quantity = min(self.rng.randint(1, 5), self.stock[variant.id])
+                    if quantity <= 0:
+                        continue
+                    self.stock[variant.id] -= quantity
+                    item = InvoiceItem(
+                        product_id=variant.product_id,
+                        variant=variant,
+                        quantity=quantity,
+                        unit_price=variant.selling_price,
+                        discount_percentage=Decimal(self.rng.choice([0, 0, 0, 5])),
+                    )
+                    item.total_price = item.calculate_total_price()
+                    items.append(item)
+                if not items:
+                    continue
+                InvoiceSerializer.calculate_totals(invoice, items)
+                invoices.append(invoice)
+                invoice_items.append(items)
+
+            with transaction.atomic():
+                Invoice.objects.bulk_create(invoices)
+                flat, dispatched = [], []
+                for invoice, items in zip(invoices, invoice_items):
+                    dispatched_at = self.moment(invoice.date)
+                    for item in items:
+                        item.invoice = invoice
+                        flat.append(item)
+                        dispatched.append(dispatched_at)
+                InvoiceItem.objects.bulk_create(flat, batch_size=BATCH_SIZE)
+                self.write_movements(
+                    [self.movement(item.variant, 'OUT', item.quantity, invoice_item=item) for item in flat], dispatched,
+                )
+            invoice_count += len(invoices)
+            item_count += len(flat)
+        return invoice_count, item_count
+
+    def movement(self, variant, movement_type, quantity, **source):
+        shelf = self.homes[variant.id]
+        return StockMovement(
+            product_id=variant.product_id,
+            product_variant_id=variant.id,
+            warehouse_id=shelf.warehouse_id,
+            shelf=shelf,
+            movement_type=movement_type,
+            quantity=quantity,
+            **source,
+        )
+
+    def write_movements(self, movements, dates):
+        StockMovement.objects.bulk_create(movements, batch_size=BATCH_SIZE)
+        for movement, moved_at in zip(movements, dates):
+            movement.movement_date = moved_at
+        StockMovement.objects.bulk_update(movements, ['movement_date'], batch_size=BATCH_SIZE)
+        StockOccupancy.apply(movements)
+        VariantValuation.apply(movements)
+        deltas = {}
+        for movement in movements:
+            deltas[movement.product_variant_id] = deltas.get(movement.product_variant_id, 0) + movement.signed_quantity
+        ProductVariant.increment_stock(deltas)
@@ -0,0 +1,23 @@
+# api/management/commands/rebuild_sales_rollups.py
+from django.core.management.base import BaseCommand, CommandError
+
+from api.analytics import rebuild_rollups
+from api.exports import parse_date_range
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily sales rollups (DailyVariantSales, DailyCustomerSales) from the invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First invoice date to rebuild (YYYY-MM-DD); default: the first invoice')
+        parser.add_argument('--end', help='Last invoice date to rebuild (YYYY-MM-DD); default: the last invoice')
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_date_range(options['start'], options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        variant_rows, customer_rows = rebuild_rollups(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {variant_rows} daily variant rows and {customer_rows} daily customer rows"
+        ))
@@ -0,0 +1,14 @@
+# api/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand, CommandError
+
+from api.search import is_indexed, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Re-creates the product search index (SQLite only) from the products, variants and categories'
+
+    def handle(self, *args, **options):
+        if not is_indexed():
+            raise CommandError('Product search is only indexed on SQLite; other databases need no rebuild')
+        products = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {products} products"))
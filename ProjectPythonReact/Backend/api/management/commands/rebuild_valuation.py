@@ -0,0 +1,18 @@
+# api/management/commands/rebuild_valuation.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.valuation import rebuild_valuation
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds cost layers, variant valuations and movement costs from the full movement history '
+        '(once after upgrading, or after changing INVENTORY_VALUATION_METHOD)'
+    )
+
+    def handle(self, *args, **options):
+        variants = rebuild_valuation()
+        self.stdout.write(self.style.SUCCESS(
+            f"Valued {variants} variants with the {getattr(settings, 'INVENTORY_VALUATION_METHOD', 'fifo')} method"
+        ))
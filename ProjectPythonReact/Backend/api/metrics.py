@@ -0,0 +1,120 @@
+# api/metrics.py
+"""
+In-process request metrics, exposed in the Prometheus text format at /api/metrics/.
+
+Each worker process keeps its own histograms; Prometheus sums them across
+scrape targets. Nothing is persisted, so the numbers reset on restart.
+"""
+import threading
+from bisect import bisect_left
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# name -> (help text, buckets)
+METRICS = {
+    'api_request_duration_seconds': ('Wall time spent handling the request', DURATION_BUCKETS),
+    'api_request_sql_queries': ('Number of SQL queries run by the request', QUERY_COUNT_BUCKETS),
+    'api_request_sql_duration_seconds': ('Time spent in SQL queries by the request', DURATION_BUCKETS),
+    'api_response_size_bytes': ('Size of the response body (non-streaming responses only)', SIZE_BUCKETS),
+}
+
+# name -> (help text, label name)
+COUNTERS = {
+    'api_response_cache_hits_total': ('Responses served from the response cache', 'cache'),
+    'api_response_cache_misses_total': ('Responses built and stored in the response cache', 'cache'),
+    'api_response_cache_invalidations_total': ('Response cache invalidations triggered by model changes', 'cache'),
+    'api_database_lock_retries_total': ('Writes retried after the database stayed locked (api/db.py)', 'write'),
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram; callers hold the registry lock."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (metric name, view name) -> Histogram
+        self.counters = {}  # (counter name, label value) -> int
+
+    def observe(self, view, **values):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, view)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(METRICS[name][1])
+                histogram.observe(value)
+
+    def increment(self, name, label, amount=1):
+        with self.lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + amount
+
+    def counter(self, name, label):
+        with self.lock:
+            return self.counters.get((name, label), 0)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self.lock:
+            snapshot = {
+                key: (list(histogram.counts), histogram.sum, histogram.count)
+                for key, histogram in self.histograms.items()
+            }
+            counters = dict(self.counters)
+        lines = []
+        for name, (help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, view), (counts, total, count) in sorted(snapshot.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{view}"}} {total}')
+                lines.append(f'{name}_count{{view="{view}"}} {count}')
+        for name, (help_text, label) in COUNTERS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (counter, value), count in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{name}{{{label}="{value}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class QueryTimer:
+    """Database execute wrapper that counts queries and sums their time."""
+    def __init__(self, clock):
+        self.clock = clock
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = self.clock()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += self.clock() - started
+            self.count += 1
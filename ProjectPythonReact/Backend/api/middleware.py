@@ -0,0 +1,76 @@
+# api/middleware.py
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from .metrics import REGISTRY, QueryTimer
+
+# The QueryTimer of the current request, for queries run on other threads (api.async_views.gather).
+request_query_timer = ContextVar('request_query_timer', default=None)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record wall time, SQL query count, SQL time and response size per URL name.
+
+    Queries are counted with a connection execute wrapper, so this works with
+    DEBUG off. When API_QUERY_COUNT_HEADER is on, the count is also returned
+    in the X-Query-Count response header. Streaming responses are measured up
+    to the point the response is returned; the rows they send later are not
+    included.
+
+    Under ASGI the ORM runs on the request's sync thread, so the wrapper is
+    installed on that thread's connection.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_count_header = getattr(settings, 'API_QUERY_COUNT_HEADER', False)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer(time.perf_counter)
+        started = time.perf_counter()
+        token = request_query_timer.set(timer)
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            request_query_timer.reset(token)
+        return self.record(request, response, timer, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timer = QueryTimer(time.perf_counter)
+        started = time.perf_counter()
+        token = request_query_timer.set(timer)
+        await sync_to_async(lambda: connection.execute_wrappers.append(timer))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(timer))()
+            request_query_timer.reset(token)
+        return self.record(request, response, timer, time.perf_counter() - started)
+
+    def record(self, request, response, timer, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name if match else None) or 'unmatched'
+        values = {
+            'api_request_duration_seconds': elapsed,
+            'api_request_sql_queries': timer.count,
+            'api_request_sql_duration_seconds': timer.duration,
+        }
+        if not response.streaming:
+            values['api_response_size_bytes'] = len(response.content)
+        REGISTRY.observe(view, **values)
+
+        if self.query_count_header:
+            response['X-Query-Count'] = str(timer.count)
+        return response
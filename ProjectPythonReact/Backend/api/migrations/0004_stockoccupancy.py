@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, When
+
+
+def backfill_stock_occupancy(apps, schema_editor):
+    StockMovement = apps.get_model('api', 'StockMovement')
+    StockOccupancy = apps.get_model('api', 'StockOccupancy')
+    totals = StockMovement.objects.values('warehouse_id', 'shelf_id', 'product_variant_id').annotate(
+        total=Sum(Case(When(movement_type='IN', then=F('quantity')), default=-F('quantity')))
+    ).order_by()
+    StockOccupancy.objects.bulk_create([
+        StockOccupancy(
+            warehouse_id=row['warehouse_id'], shelf_id=row['shelf_id'],
+            product_variant_id=row['product_variant_id'], quantity=row['total'],
+        )
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_invoice_date_alter_invoice_due_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('product_variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_occupancy', to='api.productvariant')),
+                ('shelf', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_occupancy', to='api.shelf')),
+                ('warehouse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_occupancy', to='api.warehouse')),
+            ],
+            options={
+                'db_table': 'stock_occupancy',
+                'constraints': [models.UniqueConstraint(fields=('warehouse', 'shelf', 'product_variant'), name='unique_stock_occupancy')],
+            },
+        ),
+        migrations.RunPython(backfill_stock_occupancy, migrations.RunPython.noop),
+    ]
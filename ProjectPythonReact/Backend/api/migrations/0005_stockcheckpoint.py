@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_stockoccupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField()),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product_variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_checkpoints', to='api.productvariant')),
+            ],
+            options={
+                'db_table': 'stock_checkpoint',
+                'indexes': [models.Index(fields=['product_variant', 'position'], name='stock_checkpoint_position_idx')],
+            },
+        ),
+    ]
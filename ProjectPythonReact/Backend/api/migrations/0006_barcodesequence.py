@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+def seed_product_sequence(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    BarcodeSequence = apps.get_model('api', 'BarcodeSequence')
+    last_barcode = Product.objects.order_by('-barcode').values_list('barcode', flat=True).first()
+    BarcodeSequence.objects.create(name='product', next_value=int(last_barcode[1:]) + 1 if last_barcode else 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_stockcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BarcodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+            options={
+                'db_table': 'barcode_sequence',
+            },
+        ),
+        migrations.RunPython(seed_product_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations
+
+# FTS5 product search index (see api/search.py); rowid is the product id.
+CREATE_TABLE = """
+    CREATE VIRTUAL TABLE api_product_search USING fts5(
+        name, brand, category, barcode, variants,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+"""
+
+# Rows of the products matched by {condition}, over p = api_product.
+INDEX_ROWS = """
+    INSERT INTO api_product_search (rowid, name, brand, category, barcode, variants)
+    SELECT p.id, p.name, COALESCE(p.brand, ''), COALESCE(c.name, ''), p.barcode,
+           COALESCE((SELECT group_concat(COALESCE(v.size, '') || ' ' || COALESCE(v.color, ''), ' ')
+                     FROM api_productvariant v WHERE v.product_id = p.id), '')
+    FROM api_product p LEFT JOIN api_category c ON c.id = p.category_id
+    WHERE {condition};
+"""
+
+
+def reindex(condition):
+    return (
+        f"DELETE FROM api_product_search WHERE rowid IN (SELECT p.id FROM api_product p WHERE {condition});"
+        + INDEX_ROWS.format(condition=condition)
+    )
+
+
+# trigger name -> (event, body)
+TRIGGERS = {
+    'api_product_search_product_insert': ('AFTER INSERT ON api_product', reindex('p.id = NEW.id')),
+    'api_product_search_product_update': (
+        'AFTER UPDATE OF name, brand, barcode, category_id ON api_product',
+        'DELETE FROM api_product_search WHERE rowid = OLD.id;' + reindex('p.id = NEW.id'),
+    ),
+    'api_product_search_product_delete': (
+        'AFTER DELETE ON api_product', 'DELETE FROM api_product_search WHERE rowid = OLD.id;',
+    ),
+    'api_product_search_variant_insert': ('AFTER INSERT ON api_productvariant', reindex('p.id = NEW.product_id')),
+    'api_product_search_variant_update': (
+        'AFTER UPDATE OF size, color, product_id ON api_productvariant',
+        reindex('p.id IN (OLD.product_id, NEW.product_id)'),
+    ),
+    'api_product_search_variant_delete': ('AFTER DELETE ON api_productvariant', reindex('p.id = OLD.product_id')),
+    'api_product_search_category_update': ('AFTER UPDATE OF name ON api_category', reindex('p.category_id = NEW.id')),
+}
+
+
+def create_search_index(apps, schema_editor):
+    # Other databases search with LIKE lookups instead.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE)
+    for name, (event, body) in TRIGGERS.items():
+        schema_editor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+    schema_editor.execute(INDEX_ROWS.format(condition='1'))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in TRIGGERS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    schema_editor.execute("DROP TABLE IF EXISTS api_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_invoice_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantValuation',
+            fields=[
+                ('product_variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='valuation', serialize=False, to='api.productvariant')),
+                ('quantity', models.IntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('cogs', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('last_unit_cost', models.DecimalField(decimal_places=4, default=0, max_digits=12)),
+            ],
+            options={
+                'db_table': 'variant_valuation',
+            },
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=16, null=True),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(blank=True, default='', max_length=50)),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('quantity', models.IntegerField()),
+                ('remaining', models.IntegerField()),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('movement', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.stockmovement')),
+                ('product_variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='api.productvariant')),
+            ],
+            options={
+                'db_table': 'cost_layer',
+                'indexes': [models.Index(condition=models.Q(('remaining__gt', 0)), fields=['product_variant', 'id'], name='cost_layer_open_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_inventory_valuation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='reorder_point',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
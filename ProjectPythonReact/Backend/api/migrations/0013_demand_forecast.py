@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_variant_reorder_point'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('product_variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='api.productvariant')),
+                ('method', models.CharField(choices=[('ses', 'Simple exponential smoothing'), ('seasonal_naive', 'Seasonal naive (weekly)')], max_length=20)),
+                ('alpha', models.FloatField(blank=True, null=True)),
+                ('mae', models.FloatField()),
+                ('history_days', models.PositiveIntegerField()),
+                ('horizon_days', models.PositiveIntegerField()),
+                ('daily', models.JSONField()),
+                ('total', models.FloatField()),
+                ('generated_on', models.DateField()),
+            ],
+            options={
+                'db_table': 'demand_forecast',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailyvariantsales',
+            index=models.Index(fields=['product_variant', 'date', 'units'], name='daily_variant_sales_hist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demandforecast',
+            index=models.Index(fields=['-total'], name='demand_forecast_total_idx'),
+        ),
+    ]
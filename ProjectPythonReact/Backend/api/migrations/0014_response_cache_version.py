@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:39
+
+import time
+
+from django.db import migrations, models
+
+# Namespaces of the response cache (api/cache.py), starting at the time of the migration.
+NAMESPACES = ('categories', 'delivery_methods', 'suppliers', 'products', 'customers', 'invoices', 'forecasts')
+
+
+def create_versions(apps, schema_editor):
+    ResponseCacheVersion = apps.get_model('api', 'ResponseCacheVersion')
+    now = time.time_ns() // 1000
+    ResponseCacheVersion.objects.bulk_create([
+        ResponseCacheVersion(namespace=namespace, version=now) for namespace in NAMESPACES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_demand_forecast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseCacheVersion',
+            fields=[
+                ('namespace', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'response_cache_version',
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
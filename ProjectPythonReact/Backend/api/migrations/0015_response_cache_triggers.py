@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:05
+
+from django.db import migrations
+
+# table -> response cache namespaces whose output includes its rows (api/signals.py, api/cache.py)
+DEPENDENCIES = {
+    'api_category': ('categories', 'products'),
+    'delivery_methods': ('delivery_methods', 'invoices'),
+    'api_supplier': ('suppliers', 'products'),
+    'api_product': ('products',),
+    'api_productvariant': ('products',),
+    'api_purchase': ('products',),
+    'api_customer': ('customers', 'invoices'),
+    'api_invoice': ('invoices',),
+    'api_invoiceitem': ('invoices',),
+    'demand_forecast': ('forecasts',),
+}
+
+EVENTS = ('insert', 'update', 'delete')
+
+# Same rule as api.cache.invalidate(): above the current version and the current time in microseconds.
+BUMP = """
+    UPDATE response_cache_version
+    SET version = MAX(version + 1, CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER))
+    WHERE namespace IN ({namespaces});
+"""
+
+
+def trigger_name(table, event):
+    return f'response_cache_{table}_{event}'
+
+
+def create_triggers(apps, schema_editor):
+    # Other databases bump the versions from api.cache.invalidate().
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, namespaces in DEPENDENCIES.items():
+        body = BUMP.format(namespaces=', '.join(f"'{namespace}'" for namespace in namespaces))
+        for event in EVENTS:
+            schema_editor.execute(
+                f"CREATE TRIGGER {trigger_name(table, event)} AFTER {event.upper()} ON {table} BEGIN {body} END"
+            )
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in DEPENDENCIES:
+        for event in EVENTS:
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {trigger_name(table, event)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_response_cache_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
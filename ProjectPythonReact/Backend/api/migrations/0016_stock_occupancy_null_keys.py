@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    # The previous constraint let rows whose keys include NULL repeat; fold them into one row per key.
+    StockOccupancy = apps.get_model('api', 'StockOccupancy')
+    duplicates = StockOccupancy.objects.values('warehouse_id', 'shelf_id', 'product_variant_id').annotate(
+        rows=Count('id'), first=Min('id'), total=Sum('quantity'),
+    ).filter(rows__gt=1).order_by()
+    for row in duplicates:
+        keys = StockOccupancy.objects.filter(
+            warehouse_id=row['warehouse_id'], shelf_id=row['shelf_id'], product_variant_id=row['product_variant_id'],
+        )
+        keys.exclude(id=row['first']).delete()
+        keys.filter(id=row['first']).update(quantity=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_response_cache_triggers'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='stockoccupancy',
+            name='unique_stock_occupancy',
+        ),
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='stockoccupancy',
+            index=models.Index(fields=['warehouse', 'shelf', 'product_variant'], name='stock_occupancy_key_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockoccupancy',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('warehouse', 0, output_field=models.IntegerField()), django.db.models.functions.comparison.Coalesce('shelf', 0, output_field=models.IntegerField()), django.db.models.functions.comparison.Coalesce('product_variant', 0, output_field=models.IntegerField()), name='unique_stock_occupancy'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_stock_occupancy_null_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='delivery_method',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='api.deliverymethod'),
+        ),
+        migrations.AlterField(
+            model_name='invoiceitem',
+            name='variant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.productvariant'),
+        ),
+    ]
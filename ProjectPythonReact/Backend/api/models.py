@@ -1,13 +1,19 @@
 from django.db import models
+import os
+import threading
 import uuid
+from decimal import Decimal
 from model_utils import FieldTracker
 import random
 import logging
 logger = logging.getLogger(__name__)  # This gets a logger named after the module
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.db.models import Sum, Q
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
+from django.conf import settings
+from .cache import invalidate as invalidate_cached_responses
 #Supplier model
 class Supplier(models.Model):
     name = models.CharField(max_length=255)
@@ -25,10 +31,104 @@ class Category(models.Model):
 
     def __str__(self):
         return self.name
+#barcode sequence model
+class BarcodeSequence(models.Model):
+    """Next unused value of a barcode sequence; processes reserve blocks of values from it."""
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    class Meta:
+        db_table = 'barcode_sequence'
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+#response cache version model
+class ResponseCacheVersion(models.Model):
+    """Version of a response cache namespace (api/cache.py), shared by every process on the database."""
+    namespace = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)  # microseconds since the epoch of the last change, or later
+
+    class Meta:
+        db_table = 'response_cache_version'
+
+    def __str__(self):
+        return f"{self.namespace}: {self.version}"
+
+
+class BarcodeAllocator:
+    """
+    Hands out sequence values from blocks reserved in BarcodeSequence, so most
+    allocations need no query and concurrent processes never get the same value.
+
+    Only blocks reserved in autocommit mode are cached for later calls; inside a
+    transaction exactly the requested values are reserved, because a rollback would
+    return them to the table while this process still held them.
+    """
+    def __init__(self, name, block_size=100):
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._next = 0
+        self._limit = 0
+
+    def allocate(self, count=1):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's block is not ours to use.
+                self._reset()
+            cached = min(count, self._limit - self._next)
+            values = list(range(self._next, self._next + cached))
+            self._next += cached
+
+            missing = count - cached
+            if missing:
+                if transaction.get_connection().in_atomic_block:
+                    start = self._reserve(missing)
+                    values.extend(range(start, start + missing))
+                else:
+                    size = max(missing, self.block_size)
+                    start = self._reserve(size)
+                    values.extend(range(start, start + missing))
+                    self._next, self._limit = start + missing, start + size
+            return values
+
+    def _reserve(self, size):
+        """Atomically advance the sequence by `size` and return the first reserved value."""
+        with transaction.atomic():
+            sequence = BarcodeSequence.objects.filter(name=self.name)
+            if sequence.update(next_value=models.F('next_value') + size):
+                return sequence.values_list('next_value', flat=True).get() - size
+            start = self._first_free_value()
+            try:
+                with transaction.atomic():
+                    BarcodeSequence.objects.create(name=self.name, next_value=start + size)
+                return start
+            except IntegrityError:
+                # Another process created the row first; reserve from it instead.
+                sequence.update(next_value=models.F('next_value') + size)
+                return sequence.values_list('next_value', flat=True).get() - size
+
+    @staticmethod
+    def _first_free_value():
+        # Barcodes are zero-padded, so the greatest one sorts last.
+        last_barcode = Product.objects.order_by('-barcode').values_list('barcode', flat=True).first()
+        return int(last_barcode[1:]) + 1 if last_barcode else 1
+
+
+barcode_allocator = BarcodeAllocator('product')
+
+
+def allocate_barcodes(count):
+    """Reserve `count` product barcodes at once, e.g. for bulk product creation."""
+    return [f"P{str(value).zfill(11)}" for value in barcode_allocator.allocate(count)]  # e.g., P00000000001
+
+
 def generate_sequential_barcode():
-    last_product = Product.objects.order_by('-id').first()
-    last_id = int(last_product.barcode[1:]) if last_product and last_product.barcode else 0
-    return f"P{str(last_id + 1).zfill(11)}"  # e.g., P00000000001
+    return allocate_barcodes(1)[0]
 class Product(models.Model):
     name = models.CharField(max_length=100, null=False)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
@@ -127,14 +227,65 @@ class ProductVariant(models.Model):
     stock_quantity = models.IntegerField(default=0,null=True, blank=True)
     purchase_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # Restock when stock falls to this level; when unset it follows sales velocity (see api/restock.py).
+    reorder_point = models.PositiveIntegerField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.product.name} - {self.size or 'No Size'} - {self.color or 'No Color'}"
 
-    def save(self, *args, **kwargs):
-        print(f"Saving ProductVariant {self.id}, stock_quantity={self.stock_quantity}")  # Debug
-        super().save(*args, **kwargs)
-        print(f"Saved ProductVariant {self.id}, stock_quantity={self.stock_quantity}")  # Debug
+    @classmethod
+    def increment_stock(cls, quantities, batch_size=1000):
+        """Add {variant_id: quantity} to stock with one relative UPDATE per batch of variants."""
+        items = [(variant_id, quantity) for variant_id, quantity in quantities.items() if quantity]
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            delta = models.Case(
+                *[models.When(pk=variant_id, then=models.Value(quantity)) for variant_id, quantity in batch],
+                output_field=models.IntegerField(),
+            )
+            cls.objects.filter(pk__in=[variant_id for variant_id, _ in batch]).update(
+                stock_quantity=Coalesce(models.F('stock_quantity'), 0) + delta
+            )
+        if items:
+            # Queryset updates send no signals; the product list shows variant stock.
+            invalidate_cached_responses('products')
+
+    @classmethod
+    def decrement_stock(cls, quantities):
+        """
+        Take {variant_id: quantity} out of stock in a single conditional UPDATE.
+        Either every variant had enough stock and all are decremented, or nothing
+        changes and InsufficientStock is raised with the variants that were short.
+        """
+        quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        needed = models.Case(
+            *[models.When(pk=variant_id, then=models.Value(quantity)) for variant_id, quantity in quantities.items()],
+            output_field=models.IntegerField(),
+        )
+        try:
+            with transaction.atomic():
+                updated = cls.objects.filter(pk__in=quantities, stock_quantity__gte=needed).update(
+                    stock_quantity=models.F('stock_quantity') - needed
+                )
+                if updated != len(quantities):
+                    raise InsufficientStock({})
+                invalidate_cached_responses('products')
+        except InsufficientStock:
+            available = dict(cls.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity'))
+            raise InsufficientStock({
+                variant_id: (quantity, available.get(variant_id) or 0)
+                for variant_id, quantity in quantities.items()
+                if (available.get(variant_id) or 0) < quantity
+            })
+
+
+class InsufficientStock(Exception):
+    """Raised by ProductVariant.decrement_stock; `shortages` maps variant_id -> (requested, available)."""
+    def __init__(self, shortages):
+        super().__init__(shortages)
+        self.shortages = shortages
 # Invoice Model
 # Models
 class InvoiceItem(models.Model):
@@ -146,14 +297,23 @@ class InvoiceItem(models.Model):
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0.00)
     total_price = models.DecimalField(max_digits=12, decimal_places=2)
 
-    def save(self, *args, **kwargs):
+    def calculate_total_price(self):
         # Ensure unit_price and discount_percentage are not None
-        unit_price = self.unit_price if self.unit_price is not None else 0
-        discount_percentage = self.discount_percentage if self.discount_percentage is not None else 0
-        # Calculate total_price
+        unit_price = Decimal(str(self.unit_price)) if self.unit_price is not None else Decimal('0')
+        discount_percentage = Decimal(str(self.discount_percentage)) if self.discount_percentage is not None else Decimal('0')
         discount = unit_price * (discount_percentage / 100)
-        self.total_price = (unit_price - discount) * self.quantity
-        super().save(*args, **kwargs)
+        return (unit_price - discount) * self.quantity
+
+    def save(self, *args, **kwargs):
+        self.total_price = self.calculate_total_price()
+        # Keep the daily sales rollup in step with this line inside the same transaction.
+        with transaction.atomic():
+            if not self._state.adding:
+                previous = InvoiceItem.objects.select_related('invoice').filter(pk=self.pk).first()
+                if previous is not None:
+                    DailyVariantSales.apply(previous.invoice, [previous], sign=-1)
+            super().save(*args, **kwargs)
+            DailyVariantSales.apply(self.invoice, [self])
 
     def __str__(self):
         return f"Item {self.id} - {self.product.name} - Invoice {self.invoice.id}"
@@ -189,16 +349,52 @@ class Invoice(models.Model):
     tax = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     total = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
     total_in_riel = models.DecimalField(max_digits=15, decimal_places=2, default=0.00)
-    tracker = FieldTracker(fields=['status'])
+    # The fields the sales rollups are keyed or summed on; see save().
+    tracker = FieldTracker(fields=['status', 'type', 'date', 'customer', 'subtotal', 'tax', 'total'])
+
+    # Invoices in these states are not sales and stay out of the rollups, as do quotations.
+    NON_SALE_STATUSES = ('DRAFT', 'CANCELLED')
+
+    class Meta:
+        # Invoice listings filter on these columns and order by date (see api/filters.py).
+        indexes = [
+            models.Index(fields=['date'], name='invoice_date_idx'),
+            models.Index(fields=['status', 'date'], name='invoice_status_date_idx'),
+            models.Index(fields=['customer', 'date'], name='invoice_customer_date_idx'),
+            models.Index(fields=['payment_method', 'date'], name='invoice_payment_date_idx'),
+        ]
 
     def __str__(self):
         return f"Invoice {self.id} - {self.customer}"
 
+    @property
+    def counts_as_sale(self):
+        return self.type == 'invoice' and self.status not in self.NON_SALE_STATUSES
+
     def save(self, *args, **kwargs):
         # Remove the calculation logic from here
         # We'll handle calculations in the serializer after creating related items
         logger.info(f"Saving invoice {self.id or 'new'} with status {self.status}")
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        changed = {} if adding else self.tracker.changed()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                # Items are added by whoever creates them (InvoiceItem.save, InvoiceSerializer.create).
+                DailyCustomerSales.apply(self)
+            elif changed:
+                # Move this invoice out of the rollups as it was and back in as it is now.
+                previous = Invoice(pk=self.pk, **{
+                    field: changed.get(field, getattr(self, field))
+                    for field in ('status', 'type', 'date', 'subtotal', 'tax', 'total')
+                })
+                previous.customer_id = changed.get('customer', self.customer_id)
+                DailyCustomerSales.apply(previous, sign=-1)
+                DailyCustomerSales.apply(self)
+                if changed.keys() & {'status', 'type', 'date'}:
+                    items = list(self.items.all())
+                    DailyVariantSales.apply(previous, items, sign=-1)
+                    DailyVariantSales.apply(self, items)
 #stock model
 class StockMovement(models.Model):
     MOVEMENT_TYPES = (
@@ -214,9 +410,472 @@ class StockMovement(models.Model):
     movement_date = models.DateTimeField(auto_now_add=True)
     purchase = models.ForeignKey('Purchase', on_delete=models.CASCADE, null=True, blank=True)
     invoice_item = models.ForeignKey('InvoiceItem', on_delete=models.CASCADE, null=True, blank=True)
+    # Stock value the movement added (IN) or took out as cost of goods sold (OUT); set by VariantValuation.apply.
+    cost = models.DecimalField(max_digits=16, decimal_places=4, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Covers the signed-quantity SUM of a variant's movements (api/ledger.py) without reading the table.
+            models.Index(fields=['product_variant', 'movement_type', 'quantity'], name='stock_movement_variant_idx'),
+        ]
 
     def __str__(self):
         return f"{self.movement_type} - {self.product.name} - {self.quantity}"
+
+    @property
+    def signed_quantity(self):
+        return self.quantity if self.movement_type == 'IN' else -self.quantity
+
+    def save(self, *args, **kwargs):
+        # Keep StockOccupancy in step with this movement inside the same transaction.
+        with transaction.atomic():
+            if not self._state.adding:
+                previous = StockMovement.objects.filter(pk=self.pk).first()
+                if previous is not None:
+                    StockOccupancy.apply([previous], sign=-1)
+                    StockCheckpoint.invalidate([previous, self])
+                    VariantValuation.apply([previous], sign=-1)
+            super().save(*args, **kwargs)
+            StockOccupancy.apply([self])
+            VariantValuation.apply([self])
+
+#stock occupancy model
+class StockOccupancy(models.Model):
+    """Running on-hand quantity per (warehouse, shelf, variant), maintained from StockMovement writes."""
+    warehouse = models.ForeignKey('Warehouse', on_delete=models.CASCADE, null=True, blank=True, related_name='stock_occupancy')
+    shelf = models.ForeignKey('Shelf', on_delete=models.CASCADE, null=True, blank=True, related_name='stock_occupancy')
+    product_variant = models.ForeignKey('ProductVariant', on_delete=models.CASCADE, null=True, blank=True, related_name='stock_occupancy')
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'stock_occupancy'
+        constraints = [
+            # On the coalesced keys: a plain unique constraint lets rows with NULL keys repeat.
+            models.UniqueConstraint(
+                Coalesce('warehouse', 0, output_field=models.IntegerField()),
+                Coalesce('shelf', 0, output_field=models.IntegerField()),
+                Coalesce('product_variant', 0, output_field=models.IntegerField()),
+                name='unique_stock_occupancy',
+            ),
+        ]
+        indexes = [
+            # The key lookups of apply() compare the columns themselves.
+            models.Index(fields=['warehouse', 'shelf', 'product_variant'], name='stock_occupancy_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.warehouse_id}/{self.shelf_id}/{self.product_variant_id}: {self.quantity}"
+
+    @classmethod
+    def apply(cls, movements, sign=1, create=True):
+        """
+        Add (sign=1) or remove (sign=-1) the effect of `movements` on the occupancy rows.
+        Deltas are summed per key first; a batch costs a chunked lookup, a bulk UPDATE and a bulk INSERT.
+        With create=False missing rows are left alone (used while cascading deletes).
+        """
+        deltas = {}
+        for movement in movements:
+            key = (movement.warehouse_id, movement.shelf_id, movement.product_variant_id)
+            deltas[key] = deltas.get(key, 0) + sign * movement.signed_quantity
+
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        with transaction.atomic():
+            if len(deltas) == 1:
+                cls._apply_one(*next(iter(deltas.items())), create)
+                return
+
+            # Batches: find the existing rows in one query, then one relative bulk UPDATE and one bulk INSERT.
+            existing = {}
+            key_list = list(deltas)
+            # OR-ed key lookups in chunks; SQLite caps expression depth at 1000.
+            for start in range(0, len(key_list), 500):
+                keys = models.Q()
+                for warehouse_id, shelf_id, variant_id in key_list[start:start + 500]:
+                    keys |= models.Q(warehouse_id=warehouse_id, shelf_id=shelf_id, product_variant_id=variant_id)
+                for row in cls.objects.filter(keys).only('id', 'warehouse_id', 'shelf_id', 'product_variant_id'):
+                    existing[(row.warehouse_id, row.shelf_id, row.product_variant_id)] = row
+            for key, row in existing.items():
+                row.quantity = models.F('quantity') + deltas[key]
+            cls.objects.bulk_update(existing.values(), ['quantity'], batch_size=500)
+            missing = {key: delta for key, delta in deltas.items() if key not in existing}
+            if create and missing:
+                try:
+                    with transaction.atomic():
+                        cls.objects.bulk_create([
+                            cls(warehouse_id=warehouse_id, shelf_id=shelf_id, product_variant_id=variant_id, quantity=delta)
+                            for (warehouse_id, shelf_id, variant_id), delta in missing.items()
+                        ], batch_size=500)
+                except IntegrityError:
+                    # A concurrent transaction inserted some of the keys first.
+                    for key, delta in missing.items():
+                        cls._apply_one(key, delta, create)
+
+    @classmethod
+    def _add(cls, key, delta):
+        warehouse_id, shelf_id, variant_id = key
+        rows = cls.objects.filter(warehouse_id=warehouse_id, shelf_id=shelf_id, product_variant_id=variant_id)
+        return rows.update(quantity=models.F('quantity') + delta)
+
+    @classmethod
+    def _apply_one(cls, key, delta, create):
+        if cls._add(key, delta) or not create:
+            return
+        warehouse_id, shelf_id, variant_id = key
+        try:
+            with transaction.atomic():
+                cls.objects.create(warehouse_id=warehouse_id, shelf_id=shelf_id, product_variant_id=variant_id, quantity=delta)
+        except IntegrityError:
+            # Inserted by a concurrent transaction since the UPDATE: add to that row instead.
+            cls._add(key, delta)
+#stock checkpoint model
+class StockCheckpoint(models.Model):
+    """
+    Balance of a variant through StockMovement id `position` (inclusive).
+    Stock is the latest checkpoint's balance plus the movements after it; see api/ledger.py.
+    """
+    product_variant = models.ForeignKey('ProductVariant', on_delete=models.CASCADE, related_name='stock_checkpoints')
+    position = models.BigIntegerField()
+    as_of = models.DateTimeField()
+    balance = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'stock_checkpoint'
+        indexes = [
+            models.Index(fields=['product_variant', 'position'], name='stock_checkpoint_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"Variant {self.product_variant_id} @ {self.position}: {self.balance}"
+
+    @classmethod
+    def invalidate(cls, movements):
+        """Drop checkpoints that already include a movement that is being changed or removed."""
+        for movement in movements:
+            if movement.pk and movement.product_variant_id:
+                cls.objects.filter(product_variant_id=movement.product_variant_id, position__gte=movement.pk).delete()
+#inventory valuation models
+class CostLayer(models.Model):
+    """Units received at one unit cost (a purchase batch); OUT movements consume the oldest open layers first."""
+    product_variant = models.ForeignKey('ProductVariant', on_delete=models.CASCADE, related_name='cost_layers')
+    # The IN movement that received the units. No FK constraint: the layer is looked up while that movement is deleted.
+    movement = models.ForeignKey('StockMovement', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    batch_number = models.CharField(max_length=50, blank=True, default='')
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4)
+    quantity = models.IntegerField()
+    remaining = models.IntegerField()
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'cost_layer'
+        indexes = [
+            models.Index(fields=['product_variant', 'id'], condition=Q(remaining__gt=0), name='cost_layer_open_idx'),
+        ]
+
+    def __str__(self):
+        return f"Variant {self.product_variant_id} {self.batch_number}: {self.remaining}/{self.quantity} @ {self.unit_cost}"
+
+
+class VariantValuation(models.Model):
+    """
+    On-hand quantity, stock value and cumulative cost of goods sold of a variant,
+    maintained from StockMovement writes like StockOccupancy. The valuation method is
+    settings.INVENTORY_VALUATION_METHOD: 'fifo' costs OUT movements from the oldest
+    cost layers, 'average' at the variant's weighted-average unit cost.
+    """
+    product_variant = models.OneToOneField('ProductVariant', on_delete=models.CASCADE, primary_key=True, related_name='valuation')
+    quantity = models.IntegerField(default=0)
+    value = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    cogs = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    last_unit_cost = models.DecimalField(max_digits=12, decimal_places=4, default=0)
+
+    class Meta:
+        db_table = 'variant_valuation'
+
+    def __str__(self):
+        return f"Variant {self.product_variant_id}: {self.quantity} valued {self.value}"
+
+    @property
+    def unit_cost(self):
+        # Stock that went negative is costed at the last known unit cost.
+        return self.value / self.quantity if self.quantity > 0 else self.last_unit_cost
+
+    @classmethod
+    def apply(cls, movements, sign=1):
+        """
+        Add (sign=1) or remove (sign=-1) saved `movements`, in order, to the valuations and cost layers
+        and store the cost of new movements. IN movements open a layer at their purchase price; OUT
+        movements consume layers oldest first. Removing an OUT movement returns its units as a layer at
+        the cost they were issued at; removing an IN movement drops what is left of its layer, and the
+        units already issued from it become negative stock at the last unit cost.
+        A batch costs a handful of queries whatever its size. The valuation rows are locked while
+        they are read, so concurrent batches on the same variants apply one after the other.
+        """
+        movements = [movement for movement in movements if movement.pk and movement.product_variant_id]
+        if not movements:
+            return
+        fifo = getattr(settings, 'INVENTORY_VALUATION_METHOD', 'fifo') == 'fifo'
+        adds = lambda movement: (movement.movement_type == 'IN') == (sign == 1)
+
+        with transaction.atomic():
+            variant_ids = list({movement.product_variant_id: None for movement in movements})
+            locked = cls.objects.select_for_update()
+            valuations = {}
+            for start in range(0, len(variant_ids), 500):
+                valuations.update(locked.in_bulk(variant_ids[start:start + 500]))
+            missing = [variant_id for variant_id in variant_ids if variant_id not in valuations] if sign == 1 else []
+            if missing:
+                # Insert the missing rows first (or find a concurrent insert's), so they are locked like the others.
+                cls.objects.bulk_create([cls(product_variant_id=variant_id) for variant_id in missing],
+                                        batch_size=500, ignore_conflicts=True)
+                for start in range(0, len(missing), 500):
+                    valuations.update(locked.in_bulk(missing[start:start + 500]))
+
+            # Open layers of the variants that issue stock, oldest first; layers opened in this batch are appended.
+            open_layers = {variant_id: [] for variant_id in variant_ids}
+            issuing = list({movement.product_variant_id: None for movement in movements if sign == 1 and not adds(movement)})
+            for start in range(0, len(issuing), 500):
+                for layer in CostLayer.objects.filter(product_variant_id__in=issuing[start:start + 500], remaining__gt=0).order_by('pk'):
+                    open_layers[layer.product_variant_id].append(layer)
+            removed_ins = [movement.pk for movement in movements if sign == -1 and movement.movement_type == 'IN']
+            layers_by_movement = {
+                layer.movement_id: layer for layer in CostLayer.objects.filter(movement_id__in=removed_ins)
+            } if removed_ins else {}
+            purchase_field = StockMovement._meta.get_field('purchase')
+            purchase_ids = [
+                movement.purchase_id for movement in movements
+                if sign == 1 and movement.purchase_id and not purchase_field.is_cached(movement)
+            ]
+            purchases = Purchase.objects.in_bulk(purchase_ids) if purchase_ids else {}
+
+            new_layers, touched_layers, dropped_layers, costed = [], {}, [], []
+            for movement in movements:
+                valuation = valuations.get(movement.product_variant_id)
+                if valuation is None:
+                    continue  # the variant is being deleted
+                quantity = movement.quantity
+                if adds(movement):
+                    if sign == 1:
+                        purchase = purchases.get(movement.purchase_id) or (movement.purchase if movement.purchase_id else None)
+                        unit_cost = Decimal(str(purchase.purchase_price)) if purchase else valuation.unit_cost
+                        batch_number = purchase.batch_number if purchase else ''
+                        valuation.last_unit_cost = unit_cost
+                        cost = unit_cost * quantity
+                        if movement.cost != cost:  # purchases set it when they write the movement
+                            movement.cost = cost
+                            costed.append(movement)
+                    else:
+                        unit_cost = (movement.cost or Decimal('0')) / quantity
+                        batch_number = ''
+                        valuation.cogs -= movement.cost or 0
+                    # Units first fill stock that had gone negative; the rest stays open in the layer.
+                    remaining = quantity - min(max(-valuation.quantity, 0), quantity)
+                    layer = CostLayer(
+                        product_variant_id=movement.product_variant_id, movement=movement if sign == 1 else None,
+                        batch_number=batch_number, unit_cost=unit_cost, quantity=quantity, remaining=remaining,
+                    )
+                    new_layers.append(layer)
+                    if remaining:
+                        open_layers[movement.product_variant_id].append(layer)
+                    valuation.quantity += quantity
+                    valuation.value += unit_cost * quantity
+                elif sign == 1:
+                    average_cost = valuation.unit_cost
+                    cost, left = Decimal('0'), quantity
+                    for layer in open_layers[movement.product_variant_id]:
+                        if not left:
+                            break
+                        if not layer.remaining:
+                            continue
+                        taken = min(layer.remaining, left)
+                        layer.remaining -= taken
+                        left -= taken
+                        cost += taken * layer.unit_cost
+                        if layer.pk:
+                            touched_layers[layer.pk] = layer
+                    cost += left * valuation.last_unit_cost
+                    if not fifo:
+                        cost = average_cost * quantity
+                    movement.cost = cost
+                    costed.append(movement)
+                    valuation.quantity -= quantity
+                    valuation.value -= cost
+                    valuation.cogs += cost
+                else:
+                    layer = layers_by_movement.get(movement.pk)
+                    remaining = quantity if layer is None else layer.remaining
+                    unit_cost = layer.unit_cost if fifo and layer is not None else valuation.unit_cost
+                    valuation.value -= remaining * unit_cost + (quantity - remaining) * valuation.last_unit_cost
+                    valuation.quantity -= quantity
+                    if layer is not None:
+                        dropped_layers.append(layer.pk)
+                if valuation.quantity == 0:
+                    valuation.value = Decimal('0')
+
+            cls.objects.bulk_update(
+                valuations.values(), ['quantity', 'value', 'cogs', 'last_unit_cost'], batch_size=500,
+            )
+            CostLayer.objects.bulk_update(touched_layers.values(), ['remaining'], batch_size=500)
+            CostLayer.objects.filter(pk__in=dropped_layers).delete()
+            CostLayer.objects.bulk_create(new_layers, batch_size=500)
+            StockMovement.objects.bulk_update(costed, ['cost'], batch_size=500)
+#sales rollup models
+def apply_rollup_deltas(model, deltas):
+    """
+    Add {key: {field: delta}} to the rollup rows of `model` (keyed by model.KEY_FIELDS), inserting missing rows.
+    Like StockOccupancy.apply, a batch costs a chunked lookup, a relative bulk UPDATE and a bulk INSERT.
+    """
+    if not deltas:
+        return
+    with transaction.atomic():
+        if len(deltas) == 1:
+            key, values = next(iter(deltas.items()))
+            key = dict(zip(model.KEY_FIELDS, key))
+            if not model.objects.filter(**key).update(**{field: models.F(field) + value for field, value in values.items()}):
+                model.objects.create(**key, **values)
+            return
+
+        existing = {}
+        key_list = list(deltas)
+        # OR-ed key lookups in chunks; SQLite caps expression depth at 1000.
+        for start in range(0, len(key_list), 500):
+            keys = models.Q()
+            for key in key_list[start:start + 500]:
+                keys |= models.Q(**dict(zip(model.KEY_FIELDS, key)))
+            for row in model.objects.filter(keys).only('id', *model.KEY_FIELDS):
+                existing[tuple(getattr(row, field) for field in model.KEY_FIELDS)] = row
+        fields = list(next(iter(deltas.values())))
+        for key, row in existing.items():
+            for field, value in deltas[key].items():
+                setattr(row, field, models.F(field) + value)
+        model.objects.bulk_update(existing.values(), fields, batch_size=500)
+        model.objects.bulk_create([
+            model(**dict(zip(model.KEY_FIELDS, key)), **values) for key, values in deltas.items() if key not in existing
+        ], batch_size=500)
+
+
+class DailyVariantSales(models.Model):
+    """
+    Units and line revenue per (day, product, variant) of the invoices that count as sales.
+    Maintained by InvoiceItem.save, Invoice.save and the delete signals; rebuilt by `manage.py rebuild_sales_rollups`.
+    """
+    KEY_FIELDS = ('date', 'product_id', 'product_variant_id')
+
+    date = models.DateField()
+    # No FK constraint: the history stays when a product or variant is removed from the catalog. The lines
+    # of a deleted product are not subtracted (see api/signals.py) and a deleted variant's rows move to
+    # product_variant=None, like its invoice lines. rebuild_sales_rollups only recounts the remaining lines.
+    product = models.ForeignKey('Product', on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    product_variant = models.ForeignKey('ProductVariant', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'daily_variant_sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product', 'product_variant'], name='unique_daily_variant_sales'),
+        ]
+        indexes = [
+            # Per-variant history reads of the demand forecast (api/forecasting.py).
+            models.Index(fields=['product_variant', 'date', 'units'], name='daily_variant_sales_hist_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_id}/{self.product_variant_id}: {self.units} units, {self.revenue}"
+
+    @classmethod
+    def apply(cls, invoice, items, sign=1):
+        """Add (sign=1) or remove (sign=-1) invoice `items` as sold on `invoice`'s date, if it counts as a sale."""
+        if not invoice.counts_as_sale:
+            return
+        day = Invoice._meta.get_field('date').to_python(invoice.date)
+        deltas = {}
+        for item in items:
+            values = deltas.setdefault((day, item.product_id, item.variant_id), {'units': 0, 'revenue': Decimal('0')})
+            values['units'] += sign * item.quantity
+            values['revenue'] += sign * item.total_price
+        apply_rollup_deltas(cls, deltas)
+
+    @classmethod
+    def detach_variants(cls, variant_ids):
+        """Move the rows of `variant_ids` to product_variant=None, as deleting a variant does to its invoice lines."""
+        with transaction.atomic():
+            rows = cls.objects.filter(product_variant_id__in=variant_ids)
+            deltas = {}
+            for day, product_id, units, revenue in rows.values_list('date', 'product_id', 'units', 'revenue'):
+                values = deltas.setdefault((day, product_id, None), {'units': 0, 'revenue': Decimal('0')})
+                values['units'] += units
+                values['revenue'] += revenue
+            rows.delete()
+            apply_rollup_deltas(cls, deltas)
+
+
+class DailyCustomerSales(models.Model):
+    """Invoice count and invoiced amounts per (day, customer) of the invoices that count as sales."""
+    KEY_FIELDS = ('date', 'customer_id')
+
+    date = models.DateField()
+    customer = models.ForeignKey('Customer', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    invoice_count = models.IntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'daily_customer_sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'customer'], name='unique_daily_customer_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.customer_id}: {self.invoice_count} invoices, {self.revenue}"
+
+    @classmethod
+    def apply(cls, invoice, sign=1):
+        """Add (sign=1) or remove (sign=-1) `invoice`, if it counts as a sale."""
+        if not invoice.counts_as_sale:
+            return
+        day = Invoice._meta.get_field('date').to_python(invoice.date)
+        to_decimal = lambda value: Decimal(str(value)) if value is not None else Decimal('0')
+        apply_rollup_deltas(cls, {(day, invoice.customer_id): {
+            'invoice_count': sign,
+            'subtotal': sign * to_decimal(invoice.subtotal),
+            'tax': sign * to_decimal(invoice.tax),
+            'revenue': sign * to_decimal(invoice.total),
+        }})
+class DemandForecast(models.Model):
+    """
+    Expected daily unit sales of a variant over the next `horizon_days`, fitted from its
+    DailyVariantSales history by `manage.py forecast_demand` (see api/forecasting.py).
+    """
+    METHOD_CHOICES = [
+        ('ses', 'Simple exponential smoothing'),
+        ('seasonal_naive', 'Seasonal naive (weekly)'),
+    ]
+
+    product_variant = models.OneToOneField('ProductVariant', on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES)
+    alpha = models.FloatField(null=True, blank=True)  # smoothing factor of 'ses' forecasts
+    mae = models.FloatField()  # in-sample mean absolute one-step error, units per day
+    history_days = models.PositiveIntegerField()
+    horizon_days = models.PositiveIntegerField()
+    daily = models.JSONField()  # forecast units for each day after generated_on
+    total = models.FloatField()
+    generated_on = models.DateField()
+
+    class Meta:
+        db_table = 'demand_forecast'
+        indexes = [
+            models.Index(fields=['-total'], name='demand_forecast_total_idx'),
+        ]
+
+    def __str__(self):
+        return f"Variant {self.product_variant_id}: {self.total:.1f} units over {self.horizon_days} days ({self.method})"
+
+
 #purchase model
 # models.py
 class Purchase(models.Model):
@@ -230,6 +889,12 @@ class Purchase(models.Model):
     purchase_date = models.DateTimeField(auto_now_add=True)
     total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Latest purchase of a variant (ProductVariantSerializer purchase_price, purchase_set ordering).
+            models.Index(fields=['product_variant', '-purchase_date', '-id'], name='purchase_variant_date_idx'),
+        ]
+
     def __str__(self):
         return f"Purchase {self.id} - {self.product.name} ({self.batch_number})"
 
@@ -239,7 +904,6 @@ class Purchase(models.Model):
 
         # Check if this is a new purchase
         is_new = self._state.adding
-        print(f"Saving purchase {self.id or 'new'}, is_new={is_new}, product_variant={self.product_variant}")  # Debug
 
         with transaction.atomic():
             # Save the purchase first to get an ID
@@ -247,10 +911,8 @@ class Purchase(models.Model):
 
             # If there's a product variant and this is a new purchase, update stock
             if is_new and self.product_variant:
-                print(f"Before update: Variant {self.product_variant.id} stock_quantity={self.product_variant.stock_quantity}")  # Debug
-                self.product_variant.stock_quantity += self.quantity
-                self.product_variant.save()
-                print(f"After update: Variant {self.product_variant.id} stock_quantity={self.product_variant.stock_quantity}")  # Debug
+                ProductVariant.increment_stock({self.product_variant.id: self.quantity})
+                self.product_variant.refresh_from_db(fields=['stock_quantity'])
 
                 # Create a StockMovement entry
                 StockMovement.objects.create(
@@ -261,7 +923,37 @@ class Purchase(models.Model):
                     purchase=self,
                     warehouse=None,
                     shelf=None,
+                    cost=self.total,
+                )
+
+    @classmethod
+    def bulk_receive(cls, purchases):
+        """
+        Insert many new purchases at once: the purchases and their IN movements are
+        bulk-inserted and stock is raised with one aggregated delta per variant,
+        all in one transaction. Returns the saved purchases.
+        """
+        quantities = {}
+        for purchase in purchases:
+            purchase.total = purchase.quantity * purchase.purchase_price
+            if purchase.product_variant_id:
+                quantities[purchase.product_variant_id] = quantities.get(purchase.product_variant_id, 0) + purchase.quantity
+
+        with transaction.atomic():
+            cls.objects.bulk_create(purchases, batch_size=1000)
+            movements = [
+                StockMovement(
+                    product_id=purchase.product_id,
+                    product_variant_id=purchase.product_variant_id,
+                    movement_type='IN',
+                    quantity=purchase.quantity,
+                    purchase=purchase,
+                    cost=purchase.total,
                 )
-                print(f"Created StockMovement for purchase {self.id}")  # Debug
-            else:
-                print("Stock update skipped: is_new or product_variant condition not met")  # Debug
+                for purchase in purchases if purchase.product_variant_id
+            ]
+            StockMovement.objects.bulk_create(movements, batch_size=1000)
+            StockOccupancy.apply(movements)
+            VariantValuation.apply(movements)
+            ProductVariant.increment_stock(quantities)
+        return purchases
@@ -0,0 +1,165 @@
+# api/pagination.py
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) pagination over a fixed ordering, e.g. ('-movement_date', '-pk').
+
+    The cursor holds the ordering values of the last row of the page, and the
+    next page is fetched with a WHERE clause on those values instead of an
+    OFFSET, so deep pages cost the same as the first one. The last ordering
+    field must be unique (the primary key) to keep the ordering stable.
+
+    NULLs of nullable ordering fields sort before every value in ascending
+    order and after every value in descending order, on every database.
+
+    Pagination is opt-in: list views only paginate when the request carries
+    a `cursor` or `limit` query parameter, so existing clients keep getting
+    a plain list.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def __init__(self, ordering=('-pk',)):
+        self.ordering = tuple(ordering)
+        self.page_size = getattr(settings, 'API_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+        self.next_position = None
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        model = queryset.model
+
+        queryset = queryset.order_by(*self._order_by(model))
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            position = self.decode_cursor(encoded, model)
+            queryset = queryset.filter(self._after(position, model))
+
+        # Fetch one extra row to know whether there is a next page.
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        if len(rows) > page_size:
+            self.next_position = [self._value(page[-1], name.lstrip('-'), model) for name in self.ordering]
+        else:
+            self.next_position = None
+        return page
+
+    @staticmethod
+    def _is_nullable(field, model):
+        return field != 'pk' and model._meta.get_field(field).null
+
+    def _order_by(self, model):
+        order_by = []
+        for name in self.ordering:
+            field = name.lstrip('-')
+            if not self._is_nullable(field, model):
+                order_by.append(name)
+            elif name.startswith('-'):
+                order_by.append(F(field).desc(nulls_last=True))
+            else:
+                order_by.append(F(field).asc(nulls_first=True))
+        return order_by
+
+    @staticmethod
+    def _value(row, field, model):
+        # Rows are model instances, or dicts from a values() queryset.
+        if isinstance(row, dict):
+            return row[model._meta.pk.attname if field == 'pk' else field]
+        return getattr(row, field)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def _after(self, position, model):
+        # (a, b, c) > (x, y, z)  ==  a > x OR (a = x AND (b > y OR (b = y AND c > z)))
+        condition = None
+        for name, value in reversed(list(zip(self.ordering, position))):
+            field = name.lstrip('-')
+            strictly_after, equal = self._compare(field, name.startswith('-'), value, model)
+            if condition is None:
+                condition = strictly_after
+            else:
+                condition = strictly_after | (equal & condition)
+        return condition
+
+    def _compare(self, field, descending, value, model):
+        """(rows strictly after `value`, rows equal to it) in the ordering of `field`, as Q objects."""
+        lookup = '__lt' if descending else '__gt'
+        if not self._is_nullable(field, model):
+            return Q(**{field + lookup: value}), Q(**{field: value})
+        # NULL is below every value: first ascending, last descending.
+        is_null = Q(**{field + '__isnull': True})
+        if value is None:
+            return (Q(pk__in=[]) if descending else ~is_null), is_null
+        strictly_after = Q(**{field + lookup: value})
+        return (strictly_after | is_null if descending else strictly_after), Q(**{field: value})
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values, default=str).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, encoded, model):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            position = []
+            for name, value in zip(self.ordering, values):
+                field = name.lstrip('-')
+                model_field = model._meta.pk if field == 'pk' else model._meta.get_field(field)
+                if value is None and not model_field.null:
+                    raise ValueError
+                position.append(None if value is None else model_field.to_python(value))
+            return position
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+
+def paginated_list_response(request, queryset, serializer_class, ordering, context=None):
+    """
+    Serialize a list view, paginating with a keyset cursor when the client asks for it.
+    With serializer_class=None the queryset is a values() queryset and its rows are sent as they are.
+    """
+    paginator = KeysetPagination(ordering)
+    if paginator.is_requested(request):
+        page = paginator.paginate_queryset(queryset, request)
+        data = page if serializer_class is None else serializer_class(page, many=True, context=context or {}).data
+        return paginator.get_paginated_response(data)
+    if serializer_class is None:
+        return Response(list(queryset))
+    serializer = serializer_class(queryset, many=True, context=context or {})
+    return Response(serializer.data)
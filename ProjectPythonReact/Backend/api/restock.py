@@ -0,0 +1,99 @@
+# api/restock.py
+"""
+Low-stock scan.
+
+Stock and reorder points of every variant and the units each sold in the
+trailing window are read as two flat result sets (the sales from the
+DailyVariantSales rollup rather than InvoiceItem) and compared in NumPy,
+so the scan is two queries and a few array operations at any catalog size.
+
+A variant needs restocking when its stock is at or below its reorder point.
+Variants without a reorder point use the demand expected over the lead time:
+ceil(daily velocity * RESTOCK_LEAD_TIME_DAYS).
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import DailyVariantSales, ProductVariant
+
+MAX_LIMIT = 500
+
+
+def fetch_columns(queryset, columns):
+    """Rows of a values_list() queryset as an int64 array of shape (rows, columns), without building model rows."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return np.array(rows, dtype=np.int64).reshape(len(rows), columns)
+
+
+def low_stock(params):
+    try:
+        limit = min(max(int(params.get('limit', 100)), 1), MAX_LIMIT)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    window = getattr(settings, 'RESTOCK_SALES_WINDOW_DAYS', 30)
+    lead_time = getattr(settings, 'RESTOCK_LEAD_TIME_DAYS', 7)
+    since = timezone.localdate() - timedelta(days=window)
+
+    variants = fetch_columns(ProductVariant.objects.order_by('pk').values_list(
+        'pk', Coalesce('stock_quantity', Value(0)), Coalesce('reorder_point', Value(-1)),
+    ), 3)
+    sales = fetch_columns(DailyVariantSales.objects.filter(date__gt=since, product_variant__isnull=False).values_list(
+        'product_variant_id',
+    ).annotate(units=Sum('units')).order_by(), 2)
+
+    ids, stock, reorder_point = variants[:, 0], variants[:, 1], variants[:, 2]
+    sold = np.zeros(len(ids), dtype=np.int64)
+    if len(sales) and len(ids):
+        # Align the sales with the (sorted) variant ids; sales of deleted variants are dropped.
+        positions = np.searchsorted(ids, sales[:, 0])
+        known = positions < len(ids)
+        known[known] = ids[positions[known]] == sales[known, 0]
+        sold[positions[known]] = sales[known, 1]
+
+    velocity = sold / window
+    demand_point = np.ceil(velocity * lead_time)
+    has_point = reorder_point >= 0
+    low = np.where(has_point, stock <= reorder_point, (velocity > 0) & (stock <= demand_point))
+    cover = np.full(len(ids), np.inf)
+    np.divide(np.maximum(stock, 0), velocity, out=cover, where=velocity > 0)
+
+    flagged = np.flatnonzero(low)
+    flagged = flagged[np.lexsort((stock[flagged], cover[flagged]))][:limit]
+    details = {
+        row['pk']: row for row in ProductVariant.objects.filter(pk__in=ids[flagged].tolist()).values(
+            'pk', 'product_id', 'product__name', 'size', 'color',
+        )
+    }
+    results = []
+    for index in flagged:
+        row = details.get(int(ids[index]))
+        if row is None:
+            continue  # deleted since the scan
+        results.append({
+            'variant_id': row['pk'],
+            'product_id': row['product_id'],
+            'product': row['product__name'],
+            'size': row['size'],
+            'color': row['color'],
+            'stock': int(stock[index]),
+            'reorder_point': int(reorder_point[index] if has_point[index] else demand_point[index]),
+            'reorder_point_source': 'variant' if has_point[index] else 'velocity',
+            'daily_velocity': round(float(velocity[index]), 3),
+            'days_of_cover': None if np.isinf(cover[index]) else round(float(cover[index]), 1),
+        })
+    return {
+        'window_days': window,
+        'lead_time_days': lead_time,
+        'count': int(low.sum()),
+        'results': results,
+    }
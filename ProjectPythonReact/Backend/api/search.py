@@ -0,0 +1,79 @@
+# api/search.py
+"""
+Product search.
+
+On SQLite the catalog is indexed in the FTS5 table `api_product_search`, one
+row per product (rowid = product id) with its name, brand, category name,
+barcode and the sizes/colors of its variants. Triggers created by migration
+0008 keep the rows in step with api_product, api_productvariant and
+api_category, including bulk_create and queryset updates that send no signals.
+
+Other databases fall back to case-insensitive LIKE lookups.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .cache import invalidate
+from .models import Product
+
+SEARCH_TABLE = 'api_product_search'
+
+# bm25() weights, in column order: name, brand, category, barcode, variants
+COLUMN_WEIGHTS = (10.0, 3.0, 3.0, 5.0, 1.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Same row layout as the triggers in migration 0008, which keeps its own copy as migrations
+# must not import application code.
+INDEX_ROWS_SQL = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, name, brand, category, barcode, variants)
+    SELECT p.id, p.name, COALESCE(p.brand, ''), COALESCE(c.name, ''), p.barcode,
+           COALESCE((SELECT group_concat(COALESCE(v.size, '') || ' ' || COALESCE(v.color, ''), ' ')
+                     FROM api_productvariant v WHERE v.product_id = p.id), '')
+    FROM api_product p LEFT JOIN api_category c ON c.id = p.category_id
+"""
+
+
+def is_indexed():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix of a token."""
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def search_product_ids(query, limit):
+    """Ids of the products matching `query`, best match first."""
+    if not TOKEN_RE.search(query):
+        return []
+    if is_indexed():
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+                f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s",
+                [match_expression(query), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    condition = Q()
+    for token in TOKEN_RE.findall(query):
+        condition &= (
+            Q(name__icontains=token) | Q(brand__icontains=token) | Q(category__name__icontains=token)
+            | Q(barcode__startswith=token) | Q(variants__size__icontains=token) | Q(variants__color__icontains=token)
+        )
+    return list(Product.objects.filter(condition).distinct().order_by('name').values_list('pk', flat=True)[:limit])
+
+
+def rebuild_index():
+    """Re-create every row of the search index from the catalog tables; returns the number of rows."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(INDEX_ROWS_SQL)
+        # The cache version triggers do not watch the index table.
+        invalidate('products', force=True)
+        cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
@@ -2,17 +2,19 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from decimal import Decimal
-from django.db.models import Sum
+from django.db.models import Sum, Count, OuterRef, Subquery, Prefetch
+from django.db.models.functions import Coalesce
 from rest_framework import viewsets
 from django.utils import timezone
 import logging
 from .utils import get_current_stock
+from .cache import invalidate as invalidate_cached_responses
 from django.db import transaction
 from datetime import datetime
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Supplier, Product, ProductVariant, Category, Warehouse, Shelf, Purchase, StockMovement, Customer, DeliveryMethod, Invoice, InvoiceItem
+from .models import allocate_barcodes, InsufficientStock, DailyVariantSales, VariantValuation, Supplier, Product, ProductVariant, Category, Warehouse, Shelf, Purchase, StockMovement, StockOccupancy, Customer, DeliveryMethod, Invoice, InvoiceItem
 
 logger = logging.getLogger(__name__)
 
@@ -78,8 +80,134 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name']
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that resolves ids from the objects the parent list
+    serializer loaded in bulk (see PreloadingListSerializer), with the same
+    error messages. Falls back to a per-value query when nothing was preloaded.
+    """
+    def to_internal_value(self, data):
+        preloaded = getattr(self.parent, 'preloaded', {}).get(self.field_name)
+        if preloaded is None or isinstance(data, bool):
+            return super().to_internal_value(data)
+        try:
+            # Through str(), so 1.9 (and '1.9') are rejected instead of truncated to 1.
+            pk = int(str(data))
+        except ValueError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in preloaded:
+            self.fail('does_not_exist', pk_value=data)
+        return preloaded[pk]
+
+
+def requested_expansions(request):
+    """Paths named in ?expand=, plus their parents: 'items.product.variants' also expands 'items.product'."""
+    expand = set()
+    for path in query_param_set(request, 'expand'):
+        parts = path.split('.')
+        expand.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return expand
+
+
+def query_param_set(request, name):
+    if request is None:
+        return set()
+    params = getattr(request, 'query_params', request.GET)
+    return {value.strip() for value in params.get(name, '').split(',') if value.strip()}
+
+
+class ExpandableFieldsMixin:
+    """
+    Sparse fieldsets and opt-in expansion from the request in the serializer context.
+
+    ?fields=id,status keeps only those top-level fields in a GET response, and
+    ?expand=items.product swaps in the serializers from Meta.expandable_fields at
+    that path (dotted from the top-level object) in place of the compact default.
+    """
+    def field_path(self):
+        names = []
+        node = self
+        while node is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return fields
+
+        path = self.field_path()
+        expand = requested_expansions(request)
+        for name, (serializer_class, kwargs) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if (f'{path}.{name}' if path else name) in expand:
+                fields[name] = serializer_class(**kwargs)
+
+        only = query_param_set(request, 'fields')
+        if only and not path:
+            fields = {name: field for name, field in fields.items() if name in only}
+        return fields
+
+
+class PreloadingListSerializer(serializers.ListSerializer):
+    """Resolves every PreloadedPrimaryKeyRelatedField of the payload with one query per field."""
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.preloaded = {
+                name: field.get_queryset().in_bulk(self._collect_ids(data, name))
+                for name, field in self.child.fields.items()
+                if isinstance(field, PreloadedPrimaryKeyRelatedField)
+            }
+            self.link_preloaded(self.child.preloaded)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.child.preloaded = {}
+
+    def link_preloaded(self, preloaded):
+        """Hook to wire preloaded objects together, e.g. variant.product."""
+
+    @staticmethod
+    def link_variants_to_products(variants, products):
+        # Point each variant at the already loaded product so variant.product needs no query.
+        for variant in variants.values():
+            if variant.product_id in products:
+                variant.product = products[variant.product_id]
+
+    @staticmethod
+    def _collect_ids(data, name):
+        ids = set()
+        for item in data:
+            if isinstance(item, dict) and not isinstance(item.get(name), bool):
+                try:
+                    ids.add(int(str(item.get(name))))
+                except (TypeError, ValueError):
+                    pass
+        return ids
+
+
+class InvoiceItemListSerializer(PreloadingListSerializer):
+    def link_preloaded(self, preloaded):
+        self.link_variants_to_products(preloaded.get('variant_id', {}), preloaded.get('product_id', {}))
+
+
+class PurchaseListSerializer(PreloadingListSerializer):
+    def link_preloaded(self, preloaded):
+        self.link_variants_to_products(preloaded.get('product_variant', {}), preloaded.get('product', {}))
+
+    def create(self, validated_data):
+        return Purchase.bulk_receive([Purchase(**attrs) for attrs in validated_data])
+
+
 # Purchase order serializer
 class PurchaseSerializer(serializers.ModelSerializer):
+    supplier = PreloadedPrimaryKeyRelatedField(queryset=Supplier.objects.all())
+    product = PreloadedPrimaryKeyRelatedField(queryset=Product.objects.all())
+    product_variant = PreloadedPrimaryKeyRelatedField(
+        queryset=ProductVariant.objects.all(), allow_null=True, required=False
+    )
     supplier_name = serializers.CharField(source='supplier.name', read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_variant_info = serializers.CharField(source='product_variant.__str__', read_only=True)
@@ -91,21 +219,19 @@ class PurchaseSerializer(serializers.ModelSerializer):
             'product_variant', 'product_variant_info', 'batch_number',
             'quantity', 'purchase_price', 'purchase_date', 'total'
         ]
+        list_serializer_class = PurchaseListSerializer
 
-    def create(self, validated_data):
-        # Create the purchase instance
-        purchase = Purchase.objects.create(
-            **validated_data,
-            total=validated_data['quantity'] * validated_data['purchase_price']
-        )
-
-        # Increment the variant's stock
-        if purchase.product_variant:
-            variant = purchase.product_variant
-            variant.stock_quantity = (variant.stock_quantity or 0) + purchase.quantity
-            variant.save()
+    def validate(self, data):
+        variant = data.get('product_variant')
+        if variant and data.get('product') and variant.product_id != data['product'].id:
+            raise serializers.ValidationError(
+                {"product_variant": "The selected variant does not belong to the specified product."}
+            )
+        return data
 
-        return purchase
+    def create(self, validated_data):
+        # Purchase.save adds the quantity to the variant's stock and records the IN movement
+        return Purchase.objects.create(**validated_data)
 
 class StockMovementSerializer(serializers.ModelSerializer):
     product_name = serializers.SerializerMethodField()
@@ -143,35 +269,79 @@ class StockMovementSerializer(serializers.ModelSerializer):
         
         return stock_movement
 # Updated ProductVariantSerializer with logging
-class ProductVariantSerializer(serializers.ModelSerializer):
-    purchases = PurchaseSerializer(source='purchase_set', many=True, read_only=True)
+class ProductVariantSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     stock = serializers.IntegerField(source='stock_quantity', required=False, allow_null=True)  # Make optional
     purchase_price = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductVariant
-        fields = ['id', 'product', 'size', 'color', 'stock', 'purchase_price', 'selling_price', 'purchases']
+        fields = ['id', 'product', 'size', 'color', 'stock', 'purchase_price', 'selling_price', 'reorder_point']
+        # The purchase history is only sent with ?expand=purchases
+        expandable_fields = {
+            'purchases': (PurchaseSerializer, {'source': 'purchase_set', 'many': True, 'read_only': True}),
+        }
+
+    @staticmethod
+    def setup_eager_loading(queryset, expand=(), prefix=''):
+        # Load variants with their product, latest purchase price and (when expanded)
+        # purchases in a fixed number of queries instead of several per variant.
+        latest_purchase_price = Purchase.objects.filter(
+            product_variant=OuterRef('pk')
+        ).order_by('-purchase_date', '-id').values('purchase_price')[:1]
+        queryset = queryset.select_related('product').annotate(
+            latest_purchase_price=Subquery(latest_purchase_price)
+        )
+        if prefix + 'purchases' in expand:
+            queryset = queryset.prefetch_related(
+                Prefetch('purchase_set', queryset=Purchase.objects.select_related('supplier', 'product'))
+            )
+        return queryset
 
     def get_purchase_price(self, obj):
+        if hasattr(obj, 'latest_purchase_price'):
+            return obj.latest_purchase_price if obj.latest_purchase_price is not None else 0.00
         latest_purchase = obj.purchase_set.order_by('-purchase_date').first()
         return latest_purchase.purchase_price if latest_purchase else 0.00
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        logger.info(f"Serializing ProductVariant {instance.id}: {representation}")
-        return representation
+class ProductListSerializer(PreloadingListSerializer):
+    def create(self, validated_data):
+        # One sequence reservation for the whole batch instead of one per product.
+        barcodes = allocate_barcodes(len(validated_data))
+        products = Product.objects.bulk_create([
+            Product(barcode=barcode, **attrs) for barcode, attrs in zip(barcodes, validated_data)
+        ])
+        invalidate_cached_responses('products')  # bulk_create sends no post_save
+        return products
 
 # Updated ProductSerializer
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'barcode']
+
+
+class VariantSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductVariant
+        fields = ['id', 'product', 'size', 'color']
+
+
+class ProductSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     variants = ProductVariantSerializer(many=True, read_only=True)
     category = CategorySerializer(read_only=True)
-    category_id = serializers.PrimaryKeyRelatedField(
+    category_id = PreloadedPrimaryKeyRelatedField(
         queryset=Category.objects.all(), source='category', write_only=True
     )
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'category', 'category_id', 'description', 'brand', 'image_url', 'barcode', 'created_at', 'variants']
+        list_serializer_class = ProductListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset, expand=(), prefix=''):
+        variants = ProductVariantSerializer.setup_eager_loading(ProductVariant.objects.all(), expand, prefix + 'variants.')
+        return queryset.select_related('category').prefetch_related(Prefetch('variants', queryset=variants))
 
 # Updated WarehouseSerializer
 class WarehouseSerializer(serializers.ModelSerializer):
@@ -182,15 +352,26 @@ class WarehouseSerializer(serializers.ModelSerializer):
         model = Warehouse
         fields = ['id', 'name', 'location', 'owner', 'contact_person', 'contact_number', 'capacity', 'created_at', 'shelf_count', 'total_quantity']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # Totals come from the maintained StockOccupancy table in the same query as the warehouses.
+        shelf_count = Shelf.objects.filter(warehouse=OuterRef('pk')).order_by().values('warehouse').annotate(
+            count=Count('pk')
+        ).values('count')
+        return queryset.annotate(
+            occupancy_total=Sum('stock_occupancy__quantity'),
+            shelf_total=Coalesce(Subquery(shelf_count), 0),
+        )
+
     def get_shelf_count(self, obj):
+        if hasattr(obj, 'shelf_total'):
+            return obj.shelf_total
         return obj.shelves.count()
 
     def get_total_quantity(self, obj):
-        total = StockMovement.objects.filter(
-            warehouse=obj,
-            movement_type='IN'
-        ).aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
-        return total
+        if hasattr(obj, 'occupancy_total'):
+            return obj.occupancy_total or 0
+        return obj.stock_occupancy.aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
 
 # Updated ShelfSerializer
 class ShelfSerializer(serializers.ModelSerializer):
@@ -202,12 +383,14 @@ class ShelfSerializer(serializers.ModelSerializer):
         model = Shelf
         fields = ['id', 'warehouse', 'warehouse_name', 'shelf_name', 'section', 'capacity', 'created_at', 'total_quantity']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('warehouse').annotate(occupancy_total=Sum('stock_occupancy__quantity'))
+
     def get_total_quantity(self, obj):
-        total = StockMovement.objects.filter(
-            shelf=obj,
-            movement_type='IN'
-        ).aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
-        return total
+        if hasattr(obj, 'occupancy_total'):
+            return obj.occupancy_total or 0
+        return obj.stock_occupancy.aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
 
     def validate(self, data):
         warehouse = data.get('warehouse')
@@ -259,15 +442,15 @@ class CustomerSerializer(serializers.ModelSerializer):
 
 # InvoiceItem serializer
 # Serializers
-class InvoiceItemSerializer(serializers.ModelSerializer):
-    product_id = serializers.PrimaryKeyRelatedField(
+class InvoiceItemSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    product_id = PreloadedPrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
     )
-    variant_id = serializers.PrimaryKeyRelatedField(
+    variant_id = PreloadedPrimaryKeyRelatedField(
         queryset=ProductVariant.objects.all(), source='variant', write_only=True, allow_null=True
     )
-    product = ProductSerializer(read_only=True)
-    variant = ProductVariantSerializer(read_only=True, allow_null=True)
+    product = ProductSummarySerializer(read_only=True)
+    variant = VariantSummarySerializer(read_only=True, allow_null=True)
 
     class Meta:
         model = InvoiceItem
@@ -276,6 +459,12 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
             'quantity', 'unit_price', 'discount_percentage'
         ]
         read_only_fields = ['id', 'product', 'variant']
+        list_serializer_class = InvoiceItemListSerializer
+        # Full product/variant payloads with ?expand=items.product / items.variant
+        expandable_fields = {
+            'product': (ProductSerializer, {'read_only': True}),
+            'variant': (ProductVariantSerializer, {'read_only': True, 'allow_null': True}),
+        }
 
     def validate(self, data):
         logger.info(f"Validating InvoiceItem data: {data}")
@@ -318,7 +507,7 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         product = data.get('product')
         variant = data.get('variant')
         if variant:
-            if variant.product != product:
+            if variant.product_id != product.id:
                 error_msg = {"variant_id": "The selected variant does not belong to the specified product."}
                 logger.error(f"Validation failed: {error_msg}")
                 raise serializers.ValidationError(error_msg)
@@ -334,7 +523,7 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         logger.info("InvoiceItem validation passed")
         return data
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     customer_id = serializers.PrimaryKeyRelatedField(
         queryset=Customer.objects.all(), source='customer', write_only=True
@@ -361,6 +550,24 @@ class InvoiceSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'subtotal', 'tax', 'total', 'total_in_riel']
 
+    @staticmethod
+    def setup_eager_loading(queryset, expand=()):
+        # Compact items join their product and variant; expanded ones are prefetched with their own eager loading.
+        items = InvoiceItem.objects.all()
+        if 'items.product' in expand:
+            items = items.prefetch_related(Prefetch(
+                'product', queryset=ProductSerializer.setup_eager_loading(Product.objects.all(), expand, 'items.product.')
+            ))
+        else:
+            items = items.select_related('product')
+        if 'items.variant' in expand:
+            items = items.prefetch_related(Prefetch(
+                'variant', queryset=ProductVariantSerializer.setup_eager_loading(ProductVariant.objects.all(), expand, 'items.variant.')
+            ))
+        else:
+            items = items.select_related('variant')
+        return queryset.select_related('customer', 'delivery_method').prefetch_related(Prefetch('items', queryset=items))
+
     def get_subtotal(self, obj):
         return float(obj.subtotal) if obj.subtotal is not None else 0.0
 
@@ -414,72 +621,88 @@ class InvoiceSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         logger.info(f"Creating invoice with validated_data: {validated_data}")
-        items_data = validated_data.pop('items', [])
+        items_data = [item_data for item_data in validated_data.pop('items', []) if item_data is not None]
         customer = validated_data.pop('customer')
         delivery_method = validated_data.pop('delivery_method', None)
 
-        with transaction.atomic():
-            # Create the Invoice instance without calculating totals yet
-            invoice = Invoice.objects.create(
-                customer=customer,
-                delivery_method=delivery_method,
-                **validated_data
-            )
+        # Build the items and their line totals in memory; nothing is written yet.
+        items = []
+        requested = {}
+        for item_data in items_data:
+            item = InvoiceItem(**item_data)
+            item.total_price = item.calculate_total_price()
+            items.append(item)
+            if item.variant:
+                requested[item.variant.id] = requested.get(item.variant.id, 0) + item.quantity
 
-            # Create the related InvoiceItem objects
-            for item_data in items_data:
-                if item_data is None:
-                    logger.warning("Skipping None item_data in items list")
-                    continue
-                product = item_data.pop('product')
-                variant = item_data.pop('variant', None)
-                logger.info(f"Creating InvoiceItem: product={product.id}, variant={variant.id if variant else None}, data={item_data}")
-
-                # Create the InvoiceItem
-                invoice_item = InvoiceItem.objects.create(
-                    invoice=invoice,
-                    product=product,
-                    variant=variant,
-                    **item_data
-                )
+        invoice = Invoice(customer=customer, delivery_method=delivery_method, **validated_data)
+        self.calculate_totals(invoice, items)
 
-                # Update stock if variant exists
-                if variant:
-                    variant.stock_quantity -= invoice_item.quantity
-                    if variant.stock_quantity < 0:
-                        error_msg = {
-                            "quantity": f"Stock update failed for variant {variant.id}. "
-                                        f"Requested: {invoice_item.quantity}, Available: {variant.stock_quantity + invoice_item.quantity}"
-                        }
-                        logger.error(f"Stock update failed: {error_msg}")
-                        raise serializers.ValidationError(error_msg)
-                    variant.save()
-
-            # Now calculate the totals after all items are created
-            # 1. Calculate subtotal from items
-            invoice.subtotal = sum(item.total_price for item in invoice.items.all()) if invoice.items.exists() else Decimal('0.00')
-
-            # 2. Apply overall discount
-            discount_amount = invoice.subtotal * (invoice.overall_discount / Decimal('100'))
-            discounted_subtotal = invoice.subtotal - discount_amount
-
-            # 3. Calculate tax (10% if not deducted)
-            tax_rate = Decimal('0.10')  # 10% tax rate
-            invoice.tax = Decimal('0.00') if invoice.deduct_tax else (discounted_subtotal * tax_rate)
-
-            # 4. Calculate total (subtotal after discount + shipping + tax)
-            invoice.total = discounted_subtotal + invoice.shipping_cost + invoice.tax
-
-            # 5. Calculate total_in_riel (assuming 1 USD = 4100 KHR)
-            exchange_rate = Decimal('4100')
-            invoice.total_in_riel = invoice.total * exchange_rate
-
-            # Save the invoice again with the calculated totals
-            invoice.save()
+        with transaction.atomic():
+            # Reserve stock for every variant on the invoice in one conditional UPDATE.
+            # It only succeeds if enough stock remains, so concurrent checkouts cannot oversell.
+            try:
+                ProductVariant.decrement_stock(requested)
+            except InsufficientStock as e:
+                variant_id, (quantity, available) = next(iter(e.shortages.items()))
+                error_msg = {
+                    "quantity": f"Stock update failed for variant {variant_id}. "
+                                f"Requested: {quantity}, Available: {available}"
+                }
+                logger.error(f"Stock update failed: {error_msg}")
+                raise serializers.ValidationError(error_msg)
+            remaining = dict(ProductVariant.objects.filter(pk__in=requested).values_list('pk', 'stock_quantity'))
 
-            logger.info(f"Created invoice {invoice.id} with {len(items_data)} items, "
-                        f"subtotal={invoice.subtotal}, tax={invoice.tax}, total={invoice.total}, total_in_riel={invoice.total_in_riel}")
-            return invoice
+            # Write the invoice once, with its totals, then the items and their OUT movements in bulk.
+            invoice.save()
+            for item in items:
+                item.invoice = invoice
+                if item.variant:
+                    item.variant.stock_quantity = remaining[item.variant.id]
+            InvoiceItem.objects.bulk_create(items)
+            DailyVariantSales.apply(invoice, items)  # bulk_create skips InvoiceItem.save
+
+            movements = [
+                StockMovement(
+                    product=item.product,
+                    product_variant=item.variant,
+                    movement_type='OUT',
+                    quantity=item.quantity,
+                    invoice_item=item,
+                )
+                for item in items if item.variant
+            ]
+            StockMovement.objects.bulk_create(movements)
+            StockOccupancy.apply(movements)
+            VariantValuation.apply(movements)
+
+        logger.info(f"Created invoice {invoice.id} with {len(items)} items, "
+                    f"subtotal={invoice.subtotal}, tax={invoice.tax}, total={invoice.total}, total_in_riel={invoice.total_in_riel}")
+        return invoice
+
+    @staticmethod
+    def calculate_totals(invoice, items):
+        to_decimal = lambda value: Decimal(str(value)) if value is not None else Decimal('0.00')
+        invoice.overall_discount = to_decimal(invoice.overall_discount)
+        invoice.shipping_cost = to_decimal(invoice.shipping_cost)
+
+        # 1. Calculate subtotal from items
+        invoice.subtotal = sum((item.total_price for item in items), Decimal('0.00'))
+
+        # 2. Apply overall discount
+        discount_amount = invoice.subtotal * (invoice.overall_discount / Decimal('100'))
+        discounted_subtotal = invoice.subtotal - discount_amount
+
+        # 3. Calculate tax (10% if not deducted)
+        tax_rate = Decimal('0.10')  # 10% tax rate
+        invoice.tax = Decimal('0.00') if invoice.deduct_tax else (discounted_subtotal * tax_rate)
+
+        # 4. Calculate total (subtotal after discount + shipping + tax)
+        invoice.total = discounted_subtotal + invoice.shipping_cost + invoice.tax
+
+        # 5. Calculate total_in_riel (assuming 1 USD = 4100 KHR)
+        exchange_rate = Decimal('4100')
+        invoice.total_in_riel = invoice.total * exchange_rate
 
     def update(self, instance, validated_data):
         logger.info(f"Updating invoice {instance.id} with validated_data: {validated_data}")
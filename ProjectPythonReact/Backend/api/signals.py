@@ -1,13 +1,57 @@
 # api/signals.py (hypothetical)
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import Purchase, ProductVariant, InvoiceItem, StockMovement
+from .models import (
+    Purchase, ProductVariant, InvoiceItem, StockMovement, StockOccupancy, StockCheckpoint,
+    Category, DeliveryMethod, Supplier, Product, Customer, Invoice, DailyVariantSales, DailyCustomerSales,
+    VariantValuation,
+)
+from .cache import invalidate as invalidate_cached_responses
 
-@receiver(post_save, sender=Purchase)
-def reset_stock(sender, instance, created, **kwargs):
-    if created and instance.product_variant:
-        instance.product_variant.stock_quantity = 0  # This would cause the issue
-        instance.product_variant.save()
+# model -> response namespaces whose output includes its rows; invoices embed products too (see api/cache.py)
+RESPONSE_CACHE_DEPENDENCIES = {
+    Category: ('categories', 'products'),
+    DeliveryMethod: ('delivery_methods', 'invoices'),
+    Supplier: ('suppliers', 'products'),
+    Product: ('products',),
+    ProductVariant: ('products',),
+    Purchase: ('products',),
+    Customer: ('customers', 'invoices'),
+    Invoice: ('invoices',),
+    InvoiceItem: ('invoices',),
+}
+
+@receiver(post_delete, sender=StockMovement)
+def release_stock_occupancy(sender, instance, **kwargs):
+    # Runs inside the delete transaction, including cascades from Purchase/InvoiceItem.
+    StockOccupancy.apply([instance], sign=-1, create=False)
+    StockCheckpoint.invalidate([instance])
+    VariantValuation.apply([instance], sign=-1)
+
+@receiver(pre_delete, sender=Invoice)
+def remove_invoice_from_sales_rollups(sender, instance, **kwargs):
+    # The items are removed by remove_item_from_sales_rollups as the delete cascades to them.
+    DailyCustomerSales.apply(instance, sign=-1)
+
+@receiver(post_delete, sender=InvoiceItem)
+def remove_item_from_sales_rollups(sender, instance, origin=None, **kwargs):
+    # Deleting a product cascades to its invoice lines; what was sold stays in the history.
+    deleted = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if deleted is not Product:
+        DailyVariantSales.apply(instance.invoice, [instance], sign=-1)
+
+@receiver(pre_delete, sender=ProductVariant)
+def detach_variant_sales(sender, instance, **kwargs):
+    # The variant's invoice lines are set to variant=None; their rollup rows follow, so later edits balance.
+    DailyVariantSales.detach_variants([instance.pk])
+
+def invalidate_response_cache(sender, **kwargs):
+    invalidate_cached_responses(*RESPONSE_CACHE_DEPENDENCIES[sender])
+
+for model in RESPONSE_CACHE_DEPENDENCIES:
+    post_save.connect(invalidate_response_cache, sender=model, dispatch_uid=f'response_cache_save_{model.__name__}')
+    post_delete.connect(invalidate_response_cache, sender=model, dispatch_uid=f'response_cache_delete_{model.__name__}')
 # @receiver(post_save, sender=InvoiceItem)
 # def create_stock_movement_for_invoice_item(sender, instance, created, **kwargs):
 #     if created:  # Only trigger on creation, not updates
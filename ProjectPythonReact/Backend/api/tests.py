@@ -1,3 +1,1302 @@
-from django.test import TestCase
+import io
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import forecasting, ledger, valuation
+from .models import (
+    Supplier, Category, Product, ProductVariant, Purchase, Warehouse, Shelf, StockMovement, StockOccupancy,
+    StockCheckpoint, Customer, Invoice, InvoiceItem, InsufficientStock, BarcodeSequence, allocate_barcodes,
+    DailyVariantSales, DailyCustomerSales, CostLayer, VariantValuation, DemandForecast, ResponseCacheVersion,
+)
+from .cache import get_cache
+from .db import retry_when_locked
+from .metrics import REGISTRY
+from .serializers import InvoiceSerializer, ProductVariantSerializer
+from .utils import get_current_stock
+
+
+class ProductCatalogQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+        self.client.force_authenticate(User.objects.create_user('catalog', 'catalog@example.com', 'secret'))
+        self.category = Category.objects.create(name='Shirts')
+        self.supplier = Supplier.objects.create(name='Acme', phone='012', address='Street 1', country='KH')
+
+    def create_products(self, count, variants=3, purchases=2):
+        for i in range(count):
+            product = Product.objects.create(name=f'Product {i}', category=self.category)
+            for j in range(variants):
+                variant = ProductVariant.objects.create(product=product, size=f'S{j}', color='Red')
+                for k in range(purchases):
+                    Purchase.objects.create(
+                        supplier=self.supplier, product=product, product_variant=variant,
+                        batch_number=f'B{i}{j}{k}', quantity=5, purchase_price=Decimal('2.50') + k,
+                    )
+
+    def test_product_list_query_count_is_constant(self):
+        self.create_products(2)
+        # The response cache version, then the products and their variants.
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+        self.create_products(5, variants=4, purchases=3)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/products/', {'expand': 'variants.purchases'})
+        self.assertEqual(len(response.data), 7)
+
+    def test_variant_purchase_price_is_latest_purchase(self):
+        self.create_products(1, variants=1, purchases=3)
+        variant = self.client.get('/api/products/').data[0]['variants'][0]
+        self.assertEqual(variant['purchase_price'], Decimal('4.50'))
+        self.assertNotIn('purchases', variant)
+
+        response = self.client.get('/api/products/', {'expand': 'variants.purchases'})
+        variant = response.data[0]['variants'][0]
+        self.assertEqual(len(variant['purchases']), 3)
+        self.assertEqual(variant['purchases'][0]['supplier_name'], 'Acme')
+
+    def test_variant_list_query_count_is_constant(self):
+        self.create_products(3)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/variants/')
+        self.assertEqual(len(response.data), 9)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/variants/', {'expand': 'purchases'})
+        self.assertEqual(len(response.data[0]['purchases']), 2)
+
+    def test_invoice_items_are_compact_unless_expanded(self):
+        self.create_products(2, variants=2, purchases=2)
+        customer = Customer.objects.create(first_name='Dara')
+        for _ in range(3):
+            invoice = Invoice.objects.create(customer=customer, due_date=date.today())
+            for variant in ProductVariant.objects.all():
+                InvoiceItem.objects.create(invoice=invoice, product_id=variant.product_id, variant=variant,
+                                           quantity=1, unit_price=Decimal('5.00'))
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/invoices/list/')
+        item = response.data[0]['items'][0]
+        self.assertEqual(set(item['product']), {'id', 'name', 'barcode'})
+        self.assertEqual(set(item['variant']), {'id', 'product', 'size', 'color'})
+
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/invoices/list/', {'expand': 'items.product.variants.purchases'})
+        product = response.data[0]['items'][0]['product']
+        self.assertEqual(len(product['variants'][0]['purchases']), 2)
+        self.assertEqual(set(response.data[0]['items'][0]['variant']), {'id', 'product', 'size', 'color'})
+
+        response = self.client.get(f'/api/invoices/{invoice.pk}/', {'fields': 'id,status,total'})
+        self.assertEqual(set(response.data), {'id', 'status', 'total'})
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('pages', 'pages@example.com', 'secret'))
+        self.customers = [Customer.objects.create(first_name=f'Customer {i}') for i in range(5)]
+        # The first page ends inside a tie on the registration time, broken by the primary key.
+        Customer.objects.filter(pk__in=[self.customers[2].pk, self.customers[3].pk]).update(
+            registration_date=self.customers[3].registration_date,
+        )
+        self.expected = [customer.pk for customer in reversed(self.customers)]
+
+    def ids(self, response):
+        return [row['customer_id'] for row in response.data['results']]
+
+    def test_pages_follow_the_next_cursor_to_the_end(self):
+        first = self.client.get('/api/customers/', {'limit': 2})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.ids(first), self.expected[:2])
+        self.assertIn('cursor=', first.data['next'])
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.ids(second), self.expected[2:4])
+        last = self.client.get(second.data['next'])
+        self.assertEqual(self.ids(last), self.expected[4:])
+        self.assertIsNone(last.data['next'])
+
+    def test_unpaginated_without_cursor_or_limit(self):
+        response = self.client.get('/api/customers/')
+        self.assertIsInstance(response.data, list)
+        self.assertCountEqual([row['customer_id'] for row in response.data], self.expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('not-a-cursor', 'WzFd', 'WyJ4IiwgMV0='):  # garbage, one value, a bad date
+            response = self.client.get('/api/customers/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+
+class StockOccupancyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('stock', 'stock@example.com', 'secret'))
+        self.product = Product.objects.create(name='Shirt')
+        self.variant = ProductVariant.objects.create(product=self.product, size='M')
+        self.warehouse = Warehouse.objects.create(name='Main', location='PP', capacity=1000)
+        self.shelf = Shelf.objects.create(warehouse=self.warehouse, shelf_name='A1', capacity=100)
+
+    def move(self, movement_type, quantity, shelf=None):
+        return StockMovement.objects.create(
+            product=self.product, product_variant=self.variant, warehouse=self.warehouse,
+            shelf=shelf or self.shelf, movement_type=movement_type, quantity=quantity,
+        )
+
+    def occupancy(self):
+        return StockOccupancy.objects.get(warehouse=self.warehouse, shelf=self.shelf, product_variant=self.variant).quantity
+
+    def test_movements_update_occupancy(self):
+        self.move('IN', 10)
+        out = self.move('OUT', 3)
+        self.assertEqual(self.occupancy(), 7)
+
+        out.quantity = 5
+        out.save()
+        self.assertEqual(self.occupancy(), 5)
+
+        out.delete()
+        self.assertEqual(self.occupancy(), 10)
+
+    def test_rows_without_warehouse_or_shelf_are_unique(self):
+        for quantity in (4, 5):
+            StockMovement.objects.create(product=self.product, product_variant=self.variant, movement_type='IN', quantity=quantity)
+        self.assertEqual(StockOccupancy.objects.get(warehouse=None, shelf=None, product_variant=self.variant).quantity, 9)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StockOccupancy.objects.create(product_variant=self.variant, quantity=1)
+
+    def test_concurrent_insert_falls_back_to_update(self):
+        self.move('IN', 10)
+        add = StockOccupancy._add
+        calls = []
+
+        def insert_race(key, delta):
+            # The first UPDATE runs before the row of a concurrent transaction became visible.
+            calls.append(key)
+            return 0 if len(calls) == 1 else add(key, delta)
+
+        with mock.patch.object(StockOccupancy, '_add', side_effect=insert_race):
+            self.move('IN', 5)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.occupancy(), 15)
+
+    def test_warehouse_and_shelf_lists_read_occupancy(self):
+        other = Shelf.objects.create(warehouse=self.warehouse, shelf_name='A2', capacity=100)
+        self.move('IN', 10)
+        self.move('OUT', 4)
+        self.move('IN', 6, shelf=other)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/warehouses/')
+        self.assertEqual(response.data[0]['total_quantity'], 12)
+        self.assertEqual(response.data[0]['shelf_count'], 2)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/shelves/')
+        self.assertEqual({row['shelf_name']: row['total_quantity'] for row in response.data}, {'A1': 6, 'A2': 6})
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Shirt')
+        self.variant = ProductVariant.objects.create(product=self.product, size='M')
+
+    def move(self, movement_type, quantity):
+        return StockMovement.objects.create(
+            product=self.product, product_variant=self.variant, movement_type=movement_type, quantity=quantity,
+        )
+
+    def test_balance_only_reads_movements_after_checkpoint(self):
+        for _ in range(5):
+            self.move('IN', 4)
+        self.move('OUT', 6)
+        self.assertEqual(ledger.write_checkpoints(), 1)
+        self.move('IN', 1)
+
+        self.assertEqual(get_current_stock(self.product, self.variant), 15)
+        self.assertEqual(get_current_stock(self.product), 15)
+        self.assertEqual(ledger.variant_balances([self.variant.pk]), {self.variant.pk: 15})
+        self.assertEqual(ledger.write_checkpoints(min_movements=2), 0)
+
+    def test_historical_balance_and_invalidation(self):
+        first = self.move('IN', 10)
+        ledger.write_checkpoints()
+        checkpoint = StockCheckpoint.objects.get()
+        self.move('OUT', 3)
+        self.assertEqual(get_current_stock(self.product, self.variant, as_of=checkpoint.as_of), 10)
+
+        first.quantity = 12
+        first.save()
+        self.assertFalse(StockCheckpoint.objects.exists())
+        self.assertEqual(get_current_stock(self.product, self.variant), 9)
+
+
+class FixStockQuantitiesTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Shirt')
+        self.old, self.recent, self.correct, self.unmoved = [
+            ProductVariant.objects.create(product=self.product, size=size) for size in ('S', 'M', 'L', 'XL')
+        ]
+        for variant, movements in ((self.old, (('IN', 10), ('OUT', 3))), (self.recent, (('IN', 5),)), (self.correct, (('IN', 2),))):
+            for movement_type, quantity in movements:
+                StockMovement.objects.create(product=self.product, product_variant=variant,
+                                             movement_type=movement_type, quantity=quantity)
+        StockMovement.objects.filter(product_variant=self.old).update(movement_date=timezone.now() - timedelta(days=30))
+        # Drift the stored quantities behind the ledger's back.
+        for variant, stored in ((self.old, 99), (self.recent, 1), (self.correct, 2), (self.unmoved, 4)):
+            ProductVariant.objects.filter(pk=variant.pk).update(stock_quantity=stored)
+
+    def fix(self, *args):
+        out = io.StringIO()
+        call_command('fix_stock_quantities', '--chunk-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def stock(self):
+        return dict(ProductVariant.objects.order_by('pk').values_list('pk', 'stock_quantity'))
+
+    def test_corrects_drifted_quantities(self):
+        self.assertIn('Scanned 4 variants, 3 corrected', self.fix())
+        self.assertEqual(self.stock(), {self.old.pk: 7, self.recent.pk: 5, self.correct.pk: 2, self.unmoved.pk: 0})
+        self.assertIn('0 corrected', self.fix())
+
+    def test_dry_run_reports_without_writing(self):
+        before = self.stock()
+        with CaptureQueriesContext(connection) as queries:
+            out = self.fix('--dry-run')
+        self.assertIn('3 would be corrected', out)
+        self.assertIn(f'Variant {self.old.pk} stock_quantity=99, should be 7', out)
+        self.assertEqual(self.stock(), before)
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+
+    def test_since_limits_to_recently_moved_variants(self):
+        since = (timezone.localdate() - timedelta(days=7)).isoformat()
+        self.assertIn('Scanned 2 variants, 1 corrected', self.fix('--since', since))
+        self.assertEqual(self.stock(), {self.old.pk: 99, self.recent.pk: 5, self.correct.pk: 2, self.unmoved.pk: 4})
+        with self.assertRaises(CommandError):
+            self.fix('--since', 'yesterday')
+
+
+class InvoiceStockReservationTests(TransactionTestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Dara')
+        self.product = Product.objects.create(name='Shirt')
+
+    def invoice_payload(self, variants, quantity=1):
+        return {
+            'customer_id': self.customer.pk,
+            'date': date.today().isoformat(),
+            'due_date': date.today().isoformat(),
+            'status': 'PAID',
+            'shipping_cost': '0.00',
+            'overall_discount': '0.00',
+            'items': [
+                {'product_id': self.product.pk, 'variant_id': variant.pk, 'quantity': quantity, 'unit_price': '5.00',
+                 'discount_percentage': '0'}
+                for variant in variants
+            ],
+        }
+
+    def create_invoice(self, payload):
+        serializer = InvoiceSerializer(data=payload)
+        if not serializer.is_valid():
+            return False
+        try:
+            serializer.save()
+        except Exception as e:
+            if hasattr(e, 'detail'):
+                return False
+            raise
+        return True
+
+    def test_concurrent_checkouts_never_oversell(self):
+        stock = 25
+        variant = ProductVariant.objects.create(product=self.product, size='M', stock_quantity=stock)
+        payload = self.invoice_payload([variant])
+        results = []
+        lock = threading.Lock()
+
+        def checkout(attempts):
+            try:
+                for _ in range(attempts):
+                    while True:
+                        try:
+                            created = self.create_invoice(payload)
+                            break
+                        except OperationalError:
+                            # SQLite serializes writers; retry when the database is locked.
+                            time.sleep(0.001)
+                    with lock:
+                        results.append(created)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(5,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(len(results), 40)
+        self.assertEqual(results.count(True), stock)
+        self.assertEqual(variant.stock_quantity, 0)
+        self.assertEqual(Invoice.objects.count(), stock)
+
+    def test_decrement_is_all_or_nothing(self):
+        plenty = ProductVariant.objects.create(product=self.product, size='M', stock_quantity=10)
+        scarce = ProductVariant.objects.create(product=self.product, size='L', stock_quantity=1)
+        with self.assertRaises(InsufficientStock) as raised:
+            ProductVariant.decrement_stock({plenty.pk: 3, scarce.pk: 2})
+        self.assertEqual(raised.exception.shortages, {scarce.pk: (2, 1)})
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.stock_quantity, 10)
+
+    def test_batched_decrement_is_one_statement(self):
+        variants = [ProductVariant.objects.create(product=self.product, size=f'S{i}', stock_quantity=10)
+                    for i in range(20)]
+        quantities = {variant.pk: 1 + i % 3 for i, variant in enumerate(variants)}
+
+        # The previous path read and saved every variant: two statements per row.
+        with CaptureQueriesContext(connection) as queries:
+            ProductVariant.decrement_stock(quantities)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE', 'BEGIN', 'COMMIT'))]
+        self.assertEqual(len(statements), 1, statements)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+        self.assertEqual(
+            dict(ProductVariant.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity')),
+            {variant_id: 10 - quantity for variant_id, quantity in quantities.items()},
+        )
+
+
+class InvoiceCreationTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Dara')
+        self.product = Product.objects.create(name='Shirt')
+        self.variants = [
+            ProductVariant.objects.create(product=self.product, size=f'S{i}', stock_quantity=50) for i in range(200)
+        ]
+
+    def payload(self, items):
+        return {
+            'customer_id': self.customer.pk,
+            'date': date.today().isoformat(),
+            'due_date': date.today().isoformat(),
+            'overall_discount': '10.00',
+            'shipping_cost': '2.00',
+            'items': items,
+        }
+
+    def item(self, variant_id, product_id=None):
+        return {'product_id': product_id or self.product.pk, 'variant_id': variant_id, 'quantity': 2,
+                'unit_price': '5.00', 'discount_percentage': '50'}
+
+    def test_large_invoice_costs_a_handful_of_queries(self):
+        serializer = InvoiceSerializer(data=self.payload([self.item(variant.pk) for variant in self.variants]))
+        # Customer, then all products and all variants in one query each.
+        with self.assertNumQueries(3):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        with CaptureQueriesContext(connection) as queries:
+            invoice = serializer.save()
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        # 10 for the invoice, items, movements and stock, 4 for the two sales rollups, 6 for the valuation,
+        # and 3 to insert and lock the valuation rows of variants valued for the first time.
+        self.assertLessEqual(len(statements), 23)
+
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.subtotal, Decimal('1000.00'))
+        self.assertEqual(invoice.tax, Decimal('90.00'))
+        self.assertEqual(invoice.total, Decimal('992.00'))
+        self.assertEqual(invoice.items.count(), 200)
+        self.assertEqual(StockMovement.objects.filter(movement_type='OUT', invoice_item__invoice=invoice).count(), 200)
+        self.assertEqual(get_current_stock(self.product, self.variants[0]), -2)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 48)
+
+    def test_item_errors_are_reported_per_line(self):
+        other = Product.objects.create(name='Pants')
+        serializer = InvoiceSerializer(data=self.payload([
+            self.item(self.variants[0].pk),
+            self.item(999999),
+            self.item(self.variants[1].pk, product_id=other.pk),
+            self.item(self.variants[2].pk + 0.9),
+        ]))
+        self.assertFalse(serializer.is_valid())
+        errors = serializer.errors['items']
+        # Keyed by line index; the valid first line has no entry.
+        self.assertEqual(errors, {
+            1: {'variant_id': ['Invalid pk "999999" - object does not exist.']},
+            2: {'variant_id': ['The selected variant does not belong to the specified product.']},
+            3: {'variant_id': ['Incorrect type. Expected pk value, received float.']},
+        })
+
+
+class BulkPurchaseReceivingTests(TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='Acme', phone='012', address='Street 1', country='KH')
+        self.product = Product.objects.create(name='Shirt')
+        self.variants = [ProductVariant.objects.create(product=self.product, size=f'S{i}') for i in range(50)]
+
+    def line(self, variant, quantity=3, batch='B1'):
+        return {'supplier': self.supplier.pk, 'product': self.product.pk, 'product_variant': variant.pk,
+                'batch_number': batch, 'quantity': quantity, 'purchase_price': '2.00'}
+
+    def test_bulk_receive_aggregates_stock_per_variant(self):
+        lines = [self.line(variant) for variant in self.variants] * 40
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/purchases/bulk/', lines, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2000)
+        self.assertIn('rows_per_second', response.json())
+        # Inserts are batched (SQLite caps parameters per statement, cost layers fit ~140 per INSERT);
+        # nothing runs per line.
+        self.assertLess(len(queries), len(lines) // 25)
+
+        self.assertEqual(Purchase.objects.count(), 2000)
+        self.assertEqual(StockMovement.objects.filter(movement_type='IN').count(), 2000)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 120)
+        self.assertEqual(get_current_stock(self.product, self.variants[0]), 120)
+        self.assertEqual(Purchase.objects.get(pk=response.json()['ids'][0]).total, Decimal('6.00'))
+
+    def test_bulk_receive_is_all_or_nothing(self):
+        lines = [self.line(variant) for variant in self.variants[:3]]
+        lines.append(dict(self.line(self.variants[3]), supplier=999999))
+        response = self.client.post('/api/purchases/bulk/', lines, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 0)
+
+    def test_single_purchase_adds_stock_once(self):
+        response = self.client.post('/api/purchases/', self.line(self.variants[0], quantity=7), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 7)
+
+
+class BarcodeAllocationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('barcode', 'barcode@example.com', 'secret'))
+        self.category = Category.objects.create(name='Shirts')
+
+    def test_bulk_product_creation_reserves_barcodes_once(self):
+        first = Product.objects.create(name='Existing')
+        payload = [{'name': f'Product {i}', 'category_id': self.category.pk} for i in range(25)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/products/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        reservations = [query for query in queries if 'UPDATE "barcode_sequence"' in query['sql']]
+        self.assertEqual(len(reservations), 1)
+
+        barcodes = list(Product.objects.exclude(pk=first.pk).order_by('id').values_list('barcode', flat=True))
+        start = int(first.barcode[1:]) + 1
+        self.assertEqual(barcodes, [f"P{str(start + i).zfill(11)}" for i in range(25)])
+
+    def test_sequence_is_created_after_existing_barcodes(self):
+        Product.objects.create(name='Legacy', barcode='P00000000041')
+        BarcodeSequence.objects.all().delete()
+        self.assertEqual(allocate_barcodes(2), ['P00000000042', 'P00000000043'])
+        self.assertEqual(BarcodeSequence.objects.get(name='product').next_value, 44)
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('export', 'export@example.com', 'secret'))
+        supplier = Supplier.objects.create(name='Acme', phone='012', address='Street 1', country='KH')
+        product = Product.objects.create(name='Shirt')
+        variant = ProductVariant.objects.create(product=product, size='M')
+        self.purchases = [
+            Purchase.objects.create(supplier=supplier, product=product, product_variant=variant,
+                                    batch_number=f'B{i}', quantity=2, purchase_price=Decimal('1.50'))
+            for i in range(3)
+        ]
+        Purchase.objects.filter(pk=self.purchases[0].pk).update(purchase_date=timezone.make_aware(datetime(2024, 1, 10, 23, 30)))
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_export_streams_header_and_rows(self):
+        response = self.client.get('/api/exports/purchases/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'purchase_date', 'supplier_id', 'supplier_name'])
+        self.assertEqual(len(lines), 4)
+
+    def test_ndjson_export_filters_by_date_range(self):
+        response = self.client.get('/api/exports/purchases/', {'output': 'ndjson', 'start': '2024-01-10', 'end': '2024-01-10'})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.purchases[0].pk])
+        self.assertEqual(rows[0]['batch_number'], 'B0')
+
+        response = self.client.get('/api/exports/stock-movements/', {'output': 'ndjson', 'start': '2024-01-11'})
+        self.assertEqual(len(self.content(response).splitlines()), 3)
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/exports/purchases/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/purchases/', {'start': '10/01/2024'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/users/').status_code, 404)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('metrics', 'metrics@example.com', 'secret', is_staff=True))
+
+    def test_query_count_header_and_histograms(self):
+        Category.objects.create(name='Shirts')
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response.status_code, 200)
+        # The response cache version and the categories.
+        self.assertEqual(response['X-Query-Count'], '2')
+
+        body = self.client.get('/api/metrics/').content.decode('utf-8')
+        self.assertIn('# TYPE api_request_duration_seconds histogram', body)
+        self.assertIn('api_request_sql_queries_bucket{view="category_list_create",le="2"} 1', body)
+        self.assertIn('api_request_sql_queries_count{view="category_list_create"} 1', body)
+        self.assertIn('api_response_size_bytes_count{view="category_list_create"} 1', body)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_need_staff_or_the_scraper_token(self):
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get('/api/metrics/').status_code, 401)
+        self.assertEqual(anonymous.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(anonymous.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+        user = APIClient()
+        user.force_authenticate(User.objects.create_user('clerk', 'clerk@example.com', 'secret'))
+        self.assertEqual(user.get('/api/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+
+class DatasetAndBenchmarkCommandTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def generate(self, seed=7):
+        call_command(
+            'generate_dataset', seed=seed, scale=0.01, products=500, purchases=5000, invoices=3000, stdout=io.StringIO(),
+        )
+
+    def test_dataset_is_seeded_and_stock_is_consistent(self):
+        self.generate()
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertEqual(Purchase.objects.count(), 50)
+        names = list(Product.objects.order_by('id').values_list('name', flat=True))
+        self.assertEqual(Invoice.objects.count(), InvoiceItem.objects.values('invoice').distinct().count())
+
+        stocks = dict(ProductVariant.objects.values_list('id', 'stock_quantity'))
+        self.assertEqual(ledger.variant_balances(stocks), stocks)
+        self.assertTrue(all(quantity >= 0 for quantity in stocks.values()))
+
+        # Dated over --days, and every sale after the purchases it consumes.
+        purchased = Purchase.objects.values_list('purchase_date', flat=True)
+        self.assertGreater(len({timezone.localdate(moment) for moment in purchased}), 10)
+        self.assertLess(max(purchased), timezone.now())
+        balances = dict.fromkeys(stocks, 0)
+        for movement in StockMovement.objects.order_by('movement_date', 'pk'):
+            balances[movement.product_variant_id] += movement.signed_quantity
+            self.assertGreaterEqual(balances[movement.product_variant_id], 0, movement.movement_date)
+        self.assertEqual(balances, stocks)
+
+        for model in (Product, Category, Customer):
+            model.objects.all().delete()
+        self.generate()
+        self.assertEqual(list(Product.objects.order_by('id').values_list('name', flat=True)), names)
+
+    def test_benchmark_reports_each_endpoint(self):
+        self.generate()
+        out = io.StringIO()
+        call_command('benchmark_endpoints', repeat=2, warmup=0, endpoint=['product_list_create', 'invoice_detail'], stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['endpoints']), {'product_list_create', 'invoice_detail'})
+        for result in report['endpoints'].values():
+            self.assertEqual(result['status'], 200)
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertEqual(report['rows']['Product'], 5)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('cache', 'cache@example.com', 'secret'))
+        self.category = Category.objects.create(name='Shirts')
+        self.product = Product.objects.create(name='Shirt', category=self.category)
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', stock_quantity=5)
+
+    def test_repeated_get_is_served_from_cache(self):
+        first = self.client.get('/api/products/')
+        # Only the namespace version is read.
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/products/')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(REGISTRY.counter('api_response_cache_misses_total', 'products'), 1)
+        self.assertEqual(REGISTRY.counter('api_response_cache_hits_total', 'products'), 1)
+
+        # Query strings are cached separately.
+        self.client.get('/api/products/', {'limit': 1})
+        self.assertEqual(REGISTRY.counter('api_response_cache_misses_total', 'products'), 2)
+
+    def test_model_changes_invalidate_dependent_lists(self):
+        self.client.get('/api/products/')
+        self.client.get('/api/categories/')
+        self.client.get('/api/suppliers/')
+
+        self.category.name = 'Tops'
+        self.category.save()
+        self.assertEqual(self.client.get('/api/categories/').data[0]['name'], 'Tops')
+        self.assertEqual(self.client.get('/api/products/').data[0]['category']['name'], 'Tops')
+        self.assertEqual(REGISTRY.counter('api_response_cache_hits_total', 'suppliers'), 0)
+        self.client.get('/api/suppliers/')
+        self.assertEqual(REGISTRY.counter('api_response_cache_hits_total', 'suppliers'), 1)
+
+        response = self.client.post('/api/categories/', {'name': 'Shoes'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get('/api/categories/').data), 2)
+
+    def test_bulk_stock_updates_invalidate_product_list(self):
+        self.client.get('/api/products/')
+        ProductVariant.decrement_stock({self.variant.pk: 2})
+        self.assertEqual(self.client.get('/api/products/').data[0]['variants'][0]['stock'], 3)
+        ProductVariant.increment_stock({self.variant.pk: 4})
+        self.assertEqual(self.client.get('/api/products/').data[0]['variants'][0]['stock'], 7)
+
+        self.client.post('/api/products/', [{'name': 'Cap', 'category_id': self.category.pk}], format='json')
+        self.assertEqual(len(self.client.get('/api/products/').data), 2)
+
+    def test_versions_are_shared_through_the_database(self):
+        self.client.get('/api/products/')
+        version = ResponseCacheVersion.objects.get(namespace='products').version
+        categories = ResponseCacheVersion.objects.get(namespace='categories').version
+
+        # A rolled-back change leaves the version alone.
+        with transaction.atomic():
+            ProductVariant.objects.filter(pk=self.variant.pk).update(stock_quantity=9)
+            transaction.set_rollback(True)
+        self.assertEqual(ResponseCacheVersion.objects.get(namespace='products').version, version)
+        self.assertEqual(self.client.get('/api/products/').data[0]['variants'][0]['stock'], 5)
+
+        # Raw SQL, as another process or a management command could run, moves the version too.
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE api_productvariant SET stock_quantity = 9 WHERE id = %s', [self.variant.pk])
+        self.assertGreater(ResponseCacheVersion.objects.get(namespace='products').version, version)
+        self.assertEqual(self.client.get('/api/products/').data[0]['variants'][0]['stock'], 9)
+        self.assertEqual(ResponseCacheVersion.objects.get(namespace='categories').version, categories)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('etag', 'etag@example.com', 'secret'))
+        self.product = Product.objects.create(name='Shirt')
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', stock_quantity=5)
+
+    def test_unchanged_detail_returns_304_after_one_query(self):
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.variant.size = 'L'
+        self.variant.save()
+        response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since_on_lists(self):
+        response = self.client.get('/api/variants/')
+        last_modified = response['Last-Modified']
+        self.assertEqual(self.client.get('/api/variants/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(
+            self.client.get('/api/variants/', HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT').status_code, 200
+        )
+
+    def test_invoice_etag_follows_stock_changes(self):
+        customer = Customer.objects.create(first_name='Dara')
+        invoice = Invoice.objects.create(customer=customer, due_date=date.today())
+        etag = self.client.get(f'/api/invoices/{invoice.pk}/')['ETag']
+        self.assertEqual(self.client.get(f'/api/invoices/{invoice.pk}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ProductVariant.decrement_stock({self.variant.pk: 1})
+        self.assertEqual(self.client.get(f'/api/invoices/{invoice.pk}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_writes_ignore_read_validators(self):
+        etag = self.client.get(f'/api/products/{self.product.pk}/')['ETag']
+        Product.objects.filter(pk=self.product.pk).update(name='Tee')
+        self.assertNotEqual(self.client.get(f'/api/products/{self.product.pk}/')['ETag'], etag)
+
+        # A stale If-Match is not checked against the GET validators: the write runs.
+        response = self.client.put(f'/api/products/{self.product.pk}/', {'name': 'Polo'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class InvoiceListingTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('listing', 'listing@example.com', 'secret'))
+        self.dara = Customer.objects.create(first_name='Dara', last_name='Sok')
+        self.vanna = Customer.objects.create(first_name='Vanna')
+        self.invoices = [
+            Invoice.objects.create(customer=customer, status=status_, date=day, due_date=day, total=Decimal(total))
+            for customer, status_, day, total in (
+                (self.dara, 'PAID', date(2024, 1, 5), '30.00'),
+                (self.dara, 'PENDING', date(2024, 2, 5), '10.00'),
+                (self.vanna, 'PAID', date(2024, 3, 5), '20.00'),
+                (self.vanna, 'DRAFT', date(2024, 4, 5), '40.00'),
+            )
+        ]
+
+    def ids(self, response):
+        rows = response.data['results'] if isinstance(response.data, dict) else response.data
+        return [row['id'] for row in rows]
+
+    def test_summary_is_a_single_query(self):
+        # Besides the response cache version.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/invoices/list/', {'view': 'summary'})
+        self.assertEqual(self.ids(response), [invoice.pk for invoice in reversed(self.invoices)])
+        self.assertEqual(response.data[-1]['customer_name'], 'Dara Sok')
+        self.assertEqual(response.data[0]['customer_name'], 'Vanna')
+        self.assertNotIn('items', response.data[0])
+
+    def test_filters(self):
+        paid = self.client.get('/api/invoices/', {'status': 'PAID,PENDING', 'customer': self.dara.pk, 'ordering': '-date'})
+        self.assertEqual(self.ids(paid), [self.invoices[1].pk, self.invoices[0].pk])
+        ranged = self.client.get('/api/invoices/list/', {'view': 'summary', 'start': '2024-02-01', 'end': '2024-03-31'})
+        self.assertEqual(self.ids(ranged), [self.invoices[2].pk, self.invoices[1].pk])
+        self.assertEqual(self.client.get('/api/invoices/list/', {'status': 'LOST'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/', {'ordering': 'notes'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/', {'end': '2024-13-01'}).status_code, 400)
+
+    def test_ordering_with_cursor(self):
+        response = self.client.get('/api/invoices/list/', {'view': 'summary', 'ordering': '-total', 'limit': 3})
+        self.assertEqual(self.ids(response), [self.invoices[i].pk for i in (3, 0, 2)])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.ids(response), [self.invoices[1].pk])
+        self.assertIsNone(response.data['next'])
+
+    def test_cursor_over_null_status(self):
+        unset = [Invoice.objects.create(customer=self.dara, due_date=date(2024, 5, 5)) for _ in range(2)]
+        Invoice.objects.filter(pk__in=[invoice.pk for invoice in unset]).update(status=None)
+        draft, pending = self.invoices[3].pk, self.invoices[1].pk
+        paid = [self.invoices[0].pk, self.invoices[2].pk]
+        nulls = [invoice.pk for invoice in unset]
+        for ordering, expected in (
+            ('status', nulls + [draft] + paid + [pending]),
+            ('-status', [pending] + paid[::-1] + [draft] + nulls[::-1]),
+        ):
+            ids, url = [], None
+            response = self.client.get('/api/invoices/', {'ordering': ordering, 'limit': 1})
+            while True:
+                self.assertEqual(response.status_code, 200, url)
+                ids += self.ids(response)
+                url = response.data['next']
+                if url is None:
+                    break
+                response = self.client.get(url)
+            self.assertEqual(ids, expected, ordering)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('search', 'search@example.com', 'secret'))
+        shoes = Category.objects.create(name='Shoes')
+        self.runner = Product.objects.create(name='Trail Runner', brand='Acme', category=shoes)
+        ProductVariant.objects.create(product=self.runner, size='42', color='Crimson')
+        self.shirt = Product.objects.create(name='Linen Shirt', brand='Runway')
+        ProductVariant.objects.create(product=self.shirt, size='M', color='White')
+
+    def search(self, q):
+        response = self.client.get('/api/products/search/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data]
+
+    def test_search_fields_and_ranking(self):
+        self.assertEqual(self.search('shoes'), [self.runner.pk])
+        self.assertEqual(self.search('crims'), [self.runner.pk])
+        self.assertEqual(self.search('white m'), [self.shirt.pk])
+        self.assertEqual(self.search(self.shirt.barcode), [self.shirt.pk])
+        # A name match ranks above a brand match.
+        self.assertEqual(self.search('run'), [self.runner.pk, self.shirt.pk])
+        self.assertEqual(self.search('"'), [])
+
+    def test_index_follows_bulk_and_queryset_writes(self):
+        Category.objects.filter(name='Shoes').update(name='Footwear')
+        self.assertEqual(self.search('footwear'), [self.runner.pk])
+        self.assertEqual(self.search('shoes'), [])
+        ProductVariant.objects.bulk_create([ProductVariant(product=self.shirt, size='XL', color='Teal')])
+        self.assertEqual(self.search('teal'), [self.shirt.pk])
+        self.shirt.delete()
+        self.assertEqual(self.search('linen'), [])
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM api_product_search")
+        self.assertEqual(self.search('shoes'), [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 products', out.getvalue())
+        # The cached empty result is dropped with the rebuild.
+        self.assertEqual(self.search('shoes'), [self.runner.pk])
+
+    def test_barcode_lookup_is_one_query(self):
+        # Besides the response cache version.
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/barcodes/{self.runner.barcode}/')
+        self.assertEqual(response.data['product']['id'], self.runner.pk)
+        self.assertEqual([variant['color'] for variant in response.data['variants']], ['Crimson'])
+        self.assertEqual(self.client.get('/api/barcodes/000000000000/').status_code, 404)
+
+
+class QueryPlanTests(TestCase):
+    """The hot query shapes are answered from their indexes (SQLite EXPLAIN QUERY PLAN)."""
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+
+    def test_stock_balance_reads_only_the_covering_index(self):
+        movements = StockMovement.objects.filter(product_variant_id=1).order_by()
+        plan = movements.values('product_variant_id').annotate(total=ledger.SIGNED_QUANTITY).explain()
+        self.assertIn('COVERING INDEX stock_movement_variant_idx', plan, plan)
+
+    def test_latest_purchase_price(self):
+        self.assertUsesIndex(
+            ProductVariantSerializer.setup_eager_loading(ProductVariant.objects.all()), 'purchase_variant_date_idx'
+        )
+
+    def test_invoice_listings(self):
+        invoices = Invoice.objects.order_by('-date', '-pk')
+        self.assertUsesIndex(invoices, 'invoice_date_idx')
+        self.assertUsesIndex(invoices.filter(status='PAID'), 'invoice_status_date_idx')
+        self.assertUsesIndex(invoices.filter(customer_id=1, date__gte=date(2024, 1, 1)), 'invoice_customer_date_idx')
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('sales', 'sales@example.com', 'secret'))
+        self.dara = Customer.objects.create(first_name='Dara')
+        self.vanna = Customer.objects.create(first_name='Vanna')
+        self.product = Product.objects.create(name='Shirt')
+        self.small = ProductVariant.objects.create(product=self.product, size='S', stock_quantity=100)
+        self.large = ProductVariant.objects.create(product=self.product, size='L', stock_quantity=100)
+
+    def create_invoice(self, customer, day, lines, **fields):
+        response = self.client.post('/api/invoices/', {
+            'customer_id': customer.pk, 'date': day, 'due_date': day, 'deduct_tax': False,
+            'items': [
+                {'product_id': self.product.pk, 'variant_id': variant.pk, 'quantity': quantity, 'unit_price': '10.00'}
+                for variant, quantity in lines
+            ],
+            **fields,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Invoice.objects.get(pk=response.data['id'])
+
+    def rollups(self):
+        variants = {
+            (row.date.isoformat(), row.product_variant_id): (row.units, row.revenue)
+            for row in DailyVariantSales.objects.all() if row.units
+        }
+        customers = {
+            (row.date.isoformat(), row.customer_id): (row.invoice_count, row.tax, row.revenue)
+            for row in DailyCustomerSales.objects.all() if row.invoice_count
+        }
+        return variants, customers
+
+    def test_rollups_follow_creation_status_changes_and_deletes(self):
+        first = self.create_invoice(self.dara, '2024-01-05', [(self.small, 2), (self.large, 1)], status='PAID')
+        self.create_invoice(self.dara, '2024-01-05', [(self.small, 1)], status='PENDING')
+        self.create_invoice(self.vanna, '2024-02-10', [(self.large, 3)], type='quotation')
+        variants, customers = self.rollups()
+        self.assertEqual(variants, {
+            ('2024-01-05', self.small.pk): (3, Decimal('30.00')),
+            ('2024-01-05', self.large.pk): (1, Decimal('10.00')),
+        })
+        self.assertEqual(customers, {('2024-01-05', self.dara.pk): (2, Decimal('4.00'), Decimal('44.00'))})
+
+        response = self.client.patch(f'/api/invoices/{first.pk}/', {'status': 'CANCELLED'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rollups(), (
+            {('2024-01-05', self.small.pk): (1, Decimal('10.00'))},
+            {('2024-01-05', self.dara.pk): (1, Decimal('1.00'), Decimal('11.00'))},
+        ))
+        self.client.patch(f'/api/invoices/{first.pk}/', {'status': 'PAID'}, format='json')
+        self.assertEqual(self.rollups(), (variants, customers))
+
+        item = first.items.get(variant=self.large)
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.rollups()[0][('2024-01-05', self.large.pk)], (4, Decimal('40.00')))
+
+        first.delete()
+        self.assertEqual(self.rollups()[1], {('2024-01-05', self.dara.pk): (1, Decimal('1.00'), Decimal('11.00'))})
+
+    def test_history_stays_when_the_catalog_shrinks(self):
+        invoice = self.create_invoice(self.dara, '2024-01-05', [(self.small, 2), (self.large, 1)], status='PAID')
+        self.large.delete()
+        self.assertEqual(self.rollups()[0], {
+            ('2024-01-05', self.small.pk): (2, Decimal('20.00')),
+            ('2024-01-05', None): (1, Decimal('10.00')),
+        })
+
+        # The detached line keeps balancing on edits.
+        item = invoice.items.get(variant=None)
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.rollups()[0][('2024-01-05', None)], (3, Decimal('30.00')))
+        self.assertFalse(DailyVariantSales.objects.filter(units__lt=0).exists())
+
+        # Its variants go with the product; the sales stay, under the product.
+        product_id = self.product.pk
+        self.product.delete()
+        self.assertEqual(self.rollups()[0], {('2024-01-05', None): (5, Decimal('50.00'))})
+        self.assertEqual(set(DailyVariantSales.objects.values_list('product_id', flat=True)), {product_id})
+
+        products = self.client.get('/api/analytics/top-products/').data
+        self.assertEqual(
+            [(row['product_id'], row['product_name'], row['units'], row['revenue']) for row in products],
+            [(product_id, None, 5, Decimal('50.00'))],
+        )
+
+    def test_rebuild_matches_incremental_rollups(self):
+        first = self.create_invoice(self.dara, '2024-01-05', [(self.small, 2), (self.large, 1)], status='PAID')
+        self.create_invoice(self.vanna, '2024-01-06', [(self.small, 5)])
+        self.create_invoice(self.vanna, '2024-02-01', [(self.large, 1)], status='DRAFT')
+        self.client.patch(f'/api/invoices/{first.pk}/', {'status': 'PENDING'}, format='json')
+        incremental = self.rollups()
+
+        DailyVariantSales.objects.all().delete()
+        DailyCustomerSales.objects.all().delete()
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_reports_read_only_the_rollups(self):
+        self.create_invoice(self.dara, '2024-01-05', [(self.small, 2)], status='PAID')
+        self.create_invoice(self.vanna, '2024-01-20', [(self.large, 5)], status='PAID')
+        self.create_invoice(self.vanna, '2024-02-01', [(self.small, 1)], status='PAID')
+
+        with CaptureQueriesContext(connection) as queries:
+            months = self.client.get('/api/analytics/sales/', {'period': 'month'}).data
+            products = self.client.get('/api/analytics/top-products/', {'by': 'variant', 'end': '2024-01-31'}).data
+            customers = self.client.get('/api/analytics/top-customers/', {'limit': 1}).data
+        self.assertFalse([query['sql'] for query in queries if 'api_invoice' in query['sql']])
+
+        self.assertEqual([(str(row['period']), row['invoices'], row['revenue']) for row in months], [
+            ('2024-01-01', 2, Decimal('77.00')), ('2024-02-01', 1, Decimal('11.00')),
+        ])
+        self.assertEqual([(row['product_variant_id'], row['units']) for row in products], [(self.large.pk, 5), (self.small.pk, 2)])
+        self.assertEqual([(row['customer_id'], row['revenue']) for row in customers], [(self.vanna.pk, Decimal('66.00'))])
+        self.assertEqual(self.client.get('/api/analytics/sales/', {'period': 'week'}).status_code, 400)
+
+
+class InventoryValuationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('valuation', 'valuation@example.com', 'secret'))
+        self.supplier = Supplier.objects.create(name='Acme', phone='012', address='Street 1', country='KH')
+        self.customer = Customer.objects.create(first_name='Dara')
+        self.product = Product.objects.create(name='Shirt')
+        self.variant = ProductVariant.objects.create(product=self.product, size='M')
+        for batch, price in (('A', '2.00'), ('B', '3.00')):
+            Purchase.objects.create(supplier=self.supplier, product=self.product, product_variant=self.variant,
+                                    batch_number=batch, quantity=10, purchase_price=Decimal(price))
+
+    def sell(self, quantity, unit_price='5.00'):
+        response = self.client.post('/api/invoices/', {
+            'customer_id': self.customer.pk, 'date': '2024-01-05', 'due_date': '2024-01-05',
+            'items': [{'product_id': self.product.pk, 'variant_id': self.variant.pk,
+                       'quantity': quantity, 'unit_price': unit_price}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Invoice.objects.get(pk=response.data['id'])
+
+    def valuation(self):
+        valuation = VariantValuation.objects.get(product_variant=self.variant)
+        return valuation.quantity, valuation.value, valuation.cogs
+
+    def test_fifo_consumes_oldest_layers(self):
+        self.assertEqual(self.valuation(), (20, Decimal('50.0000'), Decimal('0.0000')))
+        invoice = self.sell(15)
+        self.assertEqual(self.valuation(), (5, Decimal('15.0000'), Decimal('35.0000')))
+        self.assertEqual(
+            list(CostLayer.objects.order_by('pk').values_list('batch_number', 'remaining')), [('A', 0), ('B', 5)]
+        )
+
+        margin = self.client.get(f'/api/invoices/{invoice.pk}/margin/').data
+        self.assertEqual((margin['net_sales'], margin['cogs'], margin['margin']), (Decimal('75.00'), Decimal('35.00'), Decimal('40.00')))
+        self.assertEqual(margin['items'][0]['cost'], Decimal('35.00'))
+
+        stock = self.client.get('/api/valuation/warehouses/').data
+        self.assertEqual(stock['total_value'], Decimal('15.00'))
+        self.assertEqual([(row['warehouse_id'], row['quantity']) for row in stock['warehouses']], [(None, 5)])
+
+        # Deleting the invoice returns the units at the cost they were issued at.
+        invoice.delete()
+        self.assertEqual(self.valuation(), (20, Decimal('50.0000'), Decimal('0.0000')))
+
+    def test_removing_a_consumed_purchase_leaves_negative_stock(self):
+        variant = ProductVariant.objects.create(product=self.product, size='L')
+        purchase = Purchase.objects.create(supplier=self.supplier, product=self.product, product_variant=variant,
+                                           batch_number='C', quantity=10, purchase_price=Decimal('2.00'))
+        self.client.post('/api/invoices/', {
+            'customer_id': self.customer.pk, 'date': '2024-01-05', 'due_date': '2024-01-05',
+            'items': [{'product_id': self.product.pk, 'variant_id': variant.pk, 'quantity': 4, 'unit_price': '5.00'}],
+        }, format='json')
+        StockMovement.objects.get(purchase=purchase).delete()
+
+        valuation = VariantValuation.objects.get(product_variant=variant)
+        stock = sum(StockOccupancy.objects.filter(product_variant=variant).values_list('quantity', flat=True))
+        self.assertEqual((stock, valuation.quantity), (-4, -4))
+        self.assertEqual((valuation.value, valuation.cogs), (Decimal('-8.0000'), Decimal('8.0000')))
+        self.assertFalse(CostLayer.objects.filter(product_variant=variant).exists())
+
+    def test_stock_value_is_one_aggregate_query(self):
+        warehouse = Warehouse.objects.create(name='Main', location='PP', capacity=100)
+        # 20 units valued 50.00: 2.50 each, which integer division would round down.
+        StockOccupancy.objects.filter(warehouse=None).update(quantity=17)
+        StockOccupancy.objects.create(warehouse=warehouse, product_variant=self.variant, quantity=3)
+        with self.assertNumQueries(1):
+            stock = valuation.stock_value_by_warehouse()
+        self.assertEqual(
+            [(row['warehouse'], row['quantity'], row['value']) for row in stock['warehouses']],
+            [('Main', 3, Decimal('7.50')), (None, 17, Decimal('42.50'))],
+        )
+        self.assertEqual(stock['total_value'], Decimal('50.00'))
+
+        VariantValuation.objects.filter(product_variant=self.variant).update(quantity=0, value=0, last_unit_cost=Decimal('1.25'))
+        self.assertEqual(valuation.stock_value_by_warehouse()['total_value'], Decimal('25.00'))
+
+    @override_settings(INVENTORY_VALUATION_METHOD='average')
+    def test_weighted_average(self):
+        self.sell(15)
+        self.assertEqual(self.valuation(), (5, Decimal('12.5000'), Decimal('37.5000')))
+
+    def test_rebuild_replays_the_history(self):
+        self.sell(4)
+        self.sell(8)
+        incremental = self.valuation()
+        costs = list(StockMovement.objects.order_by('pk').values_list('cost', flat=True))
+        call_command('rebuild_valuation', stdout=io.StringIO())
+        self.assertEqual(self.valuation(), incremental)
+        self.assertEqual(list(StockMovement.objects.order_by('pk').values_list('cost', flat=True)), costs)
+        self.assertEqual(incremental, (8, Decimal('24.0000'), Decimal('26.0000')))
+
+
+class LowStockTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('restock', 'restock@example.com', 'secret'))
+        self.product = Product.objects.create(name='Shirt')
+        customer = Customer.objects.create(first_name='Dara')
+        self.fast = ProductVariant.objects.create(product=self.product, size='M', stock_quantity=10)
+        self.slow = ProductVariant.objects.create(product=self.product, size='L', stock_quantity=10)
+        self.manual = ProductVariant.objects.create(product=self.product, size='S', stock_quantity=5, reorder_point=5)
+        self.idle = ProductVariant.objects.create(product=self.product, size='XL', stock_quantity=0)
+        invoice = Invoice.objects.create(customer=customer, status='PAID', date=timezone.localdate(), due_date=date.today())
+        # 60 and 3 units over the 30-day window: 2/day and 0.1/day.
+        for variant, quantity in ((self.fast, 60), (self.slow, 3)):
+            InvoiceItem.objects.create(invoice=invoice, product=self.product, variant=variant,
+                                       quantity=quantity, unit_price=Decimal('5.00'))
+
+    def test_flags_variants_below_their_reorder_point(self):
+        with self.assertNumQueries(4):
+            data = self.client.get('/api/variants/low-stock/').data
+        self.assertEqual(data['count'], 2)
+        fast, manual = data['results']
+        self.assertEqual((fast['variant_id'], fast['reorder_point'], fast['reorder_point_source']), (self.fast.pk, 14, 'velocity'))
+        self.assertEqual((fast['daily_velocity'], fast['days_of_cover']), (2.0, 5.0))
+        self.assertEqual((manual['variant_id'], manual['reorder_point_source'], manual['days_of_cover']), (self.manual.pk, 'variant', None))
+
+        ProductVariant.objects.filter(pk=self.slow.pk).update(reorder_point=20)
+        data = self.client.get('/api/variants/low-stock/', {'limit': 1}).data
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([row['variant_id'] for row in data['results']], [self.fast.pk])
+
+
+class DemandForecastTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('forecast', 'forecast@example.com', 'secret'))
+        self.product = Product.objects.create(name='Shirt')
+        self.steady = ProductVariant.objects.create(product=self.product, size='M')
+        self.weekly = ProductVariant.objects.create(product=self.product, size='L')
+        self.idle = ProductVariant.objects.create(product=self.product, size='XL')
+        self.today = timezone.localdate()
+        rows = []
+        for days_ago in range(1, 57):
+            day = self.today - timedelta(days=days_ago)
+            rows.append(DailyVariantSales(date=day, product=self.product, product_variant=self.steady, units=4))
+            rows.append(DailyVariantSales(date=day, product=self.product, product_variant=self.weekly, units=1 + day.weekday()))
+        DailyVariantSales.objects.bulk_create(rows)
+
+    def test_history_adds_rows_of_the_same_day(self):
+        # The same variant sold under another product on one day: both rows count.
+        other = Product.objects.create(name='Shirt (old listing)')
+        yesterday = self.today - timedelta(days=1)
+        DailyVariantSales.objects.create(date=yesterday, product=other, product_variant=self.steady, units=3)
+        start = yesterday - timedelta(days=1)
+        history = forecasting.load_history(np.array([self.steady.pk, self.weekly.pk]), start, 2)
+        self.assertEqual(history.tolist(), [[4, 7], [1 + start.weekday(), 1 + yesterday.weekday()]])
+
+    def test_fits_the_better_model_per_variant(self):
+        out = io.StringIO()
+        call_command('forecast_demand', '--history-days', '56', '--horizon-days', '14', stdout=out)
+        self.assertIn('for 2 variants', out.getvalue())
+        self.assertFalse(DemandForecast.objects.filter(product_variant=self.idle).exists())
+
+        steady = DemandForecast.objects.get(product_variant=self.steady)
+        self.assertEqual((steady.method, steady.mae, steady.total), ('ses', 0.0, 56.0))
+        weekly = DemandForecast.objects.get(product_variant=self.weekly)
+        self.assertEqual((weekly.method, weekly.mae), ('seasonal_naive', 0.0))
+        expected = [1 + (self.today + timedelta(days=ahead)).weekday() for ahead in range(14)]
+        self.assertEqual(weekly.daily, expected)
+
+        data = self.client.get('/api/forecasts/').data
+        self.assertEqual([row['product_variant_id'] for row in data], [self.steady.pk, self.weekly.pk])
+        response = self.client.get(f'/api/variants/{self.weekly.pk}/forecast/')
+        self.assertEqual(response.data['daily'], expected)
+        self.assertEqual(self.client.get(f'/api/variants/{self.idle.pk}/forecast/').status_code, 404)
+
+    def test_fit_runs_before_the_write_transaction(self):
+        outer = len(connection.atomic_blocks)
+        depths, fit = [], forecasting.fit
+
+        def fit_while_a_variant_is_deleted(history, horizon):
+            depths.append(len(connection.atomic_blocks))
+            self.steady.delete()
+            return fit(history, horizon)
+
+        DemandForecast.objects.create(product_variant=self.idle, method='ses', mae=0, history_days=1,
+                                      horizon_days=1, daily=[1], total=1, generated_on=self.today)
+        with mock.patch('api.forecasting.fit', side_effect=fit_while_a_variant_is_deleted):
+            self.assertEqual(forecasting.forecast_demand(56, 14, today=self.today), 1)
+        self.assertEqual(depths, [outer])
+        self.assertEqual(list(DemandForecast.objects.values_list('product_variant_id', flat=True)), [self.weekly.pk])
+
+
+class AsyncReadViewTests(TransactionTestCase):
+    # gather() reads on other connections, which only see committed rows.
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('async', 'async@example.com', 'secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.warehouse = Warehouse.objects.create(name='Main', location='Phnom Penh', capacity=1000)
+        shelf = Shelf.objects.create(warehouse=self.warehouse, shelf_name='A1', capacity=100)
+        Shelf.objects.create(warehouse=self.warehouse, shelf_name='A2', capacity=100)
+        Warehouse.objects.create(name='Empty', location='Siem Reap', capacity=10)
+        self.product = Product.objects.create(name='Shirt')
+        variant = ProductVariant.objects.create(product=self.product, size='M')
+        StockMovement.objects.create(product=self.product, product_variant=variant, movement_type='IN', quantity=7,
+                                     warehouse=self.warehouse, shelf=shelf)
+
+    def test_async_views_match_the_sync_views(self):
+        for sync_path, async_path in (
+            ('/api/warehouses/', '/api/async/warehouses/'),
+            (f'/api/warehouses/{self.warehouse.pk}/', f'/api/async/warehouses/{self.warehouse.pk}/'),
+            ('/api/shelves/', '/api/async/shelves/'),
+            (f'/api/products/{self.product.pk}/', f'/api/async/products/{self.product.pk}/'),
+        ):
+            response = self.client.get(async_path)
+            self.assertEqual(response.status_code, 200, async_path)
+            self.assertEqual(json.loads(response.content), json.loads(self.client.get(sync_path).content), async_path)
+        detail = self.client.get(f'/api/async/warehouses/{self.warehouse.pk}/')
+        self.assertEqual((detail.json()['shelf_count'], detail.json()['total_quantity']), (2, 7))
+        # The three concurrent sub-queries are counted, on their own connections.
+        self.assertEqual(detail['X-Query-Count'], '3')
+        self.assertEqual(self.client.get('/api/async/warehouses/999/').status_code, 404)
+        self.assertEqual(self.client.post('/api/async/shelves/').status_code, 405)
+
+    async def test_asgi_request_with_token(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/async/shelves/')).status_code, 401)
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        response = await client.get('/api/async/warehouses/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(row['shelf_count'] for row in response.json()), [0, 2])
+        response = await client.get('/api/async/shelves/', headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(response.status_code, 401)
+
+
+class DatabaseProfileTests(TransactionTestCase):
+    # Outside a test transaction: writes are not retried inside an outer atomic() block.
+    def test_production_connections_use_the_pragmas(self):
+        profile = settings.DATABASE_PROFILES['production']
+        production = type(connections['default'])({
+            **connection.settings_dict, **profile,
+            'OPTIONS': {**connection.settings_dict['OPTIONS'], **profile['OPTIONS']},
+        }, alias='production')
+        try:
+            with production.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                cursor.execute('PRAGMA cache_size')
+                self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['cache_size'])
+            self.assertEqual(production.transaction_mode, 'IMMEDIATE')
+        finally:
+            production.close()
+
+    @override_settings(DATABASE_WRITE_RETRIES=2, DATABASE_WRITE_RETRY_BACKOFF=0)
+    def test_locked_writes_are_retried_a_bounded_number_of_times(self):
+        calls = []
+
+        def write(failures, message='database is locked'):
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return 'saved'
+
+        before = REGISTRY.counter('api_database_lock_retries_total', write.__qualname__)
+        self.assertEqual(retry_when_locked(write)(2), 'saved')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(REGISTRY.counter('api_database_lock_retries_total', write.__qualname__) - before, 2)
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            retry_when_locked(write)(3)
+        self.assertEqual(len(calls), 3)
+
+        # Other errors, and writes inside an outer transaction, are not retried.
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            retry_when_locked(write)(1, 'no such table: api_invoice')
+        with self.assertRaises(OperationalError), transaction.atomic():
+            retry_when_locked(write)(5)
+        self.assertEqual(len(calls), 2)
@@ -2,6 +2,7 @@
 from django.urls import path
 from .views import register, get_user, login
 from . import views 
+from . import async_views
 
 urlpatterns = [
     path('api/register/', register, name='register'),
@@ -13,8 +14,13 @@ urlpatterns = [
     path('api/categories/<int:pk>/', views.category_detail, name='category_detail'),
     path('api/products/', views.product_list_create, name='product_list_create'),
     path('api/products/<int:pk>/', views.product_detail, name='product_detail'),
+    path('api/products/search/', views.product_search, name='product_search'),
+    path('api/barcodes/<str:barcode>/', views.barcode_lookup, name='barcode_lookup'),
     path('api/variants/', views.variant_list_create, name='variant_list_create'),
     path('api/variants/<int:pk>/', views.variant_detail, name='variant_detail'),
+    path('api/variants/low-stock/', views.low_stock_variants, name='low_stock_variants'),
+    path('api/variants/<int:pk>/forecast/', views.variant_forecast, name='variant_forecast'),
+    path('api/forecasts/', views.forecast_list, name='forecast_list'),
     path('api/shelves/', views.shelf_list_create, name='shelf_list_create'),
     path('api/shelves/<int:pk>/', views.shelf_detail, name='shelf_detail'),
     path('api/warehouses/', views.warehouse_list_create, name='warehouse_list_create'),
@@ -31,7 +37,21 @@ urlpatterns = [
     path('api/invoices/', views.invoice_list_create, name='invoice_list_create'),
     path('api/invoices/<int:pk>/', views.invoice_detail, name='invoice_detail'),
     path('api/invoices/list/', views.invoice_list, name='invoice-list'),
+    path('api/invoices/<int:pk>/margin/', views.invoice_margin_detail, name='invoice_margin_detail'),
     # Invoice Item (New)
     path('api/invoice-items/<int:pk>/', views.invoice_item_detail, name='invoice_item_detail'),
     path('api/purchases/bulk/', views.BulkPurchaseCreateView.as_view(), name='bulk-purchase-create'),
+    path('api/valuation/warehouses/', views.stock_value, name='stock_value'),
+    # Sales analytics from the daily rollups
+    path('api/analytics/sales/', views.sales_report, name='sales_report'),
+    path('api/analytics/top-products/', views.top_products_report, name='top_products_report'),
+    path('api/analytics/top-customers/', views.top_customers_report, name='top_customers_report'),
+    # Streaming exports: stock-movements, invoices, purchases
+    path('api/exports/<str:dataset>/', views.export_rows, name='export_rows'),
+    path('api/metrics/', views.metrics, name='metrics'),
+    # Async read endpoints for ASGI deployments (same responses as their sync versions)
+    path('api/async/warehouses/', async_views.warehouse_list, name='async_warehouse_list'),
+    path('api/async/warehouses/<int:pk>/', async_views.warehouse_detail, name='async_warehouse_detail'),
+    path('api/async/shelves/', async_views.shelf_list, name='async_shelf_list'),
+    path('api/async/products/<int:pk>/', async_views.product_detail, name='async_product_detail'),
 ]
\ No newline at end of file
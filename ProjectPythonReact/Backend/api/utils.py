@@ -1,21 +1,20 @@
 # api/utils.py
-from django.db.models import Sum
+from .ledger import movement_total, variant_balance, variant_balances
+from .models import StockMovement
 
-def get_current_stock(product, variant=None):
-    # Filter stock movements by product
-    stock_movements = StockMovement.objects.filter(product=product)
 
-    # If a variant is specified, filter by variant as well
+def get_current_stock(product, variant=None, as_of=None):
+    """
+    Stock on hand (IN movements - OUT movements) for a variant, or for all of a
+    product's movements when no variant is given. Pass `as_of` for a historical
+    balance. Variant balances start from the nearest StockCheckpoint.
+    """
     if variant:
-        stock_movements = stock_movements.filter(product_variant=variant)
+        return variant_balance(variant.pk, as_of)
 
-    # Debug
-    print(f"Stock movements for product {product.id}, variant {variant.id if variant else 'None'}: {stock_movements.count()} entries")
-    for movement in stock_movements:
-        print(f" - {movement.movement_type}: {movement.quantity}")
-
-    # Calculate total stock: IN movements - OUT movements
-    in_stock = stock_movements.filter(movement_type='IN').aggregate(total=Sum('quantity'))['total'] or 0
-    out_stock = stock_movements.filter(movement_type='OUT').aggregate(total=Sum('quantity'))['total'] or 0
-
-    return in_stock - out_stock
\ No newline at end of file
+    variant_ids = product.variants.values_list('pk', flat=True)
+    total = sum(variant_balances(variant_ids, as_of).values())
+    # Movements recorded against the product without a variant are not checkpointed.
+    return total + movement_total(
+        StockMovement.objects.filter(product=product, product_variant__isnull=True), as_of
+    )
@@ -0,0 +1,103 @@
+# api/valuation.py
+"""
+Inventory valuation reports.
+
+Stock value and cost of goods sold are kept per variant by VariantValuation.apply
+as movements are written, and each OUT movement stores its cost, so the reports
+below only read those rows; rebuild_valuation() replays the movement history
+once, for data written before the valuation existed.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, FloatField, Sum, When
+from django.db.models.functions import Cast
+
+from .models import CostLayer, InvoiceItem, StockMovement, StockOccupancy, VariantValuation
+
+BATCH_SIZE = 2000
+
+MONEY = Decimal('0.01')
+
+
+def money(value):
+    return (value or Decimal('0')).quantize(MONEY)
+
+
+def stock_value_by_warehouse():
+    """
+    Quantity and value on hand per warehouse, from StockOccupancy and the variants' unit costs,
+    in one aggregate query. The unit cost is VariantValuation.unit_cost, computed in SQL.
+    """
+    valuation = 'product_variant__valuation__'
+    # In floating point: SQLite divides integers (a whole stock value) with integer division.
+    value = Case(
+        When(**{f'{valuation}quantity__gt': 0},
+             then=F('quantity') * F(f'{valuation}value') / Cast(f'{valuation}quantity', FloatField())),
+        default=F('quantity') * Cast(f'{valuation}last_unit_cost', FloatField()),
+        output_field=FloatField(),
+    )
+    rows = StockOccupancy.objects.values('warehouse_id', 'warehouse__name').annotate(
+        total_quantity=Sum('quantity'),
+        total_value=Cast(Sum(value), DecimalField(max_digits=20, decimal_places=4)),
+    ).order_by(F('warehouse_id').asc(nulls_last=True))
+    # Stock moved without a warehouse (e.g. purchases and invoices) is reported under warehouse None.
+    results = [{
+        'warehouse_id': row['warehouse_id'],
+        'warehouse': row['warehouse__name'],
+        'quantity': row['total_quantity'],
+        'value': money(row['total_value']),
+    } for row in rows]
+    return {
+        'method': getattr(settings, 'INVENTORY_VALUATION_METHOD', 'fifo'),
+        'total_value': money(sum((row['value'] for row in results), Decimal('0'))),
+        'warehouses': results,
+    }
+
+
+def invoice_margin(invoice):
+    """Net sales, cost of goods sold and margin of an invoice and of each of its lines."""
+    items = InvoiceItem.objects.filter(invoice=invoice).select_related('product', 'variant').annotate(
+        cost=Sum('stockmovement__cost'),
+    ).order_by('pk')
+    lines = []
+    for item in items:
+        cost = money(item.cost)
+        lines.append({
+            'id': item.pk,
+            'product': item.product.name,
+            'variant_id': item.variant_id,
+            'quantity': item.quantity,
+            'revenue': money(item.total_price),
+            'cost': cost,
+            'margin': money(item.total_price) - cost,
+        })
+    discount = Decimal(str(invoice.overall_discount or 0)) / Decimal('100')
+    net_sales = money(Decimal(str(invoice.subtotal or 0)) * (1 - discount))
+    cogs = sum((line['cost'] for line in lines), Decimal('0'))
+    return {
+        'invoice_id': invoice.pk,
+        'net_sales': net_sales,
+        'cogs': cogs,
+        'margin': net_sales - cogs,
+        'margin_percent': round(float((net_sales - cogs) / net_sales * 100), 2) if net_sales else None,
+        'items': lines,
+    }
+
+
+def rebuild_valuation():
+    """Recompute every cost layer, valuation and movement cost by replaying the movements in order."""
+    with transaction.atomic():
+        CostLayer.objects.all().delete()
+        VariantValuation.objects.all().delete()
+        StockMovement.objects.exclude(cost=None).update(cost=None)
+        movements = StockMovement.objects.filter(product_variant__isnull=False).select_related('purchase').order_by('pk')
+        batch = []
+        for movement in movements.iterator(chunk_size=BATCH_SIZE):
+            batch.append(movement)
+            if len(batch) == BATCH_SIZE:
+                VariantValuation.apply(batch)
+                batch = []
+        VariantValuation.apply(batch)
+    return VariantValuation.objects.count()
@@ -1,15 +1,35 @@
 # api/views.py
 from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import BasePermission, IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from .serializers import RegisterSerializer, UserDetailSerializer, LoginSerializer
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
 from rest_framework import viewsets
-from .models import Supplier, Product, ProductVariant, Category, Warehouse,Shelf,Purchase,StockMovement,Customer,DeliveryMethod,Invoice,InvoiceItem
+from .models import Supplier, Product, ProductVariant, Category, Warehouse,Shelf,Purchase,StockMovement,Customer,DeliveryMethod,Invoice,InvoiceItem,DemandForecast
+from .serializers import requested_expansions, ProductSummarySerializer
 from .serializers import SupplierSerializer, ProductSerializer, ProductVariantSerializer, CategorySerializer, WarehouseSerializer,ShelfSerializer,PurchaseSerializer,StockMovementSerializer,StockMovementSerializer,CustomerSerializer,DeliveryMethodSerializer,InvoiceSerializer, InvoiceItemSerializer
+from .pagination import paginated_list_response
+from .filters import filter_invoices, invoice_ordering, invoice_summaries
+from .search import search_product_ids
+from .analytics import sales_by_period, top_products, top_customers
+from .valuation import stock_value_by_warehouse, invoice_margin
+from .restock import low_stock
+from .forecasting import forecast_values, top_forecasts
+from .exports import EXPORTS, CONTENT_TYPES, parse_date_range, stream_rows
+from .metrics import REGISTRY
+from .cache import cached_get, conditional_get
+from .db import retry_when_locked
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +72,8 @@ def create_supplier(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get('suppliers')
+@cached_get('suppliers')
 def list_suppliers(request):
     suppliers = Supplier.objects.all()
     serializer = SupplierSerializer(suppliers, many=True)
@@ -81,6 +103,8 @@ def supplier_detail(request, pk):
 # Category Views
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@conditional_get('categories')
+@cached_get('categories')
 def category_list_create(request):
     if request.method == 'GET':
         categories = Category.objects.all()
@@ -117,13 +141,15 @@ def category_detail(request, pk):
 # Product Views
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@conditional_get('products')
+@cached_get('products')
 def product_list_create(request):
     if request.method == 'GET':
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        products = ProductSerializer.setup_eager_loading(Product.objects.all(), requested_expansions(request))
+        return paginated_list_response(request, products, ProductSerializer, ('-created_at', '-pk'), {'request': request})
     elif request.method == 'POST':
-        serializer = ProductSerializer(data=request.data)
+        # A list of products is created in bulk
+        serializer = ProductSerializer(data=request.data, many=isinstance(request.data, list))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -131,14 +157,18 @@ def product_list_create(request):
 
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@conditional_get('products')
 def product_detail(request, pk):
+    products = Product.objects.all()
+    if request.method == 'GET':
+        products = ProductSerializer.setup_eager_loading(products, requested_expansions(request))
     try:
-        product = Product.objects.get(pk=pk)
+        product = products.get(pk=pk)
     except Product.DoesNotExist:
         return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        serializer = ProductSerializer(product)
+        serializer = ProductSerializer(product, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
     elif request.method == 'PUT':
         serializer = ProductSerializer(product, data=request.data, partial=True)  # Changed to partial=True
@@ -150,14 +180,49 @@ def product_detail(request, pk):
         product.delete()
         return Response({'detail': 'Product deleted'}, status=status.HTTP_204_NO_CONTENT)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products')
+@cached_get('products')
+def product_search(request):
+    """?q= over name, brand, category, barcode and variant size/color, best match first; ?limit= (default 20, max 100)."""
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    ids = search_product_ids(request.query_params.get('q', ''), limit)
+    products = ProductSerializer.setup_eager_loading(Product.objects.filter(pk__in=ids), requested_expansions(request))
+    rank = {pk: position for position, pk in enumerate(ids)}
+    products = sorted(products, key=lambda product: rank[product.pk])
+    return Response(ProductSerializer(products, many=True, context={'request': request}).data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products')
+def barcode_lookup(request, barcode):
+    # Point-of-sale scans: the variants of the product with this barcode, in one query on its unique index.
+    variants = list(
+        ProductVariantSerializer.setup_eager_loading(ProductVariant.objects.filter(product__barcode=barcode)).order_by('pk')
+    )
+    if variants:
+        product = variants[0].product
+    else:
+        product = Product.objects.filter(barcode=barcode).first()
+        if product is None:
+            return Response({'detail': 'No product with this barcode'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'product': ProductSummarySerializer(product).data,
+        'variants': ProductVariantSerializer(variants, many=True).data,
+    })
+
 # Product Variant Views
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@conditional_get('products')
 def variant_list_create(request):
     if request.method == 'GET':
-        variants = ProductVariant.objects.all()
-        serializer = ProductVariantSerializer(variants, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        variants = ProductVariantSerializer.setup_eager_loading(ProductVariant.objects.all(), requested_expansions(request))
+        return paginated_list_response(request, variants, ProductVariantSerializer, ('-pk',), {'request': request})
     elif request.method == 'POST':
         serializer = ProductVariantSerializer(data=request.data)
         if serializer.is_valid():
@@ -167,14 +232,18 @@ def variant_list_create(request):
 
 @api_view(['GET', 'PUT', 'DELETE'])  # Changed PATCH to PUT
 @permission_classes([IsAuthenticated])
+@conditional_get('products')
 def variant_detail(request, pk):
+    variants = ProductVariant.objects.all()
+    if request.method == 'GET':
+        variants = ProductVariantSerializer.setup_eager_loading(variants, requested_expansions(request))
     try:
-        variant = ProductVariant.objects.get(pk=pk)
+        variant = variants.get(pk=pk)
     except ProductVariant.DoesNotExist:
         return Response({'detail': 'Variant not found'}, status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        serializer = ProductVariantSerializer(variant)
+        serializer = ProductVariantSerializer(variant, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
     elif request.method == 'PUT':  # Changed to PUT
         serializer = ProductVariantSerializer(variant, data=request.data, partial=True)  # Added partial=True
@@ -186,12 +255,36 @@ def variant_detail(request, pk):
         variant.delete()
         return Response({'detail': 'Variant deleted'}, status=status.HTTP_204_NO_CONTENT)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products', 'invoices')
+def low_stock_variants(request):
+    """Variants at or below their reorder point with their days of cover, fewest first; ?limit= (default 100)."""
+    return Response(low_stock(request.query_params))
+
+# Demand forecasts (fitted by `manage.py forecast_demand`, see api/forecasting.py)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products', 'forecasts')
+def forecast_list(request):
+    """Variants with the highest forecast demand first; ?limit= (default 100)."""
+    return Response(top_forecasts(request.query_params))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products', 'forecasts')
+def variant_forecast(request, pk):
+    forecast = forecast_values(DemandForecast.objects.filter(product_variant_id=pk)).first()
+    if forecast is None:
+        return Response({'detail': 'No forecast for this variant'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(forecast)
+
 # Warehouse Views (unchanged, just for reference)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def warehouse_list_create(request):
     if request.method == 'GET':
-        warehouses = Warehouse.objects.all()
+        warehouses = WarehouseSerializer.setup_eager_loading(Warehouse.objects.all())
         serializer = WarehouseSerializer(warehouses, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     elif request.method == 'POST':
@@ -204,8 +297,11 @@ def warehouse_list_create(request):
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def warehouse_detail(request, pk):
+    warehouses = Warehouse.objects.all()
+    if request.method == 'GET':
+        warehouses = WarehouseSerializer.setup_eager_loading(warehouses)
     try:
-        warehouse = Warehouse.objects.get(pk=pk)
+        warehouse = warehouses.get(pk=pk)
     except Warehouse.DoesNotExist:
         return Response({'detail': 'Warehouse not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -227,7 +323,7 @@ def warehouse_detail(request, pk):
 @permission_classes([IsAuthenticated])
 def shelf_list_create(request):
     if request.method == 'GET':
-        shelves = Shelf.objects.all()
+        shelves = ShelfSerializer.setup_eager_loading(Shelf.objects.all())
         serializer = ShelfSerializer(shelves, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     elif request.method == 'POST':
@@ -240,8 +336,11 @@ def shelf_list_create(request):
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def shelf_detail(request, pk):
+    shelves = Shelf.objects.all()
+    if request.method == 'GET':
+        shelves = ShelfSerializer.setup_eager_loading(shelves)
     try:
-        shelf = Shelf.objects.get(pk=pk)
+        shelf = shelves.get(pk=pk)
     except Shelf.DoesNotExist:
         return Response({'detail': 'Shelf not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -263,8 +362,7 @@ def shelf_detail(request, pk):
 def purchase_list(request):
     if request.method == 'GET':
         purchases = Purchase.objects.all()
-        serializer = PurchaseSerializer(purchases, many=True)
-        return Response(serializer.data)
+        return paginated_list_response(request, purchases, PurchaseSerializer, ('-purchase_date', '-pk'))
     elif request.method == 'POST':
         serializer = PurchaseSerializer(data=request.data)
         if serializer.is_valid():
@@ -272,14 +370,32 @@ def purchase_list(request):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def receive_purchases(data):
+    """Validate and bulk-insert a list of purchase lines all-or-nothing, reporting throughput."""
+    if not isinstance(data, list):
+        return Response({"detail": "Expected a list of purchase data."}, status=status.HTTP_400_BAD_REQUEST)
+
+    started = time.monotonic()
+    serializer = PurchaseSerializer(data=data, many=True)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    retry_when_locked(serializer.save)()
+    elapsed = time.monotonic() - started
+    rate = len(data) / elapsed if elapsed > 0 else float(len(data))
+    logger.info(f"Received {len(data)} purchase lines in {elapsed:.3f}s ({rate:.0f} rows/s)")
+
+    # Re-serializing tens of thousands of rows would dominate the request, so only summarise.
+    return Response({
+        'created': len(serializer.instance),
+        'ids': [purchase.id for purchase in serializer.instance],
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(rate),
+    }, status=status.HTTP_201_CREATED)
+
 @api_view(['POST'])
 def purchase_bulk_create(request):
     if request.method == 'POST':
-        serializer = PurchaseSerializer(data=request.data, many=True)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return receive_purchases(request.data)
 
 @api_view(['GET', 'PUT', 'DELETE'])
 def purchase_detail(request, pk):
@@ -307,9 +423,11 @@ def purchase_detail(request, pk):
 def stock_movement_list(request):
     try:
         movements = StockMovement.objects.all()
-        serializer = StockMovementSerializer(movements, many=True)
+        response = paginated_list_response(request, movements, StockMovementSerializer, ('-movement_date', '-pk'))
         logger.info(f"User {request.user.username} retrieved list of stock movements")
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return response
+    except NotFound:
+        raise
     except Exception as e:
         logger.error(f"User {request.user.username} encountered an error while retrieving stock movements: {str(e)}", exc_info=True)
         return Response({'detail': f'Error retrieving stock movements: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -343,11 +461,11 @@ def stock_movement_detail(request, pk):
 # Customer Views (New)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@conditional_get('customers')
 def customer_list_create(request):
     if request.method == 'GET':
         customers = Customer.objects.all()
-        serializer = CustomerSerializer(customers, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginated_list_response(request, customers, CustomerSerializer, ('-registration_date', '-pk'))
     elif request.method == 'POST':
         serializer = CustomerSerializer(data=request.data)
         if serializer.is_valid():
@@ -379,6 +497,8 @@ def customer_detail(request, pk):
 # Delivery Method Views (New)
 @api_view(['GET', 'POST'])
 # @permission_classes([IsAuthenticated])
+@conditional_get('delivery_methods')
+@cached_get('delivery_methods')
 def delivery_method_list_create(request):
     if request.method == 'GET':
         delivery_methods = DeliveryMethod.objects.all()
@@ -413,17 +533,31 @@ def delivery_method_detail(request, pk):
         return Response({'detail': 'Delivery method deleted'}, status=status.HTTP_204_NO_CONTENT)
 
 # Invoice Views (New)
+def invoice_list_response(request):
+    """
+    Invoice listing shared by invoice_list and invoice_list_create: filtered by api/filters.py,
+    ordered with ?ordering=, and sent as flat rows with ?view=summary.
+    """
+    invoices = filter_invoices(Invoice.objects.all(), request.query_params)
+    ordering = invoice_ordering(request.query_params)
+    summary = request.query_params.get('view') == 'summary'
+    if summary or 'ordering' in request.query_params:
+        invoices = invoices.order_by(*ordering)
+    if summary:
+        return paginated_list_response(request, invoice_summaries(invoices), None, ordering)
+    invoices = InvoiceSerializer.setup_eager_loading(invoices, requested_expansions(request))
+    return paginated_list_response(request, invoices, InvoiceSerializer, ordering, {'request': request})
+
 @api_view(['GET', 'POST'])
+@conditional_get('invoices', 'products')
 def invoice_list_create(request):
     if request.method == 'GET':
-        invoices = Invoice.objects.all()
-        serializer = InvoiceSerializer(invoices, many=True)
-        return Response(serializer.data)
+        return invoice_list_response(request)
 
     elif request.method == 'POST':
         serializer = InvoiceSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            retry_when_locked(serializer.save)()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         logger.error(f"Invoice creation failed: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -458,14 +592,15 @@ def invoice_item_detail(request, pk):
 # Invoice Views (New)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@conditional_get('invoices', 'products')
 def invoice_list(request):
     if request.method == 'GET':
         try:
-            invoices = Invoice.objects.all()
-            logger.debug(f"Queried invoices: {invoices.count()} found")
-            serializer = InvoiceSerializer(invoices, many=True)
+            response = invoice_list_response(request)
             logger.info(f"User {request.user.username} retrieved list of invoices")
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return response
+        except (NotFound, ValidationError):
+            raise
         except Exception as e:
             logger.error(f"User {request.user.username} encountered an error while retrieving invoices: {str(e)}", exc_info=True)
             return Response({'detail': f'Error retrieving invoices: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -485,15 +620,19 @@ def invoice_list(request):
 
 @api_view(['GET', 'PATCH', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@conditional_get('invoices', 'products')
 def invoice_detail(request, pk):
+    invoices = Invoice.objects.all()
+    if request.method == 'GET':
+        invoices = InvoiceSerializer.setup_eager_loading(invoices, requested_expansions(request))
     try:
-        invoice = Invoice.objects.get(pk=pk)
+        invoice = invoices.get(pk=pk)
     except Invoice.DoesNotExist:
         logger.error(f"User {request.user.username} attempted to access non-existent invoice {pk}")
         return Response({'detail': 'Invoice not found'}, status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        serializer = InvoiceSerializer(invoice)
+        serializer = InvoiceSerializer(invoice, context={'request': request})
         logger.info(f"User {request.user.username} retrieved invoice {pk}")
         return Response(serializer.data, status=status.HTTP_200_OK)
     elif request.method == 'PATCH':
@@ -539,16 +678,94 @@ class StockMovementViewSet(viewsets.ModelViewSet):
 class BulkPurchaseCreateView(APIView):
     def post(self, request, *args, **kwargs):
         # Handle bulk purchase creation
-        if not isinstance(request.data, list):
-            return Response({"detail": "Expected a list of purchase data."}, status=status.HTTP_400_BAD_REQUEST)
+        return receive_purchases(request.data)
 
-        created_purchases = []
-        for purchase_data in request.data:
-            serializer = PurchaseSerializer(data=purchase_data)
-            if serializer.is_valid():
-                serializer.save()
-                created_purchases.append(serializer.data)
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(created_purchases, status=status.HTTP_201_CREATED)
\ No newline at end of file
+# Inventory valuation (maintained per variant, see api/valuation.py)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products', 'invoices')
+def stock_value(request):
+    return Response(stock_value_by_warehouse())
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('products', 'invoices')
+def invoice_margin_detail(request, pk):
+    try:
+        invoice = Invoice.objects.get(pk=pk)
+    except Invoice.DoesNotExist:
+        return Response({'detail': 'Invoice not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(invoice_margin(invoice))
+
+# Sales analytics (read from the daily rollups, see api/analytics.py)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('invoices')
+def sales_report(request):
+    """?period=day|month&start=&end=: invoices, subtotal, tax collected and revenue per period."""
+    return Response(sales_by_period(request.query_params))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('invoices')
+def top_products_report(request):
+    """?by=product|variant&start=&end=&limit=: units sold and revenue, best sellers first."""
+    return Response(top_products(request.query_params))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_get('invoices')
+def top_customers_report(request):
+    """?start=&end=&limit=: invoices, tax and revenue per customer, biggest first."""
+    return Response(top_customers(request.query_params))
+
+
+# Streaming exports
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_rows(request, dataset):
+    """
+    Stream a dataset as CSV (default) or NDJSON: ?output=csv|ndjson&start=YYYY-MM-DD&end=YYYY-MM-DD.
+    Rows are written as they are read from the database, so memory use does not grow with the export.
+    """
+    if dataset not in EXPORTS:
+        return Response({'detail': f'Unknown export: {dataset}'}, status=status.HTTP_404_NOT_FOUND)
+    output = request.query_params.get('output', 'csv')
+    if output not in CONTENT_TYPES:
+        return Response({'detail': 'output must be one of: csv, ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start, end = parse_date_range(request.query_params.get('start'), request.query_params.get('end'))
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(stream_rows(dataset, output, start, end), content_type=CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{output}"'
+    logger.info(f"User {request.user.username} exported {dataset} as {output} (start={start}, end={end})")
+    return response
+
+
+# Metrics
+class MetricsTokenAuthentication(BaseAuthentication):
+    """`Authorization: Bearer <settings.METRICS_TOKEN>`, the static credentials of the Prometheus scraper."""
+    def authenticate(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+            return AnonymousUser(), self
+        return None
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="metrics"'
+
+
+class CanReadMetrics(BasePermission):
+    """The scraper's token, or a staff user."""
+    def has_permission(self, request, view):
+        return isinstance(request.auth, MetricsTokenAuthentication) or bool(request.user and request.user.is_staff)
+
+
+@api_view(['GET'])
+@authentication_classes([MetricsTokenAuthentication, JWTAuthentication])
+@permission_classes([CanReadMetrics])
+def metrics(request):
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -51,6 +51,7 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',  # Per-view timing and SQL metrics (/api/metrics/)
     'corsheaders.middleware.CorsMiddleware',  # Add this line
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -68,6 +69,35 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
 }
+# Bearer token of the Prometheus scraper on /api/metrics/ (staff users can read it too); unset: staff only
+METRICS_TOKEN = os.environ.get('DJANGO_METRICS_TOKEN', '')
+# Keyset pagination for list endpoints (?limit=&cursor=)
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+# Bulk purchase receiving accepts tens of thousands of lines per request
+DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024
+# Send X-Query-Count with every response (see api.middleware.RequestMetricsMiddleware)
+API_QUERY_COUNT_HEADER = True
+# Cost of goods sold and stock value (api.models.VariantValuation): 'fifo' or 'average' (weighted average)
+INVENTORY_VALUATION_METHOD = 'fifo'
+# Low-stock scan (api/restock.py): sales velocity is averaged over the trailing window, and variants
+# without a reorder point are restocked when their stock covers less than the lead time.
+RESTOCK_SALES_WINDOW_DAYS = 30
+RESTOCK_LEAD_TIME_DAYS = 7
+# Cached GET responses of the catalog list endpoints (api/cache.py), invalidated by model signals.
+# The namespace versions in the cache keys are stored in the database, so a per-process cache stays
+# correct with several worker processes; TIMEOUT bounds how long an entry can outlive its version.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+}
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -112,12 +142,45 @@ LOGGING = {
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Django's defaults unless DJANGO_DATABASE_PROFILE=production, which deployments set for SQLite tuned
+# for concurrent requests. WAL is a property of the database file: the first production connection
+# switches it, and creates the db.sqlite3-wal and -shm files next to it.
+# - WAL: readers never wait for the writer. synchronous=NORMAL syncs at checkpoints instead of on
+#   every commit (a power loss can lose the last commits but cannot corrupt the database).
+# - mmap_size / cache_size: 256 MB memory-mapped reads and a 64 MB page cache per connection.
+# - transaction_mode=IMMEDIATE: atomic() blocks take the write lock at BEGIN and wait up to `timeout`
+#   seconds for it; writes that still time out are retried by api.db.retry_when_locked.
+# - Persistent connections run the pragmas once and are health-checked before reuse.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative: KiB
+}
+DATABASE_PROFILES = {
+    'basic': {},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,
+        },
+    },
+}
+DATABASE_PROFILE = os.environ.get('DJANGO_DATABASE_PROFILE', 'basic')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **DATABASE_PROFILES[DATABASE_PROFILE],
     }
 }
+# Retries of a write that timed out waiting for the SQLite write lock, and the first backoff in seconds
+DATABASE_WRITE_RETRIES = 3
+DATABASE_WRITE_RETRY_BACKOFF = 0.05
 
 
 # Password validation